@@ -29,8 +29,14 @@
 #include <math.h>
 #include <string.h>
 #include <unistd.h>
+#include <fcntl.h>
+#include <stdint.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 #include <sstream>
 #include <ctime>
+#include <vector>
+#include <algorithm>
 #include <boost/numeric/ublas/io.hpp>
 #include <boost/numeric/ublas/matrix.hpp>
 #include <boost/numeric/ublas/matrix_proxy.hpp>
@@ -65,6 +71,17 @@
 #define USEINRBF_DEBT_WITHDRAWAL 1.
 #define USEINRBF_POWER_WITHDRAWAL 1.
 #define USEINRBF_CASHIN_WITHDRAWAL 1.
+#define MAX_DEBT_QUANTILE_MODE 0          // 0: q95(max debt) from boost tail_quantile, caching every sample (exact); 1: streaming quantile sketch, fixed memory for any NUM_SAMPLES (relative error <= QUANTILE_SKETCH_ACCURACY)
+#define QUANTILE_SKETCH_ACCURACY 0.0005   // MAX_DEBT_QUANTILE_MODE==1 only: relative accuracy of max debt quantile sketch
+#define QUANTILE_SKETCH_MIN_VALUE 0.001   // MAX_DEBT_QUANTILE_MODE==1 only: max debt values <= this ($M) counted as zero
+#define QUANTILE_SKETCH_MAX_VALUE 10000.0 // MAX_DEBT_QUANTILE_MODE==1 only: max debt values above this ($M) counted in top bucket
+#define INSTRUMENTATION 0                 // 1: time stages of portfolioProblem & count samples, writing csv profile (columns as functions_instrumentation.py; per policy for retest) to <retest_file>.instrumentation.csv or <write_directory>instrumentation_pid<pid>.csv. 0: no cost
+#define SAMPLE_PLAN_MODE 0                // 0: lines_to_use from srand(seed_sample)/rand(); 1: read from sample_plan_seedS<seed_sample>.bin in read_directory (written by functions_policy_evaluation.get_sample_plan; same values), falling back to rand() if missing or mismatched
+#define ESTIMATOR_ANTITHETIC 0            // 1: first NUM_SAMPLES/2 lines_to_use simulated on synthetic data & on its antithetic twin (synthetic_data_antithetic.bin/.txt in read_directory, from make_synthetic_data_streaming.py with antithetic 1), mean objectives averaged over pairs (as functions_policy_evaluation.evaluate_objectives_estimator). 0: NUM_SAMPLES lines of synthetic data
+#define ESTIMATOR_CONTROL_VARIATE 0       // 1: cashflow objectives (annualized & min cashflow) adjusted with control variate: unhedged annualized net revenue of each sample, whose expectation over uniformly sampled windows is computed exactly from synthetic data (hedging frequency & max fund stay plain means). 0: plain sample means
+#define ESTIMATOR_CONTROL_MIN_VARIANCE 1e-4 // ESTIMATOR_CONTROL_VARIATE==1 only: control variate unused (beta 0) if its variance is below this fraction of the objective's (nearly constant control, where beta blows up)
+#define ESTIMATOR_BATCHES 20              // batches of samples for estimator variance of q95 max debt (estimator variance of each objective written to <retest_file>.variance by BORG_RUN_TYPE 0)
+#define SYNTHETIC_DATA_MODE 1             // 0: parse synthetic_data.txt; 1: memory-map synthetic_data.bin in read_directory (written by functions_stochastic_inputs.save_synthetic_data_binary; pages shared by all processes on a node), falling back to synthetic_data.txt if missing, mismatched or older than it
 
 // Constants not to be changed
 #define NUM_DECISIONS_TOTAL 2             // each year, have to choose value snow contract + withdrawal
@@ -73,6 +90,14 @@
 #define INDEX_STOCHASTIC_REVENUE 0        // revenue in first column
 #define INDEX_STOCHASTIC_SNOW_PAYOUT 1    // snow contract payout in 2nd column
 #define INDEX_STOCHASTIC_POWER_INDEX 2    // power price index in 3rd column
+#define NUM_STOCHASTIC_SOURCES (1 + ESTIMATOR_ANTITHETIC) // synthetic data, and its antithetic twin if ESTIMATOR_ANTITHETIC 1
+#define SAMPLE_PLAN_MAGIC 1314014032      // sample plan file header: int32 magic ('PCRN'), version, seed_sample, num_samples, num_lines_stochastic_input, num_years, 2 unused
+#define SAMPLE_PLAN_VERSION 1
+#define SAMPLE_PLAN_HEADER_SIZE 8
+#define SYNTHETIC_DATA_MAGIC 1145985363   // binary synthetic data header: int64 magic ('SYND'), version, data offset, num rows, num columns, provenance offset & size, 1 unused. Then per column: name, numpy dtype (8 chars) & int64 file offset of contiguous column
+#define SYNTHETIC_DATA_VERSION 1
+#define SYNTHETIC_DATA_HEADER_SIZE 8
+#define SYNTHETIC_DATA_NAME_SIZE 32
 #define MEAN_REVENUE 127.80086602479503   // mean revenue in absense of any financial risk mgmt
 #define NORMALIZE_SNOW_CONTRACT_SIZE 4.0
 #define NORMALIZE_REVENUE 250.0
@@ -111,6 +136,10 @@
 #define MIN_SNOW_CONTRACT 0.05 // DPS_RUN_TYPE==0 only: if contract slope dv < $0.05M/inch, act as if 0.
 #define MIN_MAX_FUND 0.05      // DPS_RUN_TYPE==0 only: if max fund dv < $0.05M, act as if 0.
 
+#if (ESTIMATOR_ANTITHETIC == 1) && (NUM_SAMPLES % 2 != 0)
+#error "ESTIMATOR_ANTITHETIC needs an even NUM_SAMPLES (antithetic pairs)"
+#endif
+
 namespace ublas = boost::numeric::ublas;
 namespace tools = boost::math::tools;
 namespace accumulator = boost::accumulators;
@@ -128,8 +157,40 @@ double policySnowContractValue(const double f_fund_balance, const double f_debt,
 double policyWithdrawal_2dv(const double f_fund_balance, const double f_cash_in, const double f_max_fund_size);
 double policySnowContractValue_2dv(const double f_value);
 double policyMaxFund_2dv(const double f_value);
+#if (DPS_RUN_TYPE < 2) && (MAX_DEBT_QUANTILE_MODE == 1)
+int quantileSketchSize();
+void quantileSketchAdd(std::vector<long> &f_counts, const double f_value);
+double quantileSketchUpperQuantile(const std::vector<long> &f_counts, const double f_probability);
+#endif
+#if SAMPLE_PLAN_MODE == 1
+int readSamplePlan(const string &f_directory, const unsigned int f_seed_sample);
+#endif
+#if SYNTHETIC_DATA_MODE == 1
+int mapSyntheticData(const string &f_directory, const string &f_name, const int f_source);
+#endif
+double estimatorMean(const ublas::vector<double> &f_values, double &f_variance, const bool f_use_control);
+#if DPS_RUN_TYPE < 2
+double estimatorTailQuantileVariance(const ublas::vector<double> &f_values);
+#endif
+#if ESTIMATOR_CONTROL_VARIATE == 1
+void setRevenueWindowMeans();
+#endif
+#if INSTRUMENTATION == 1
+double instrumentationClock();
+void instrumentationRecord(const int f_stage, const double f_seconds, const long f_items);
+void instrumentationWrite(const string &f_policy);
+#endif
+
+double stochastic_input[NUM_STOCHASTIC_SOURCES][NUM_LINES_STOCHASTIC_INPUT][NUM_VARIABLES_STOCHASTIC_INPUT]; // Stochastic variables, for synthetic data (& antithetic twin)
+const double *stochastic_columns[NUM_STOCHASTIC_SOURCES][NUM_VARIABLES_STOCHASTIC_INPUT];                    // Stochastic variable columns: in stochastic_input (row stride NUM_VARIABLES_STOCHASTIC_INPUT), or mapped synthetic_data.bin (row stride 1)
+int stochastic_row_stride[NUM_STOCHASTIC_SOURCES];
+const char *stochastic_source_names[2] = {"synthetic_data", "synthetic_data_antithetic"}; // file names (.bin/.txt) of sources in read_directory
 
-double stochastic_input[NUM_LINES_STOCHASTIC_INPUT][NUM_VARIABLES_STOCHASTIC_INPUT]; // Stochastic variables
+// stochastic variable f_variable (INDEX_STOCHASTIC_*) in line f_line of synthetic data f_source (1 = antithetic twin)
+inline double stochasticInput(const int f_source, const int f_line, const int f_variable)
+{
+    return stochastic_columns[f_source][f_variable][(long)f_line * stochastic_row_stride[f_source]];
+}
 double param_LHC_sample[NUM_PARAM][NUM_PARAM_SAMPLES];                               // financial parameters
 #if (BORG_RUN_TYPE == 0)
 double problem_dv[NUM_DV];
@@ -138,6 +199,7 @@ double problem_constraints[NUM_CONSTRAINTS];
 double pareto[NUM_DV + 2 * (NUM_OBJECTIVES + NUM_CONSTRAINTS)][10000];
 double N_pareto = 0;
 #endif
+double problem_objs_variance[NUM_OBJECTIVES]; // estimator variance of each objective from last portfolioProblem
 
 ublas::vector<double> annualized_cashflow(NUM_SAMPLES); // objectives/constraints
 ublas::vector<double> hedge_frequency(NUM_SAMPLES);
@@ -147,6 +209,14 @@ ublas::vector<double> debt_steal(NUM_SAMPLES);
 #else
 ublas::vector<double> min_cashflow(NUM_SAMPLES);
 #endif
+#if DPS_RUN_TYPE < 2
+ublas::vector<double> max_debt(NUM_SAMPLES); // for estimator variance of q95 max debt
+#endif
+#if ESTIMATOR_CONTROL_VARIATE == 1
+ublas::vector<double> control_cashflow(NUM_SAMPLES);                  // control variate: unhedged annualized net revenue of each sample
+double revenue_window_mean[NUM_STOCHASTIC_SOURCES][NUM_YEARS];       // mean revenue in each year of window, over all windows of synthetic data
+double control_mean;                                                  // expectation of control variate
+#endif
 
 ublas::vector<double> revenue(NUM_YEARS);                   // stochastic drivers
 ublas::vector<double> unit_payout_snow_contract(NUM_YEARS); // snow contract net payout
@@ -193,15 +263,39 @@ int NFE_counter = 0;
 unsigned int seed_borg;
 unsigned int seed_sample; // use same seed for each function evaluation, so always comparing same simulations. should be less noisy.
 int lines_to_use[NUM_SAMPLES];
-#if DPS_RUN_TYPE < 2
+#if (DPS_RUN_TYPE < 2) && (MAX_DEBT_QUANTILE_MODE == 0)
 // accumulator object to get 95th percentile of debt for objective
 typedef accumulator::accumulator_set<double, accumulator::stats<accumulator::tag::tail_quantile<accumulator::right> > > accumulator_t;
+#elif DPS_RUN_TYPE < 2
+// bucket counts of streaming quantile sketch to get 95th percentile of debt for objective, size independent of NUM_SAMPLES
+std::vector<long> debt_sketch(quantileSketchSize());
+#endif
+
+#if INSTRUMENTATION == 1
+// profiled stages of portfolioProblem: calls, seconds & items (samples; sample-years of policy decisions for simulate_samples)
+#define NUM_INSTRUMENTATION_STAGES 4
+enum
+{
+    STAGE_PORTFOLIO_PROBLEM,
+    STAGE_DECODE_POLICY,
+    STAGE_SIMULATE_SAMPLES,
+    STAGE_AGGREGATE_OBJECTIVES
+};
+const char *instrumentation_stage_names[NUM_INSTRUMENTATION_STAGES] = {"portfolioProblem", "decode_policy", "simulate_samples", "aggregate_objectives"};
+long instrumentation_calls[NUM_INSTRUMENTATION_STAGES];
+double instrumentation_seconds[NUM_INSTRUMENTATION_STAGES];
+long instrumentation_items[NUM_INSTRUMENTATION_STAGES];
+string instrumentation_file;
+int instrumentation_file_started = 0;
 #endif
 
 // problem for borg search
 void portfolioProblem(double *problem_dv, double *problem_objs, double *problem_constraints)
 {
     NFE_counter += 1;
+#if INSTRUMENTATION == 1
+    double instrumentation_start = instrumentationClock();
+#endif
     //    if ((NFE_counter % 100) == 0){printf("%d\n", NFE_counter);}
     //    printf("%d\n", NFE_counter);
 
@@ -262,9 +356,27 @@ void portfolioProblem(double *problem_dv, double *problem_objs, double *problem_
         discount_normalization += discount_factor(i);
     }
     discount_normalization = 1.0 / discount_normalization;
+#if ESTIMATOR_CONTROL_VARIATE == 1
+    // expectation of control variate (unhedged annualized net revenue) over uniformly sampled windows, averaged over sources
+    control_mean = 0.0;
+    for (int k = 0; k < NUM_STOCHASTIC_SOURCES; k++)
+    {
+        for (int i = 0; i < NUM_YEARS; i++)
+        {
+            control_mean += revenue_window_mean[k][i] * discount_factor(i);
+        }
+    }
+    control_mean = discount_normalization * control_mean / NUM_STOCHASTIC_SOURCES - MEAN_REVENUE * cost_fraction;
+#endif
+#if INSTRUMENTATION == 1
+    double instrumentation_decoded = instrumentationClock();
+    instrumentationRecord(STAGE_DECODE_POLICY, instrumentation_decoded - instrumentation_start, 1);
+#endif
 
-#if DPS_RUN_TYPE < 2
+#if (DPS_RUN_TYPE < 2) && (MAX_DEBT_QUANTILE_MODE == 0)
     accumulator_t debt_q95(accumulator::tag::tail<accumulator::right>::cache_size = NUM_SAMPLES); // accumulator object for calculating upper 5th quantile of debt
+#elif DPS_RUN_TYPE < 2
+    std::fill(debt_sketch.begin(), debt_sketch.end(), 0); // reset quantile sketch for calculating upper 5th quantile of debt
 #endif
 
     double total_payout_snow_contract = 0.;
@@ -273,9 +385,10 @@ void portfolioProblem(double *problem_dv, double *problem_objs, double *problem_
     // run revenue model simulation
     for (int s = 0; s < NUM_SAMPLES; s++)
     {
-        // randomly generated revenues
+        // randomly generated revenues, from synthetic data (or its antithetic twin for odd samples if ESTIMATOR_ANTITHETIC 1)
+        const int source = s % NUM_STOCHASTIC_SOURCES;
 #if NUM_SAMPLES > 1
-        int index = lines_to_use[s];
+        int index = lines_to_use[s / NUM_STOCHASTIC_SOURCES];
 #else
         int index = 1;
 #endif
@@ -283,12 +396,12 @@ void portfolioProblem(double *problem_dv, double *problem_objs, double *problem_
 
         // get the random revenue from the States of the world file
         //each line of SOW file covers 20 years of revenue
-        power_price_index(0) = stochastic_input[index - 1][INDEX_STOCHASTIC_POWER_INDEX];
+        power_price_index(0) = stochasticInput(source, index - 1, INDEX_STOCHASTIC_POWER_INDEX);
         for (int i = 0; i < NUM_YEARS; i++)
         {
-            revenue(i) = (stochastic_input[index + i][INDEX_STOCHASTIC_REVENUE] - MEAN_REVENUE * cost_fraction);
-            unit_payout_snow_contract(i) = stochastic_input[index + i][INDEX_STOCHASTIC_SNOW_PAYOUT];
-            power_price_index(i + 1) = stochastic_input[index + i][INDEX_STOCHASTIC_POWER_INDEX];
+            revenue(i) = (stochasticInput(source, index + i, INDEX_STOCHASTIC_REVENUE) - MEAN_REVENUE * cost_fraction);
+            unit_payout_snow_contract(i) = stochasticInput(source, index + i, INDEX_STOCHASTIC_SNOW_PAYOUT);
+            power_price_index(i + 1) = stochasticInput(source, index + i, INDEX_STOCHASTIC_POWER_INDEX);
             //            printf("%f  %f  %f\n", revenue(i), unit_payout_snow_contract(i), payout_power_contract(i));
         }
 
@@ -350,8 +463,21 @@ void portfolioProblem(double *problem_dv, double *problem_objs, double *problem_
                                   ((fund_balance(NUM_YEARS) * interest_fund * discount_factor(0)) -
                                    (debt(NUM_YEARS) * interest_debt * discount_factor(0))) *
                                       discount_factor(NUM_YEARS - 1));
+#if ESTIMATOR_CONTROL_VARIATE == 1
+        control_cashflow(s) = 0.0;
+        for (int i = 0; i < NUM_YEARS; i++)
+        {
+            control_cashflow(s) += revenue(i) * discount_factor(i);
+        }
+        control_cashflow(s) = discount_normalization * control_cashflow(s);
+#endif
 #if DPS_RUN_TYPE < 2
-        debt_q95(vmax(debt));                                  // for q95(max(debt)) objective
+        max_debt(s) = vmax(debt);
+#if MAX_DEBT_QUANTILE_MODE == 0
+        debt_q95(max_debt(s));                                 // for q95(max(debt)) objective
+#else
+        quantileSketchAdd(debt_sketch, max_debt(s));           // for q95(max(debt)) objective
+#endif
         debt_steal(s) = debt(NUM_YEARS) - debt(NUM_YEARS - 1); // for constraint to ensure that debt use is "sustainable"
 #else
         min_cashflow(s) = vmin(adjusted_revenue);
@@ -360,16 +486,26 @@ void portfolioProblem(double *problem_dv, double *problem_objs, double *problem_
         max_fund_balance(s) = vmax(fund_balance);
     }
 
+#if INSTRUMENTATION == 1
+    double instrumentation_simulated = instrumentationClock();
+    instrumentationRecord(STAGE_SIMULATE_SAMPLES, instrumentation_simulated - instrumentation_decoded, long(NUM_SAMPLES) * NUM_YEARS);
+#endif
+
     // aggregate objectives
-    problem_objs[0] = -1 * vsum(annualized_cashflow) / NUM_SAMPLES; // max: average annualized adjusted_revenue, across samp
+    problem_objs[0] = -1 * estimatorMean(annualized_cashflow, problem_objs_variance[0], true); // max: average annualized adjusted_revenue, across samp
 #if DPS_RUN_TYPE < 2
+#if MAX_DEBT_QUANTILE_MODE == 0
     problem_objs[1] = accumulator::quantile(debt_q95, accumulator::quantile_probability = 0.95); //minimize 95th percentile of max debt
 #else
-    problem_objs[1] = -1 * vsum(min_cashflow) / NUM_SAMPLES;
+    problem_objs[1] = quantileSketchUpperQuantile(debt_sketch, 0.95); //minimize 95th percentile of max debt
+#endif
+    problem_objs_variance[1] = estimatorTailQuantileVariance(max_debt);
+#else
+    problem_objs[1] = -1 * estimatorMean(min_cashflow, problem_objs_variance[1], true);
 #endif
 #if NUM_OBJECTIVES > 2
-    problem_objs[2] = 1 * vsum(hedge_frequency) / NUM_SAMPLES;  // min: avg_avg_hedging complexity
-    problem_objs[3] = 1 * vsum(max_fund_balance) / NUM_SAMPLES; // min: max_fund_balance
+    problem_objs[2] = 1 * estimatorMean(hedge_frequency, problem_objs_variance[2], false);  // min: avg_avg_hedging complexity
+    problem_objs[3] = 1 * estimatorMean(max_fund_balance, problem_objs_variance[3], false); // min: max_fund_balance
 #endif
 
 #if DPS_RUN_TYPE < 2
@@ -378,6 +514,11 @@ void portfolioProblem(double *problem_dv, double *problem_objs, double *problem_
 #endif
 
     //    printf("\n\n\n%f   %f   %f   %f   %f\n\n\n", problem_objs[0], problem_objs[1], problem_objs[2], problem_objs[3], problem_constraints[0]);
+#if INSTRUMENTATION == 1
+    double instrumentation_end = instrumentationClock();
+    instrumentationRecord(STAGE_AGGREGATE_OBJECTIVES, instrumentation_end - instrumentation_simulated, NUM_SAMPLES);
+    instrumentationRecord(STAGE_PORTFOLIO_PROBLEM, instrumentation_end - instrumentation_start, NUM_SAMPLES);
+#endif
 
     annualized_cashflow.clear();
     hedge_frequency.clear();
@@ -425,6 +566,118 @@ void normalizeWeights(ublas::vector<double> &f_dv_w)
     }
 }
 
+// value of sample unit f_unit of per-sample values: mean of antithetic pair (consecutive samples) if ESTIMATOR_ANTITHETIC 1, else sample
+inline double estimatorUnit(const ublas::vector<double> &f_values, const int f_unit)
+{
+#if ESTIMATOR_ANTITHETIC == 1
+    return 0.5 * (f_values(2 * f_unit) + f_values(2 * f_unit + 1));
+#else
+    return f_values(f_unit);
+#endif
+}
+
+// estimate of mean of per-sample values f_values over sample units (antithetic pairs if ESTIMATOR_ANTITHETIC 1), adjusted with
+// control variate control_cashflow (expectation control_mean; beta = cov / var over the same units) if ESTIMATOR_CONTROL_VARIATE 1
+// and f_use_control. Sets f_variance to estimator variance (variance of units, less the part explained by control, over number of units).
+double estimatorMean(const ublas::vector<double> &f_values, double &f_variance, const bool f_use_control)
+{
+    const int num_units = NUM_SAMPLES / NUM_STOCHASTIC_SOURCES;
+    double mean = 0.0;
+    for (int u = 0; u < num_units; u++)
+    {
+        mean += estimatorUnit(f_values, u);
+    }
+    mean = mean / num_units;
+    double sum_sq = 0.0;
+#if ESTIMATOR_CONTROL_VARIATE == 1
+    if (f_use_control)
+    {
+        double control_sample_mean = 0.0;
+        for (int u = 0; u < num_units; u++)
+        {
+            control_sample_mean += estimatorUnit(control_cashflow, u);
+        }
+        control_sample_mean = control_sample_mean / num_units;
+        double control_sum_sq = 0.0;
+        double sum_cross = 0.0;
+        for (int u = 0; u < num_units; u++)
+        {
+            double dy = estimatorUnit(f_values, u) - mean;
+            double dc = estimatorUnit(control_cashflow, u) - control_sample_mean;
+            sum_sq += dy * dy;
+            control_sum_sq += dc * dc;
+            sum_cross += dy * dc;
+        }
+        double beta = (control_sum_sq > ESTIMATOR_CONTROL_MIN_VARIANCE * sum_sq) ? sum_cross / control_sum_sq : 0.0;
+        f_variance = max(0.0, sum_sq - beta * sum_cross) / (num_units - 1) / num_units;
+        return mean - beta * (control_sample_mean - control_mean);
+    }
+#endif
+    for (int u = 0; u < num_units; u++)
+    {
+        double dy = estimatorUnit(f_values, u) - mean;
+        sum_sq += dy * dy;
+    }
+    f_variance = sum_sq / (num_units - 1) / num_units;
+    return mean;
+}
+
+#if DPS_RUN_TYPE < 2
+// estimator variance of q95 of per-sample values f_values (as boost tail_quantile: the ceil(n * 0.05)-th largest of n values), from
+// q95 of each of ESTIMATOR_BATCHES batches of consecutive samples (keeping antithetic pairs together)
+double estimatorTailQuantileVariance(const ublas::vector<double> &f_values)
+{
+    const int num_units = NUM_SAMPLES / NUM_STOCHASTIC_SOURCES;
+    double batch_quantile[ESTIMATOR_BATCHES];
+    double mean = 0.0;
+    std::vector<double> batch;
+    for (int b = 0; b < ESTIMATOR_BATCHES; b++)
+    {
+        batch.clear();
+        for (long s = NUM_STOCHASTIC_SOURCES * ((long)b * num_units / ESTIMATOR_BATCHES); s < NUM_STOCHASTIC_SOURCES * ((long)(b + 1) * num_units / ESTIMATOR_BATCHES); s++)
+        {
+            batch.push_back(f_values(s));
+        }
+        int n = (int)ceil(batch.size() * (1. - 0.95));
+        std::nth_element(batch.begin(), batch.begin() + (n - 1), batch.end(), std::greater<double>());
+        batch_quantile[b] = batch[n - 1];
+        mean += batch_quantile[b];
+    }
+    mean = mean / ESTIMATOR_BATCHES;
+    double sum_sq = 0.0;
+    for (int b = 0; b < ESTIMATOR_BATCHES; b++)
+    {
+        sum_sq += (batch_quantile[b] - mean) * (batch_quantile[b] - mean);
+    }
+    return sum_sq / (ESTIMATOR_BATCHES - 1) / ESTIMATOR_BATCHES;
+}
+#endif
+
+#if ESTIMATOR_CONTROL_VARIATE == 1
+// mean revenue in each year of sample window for each source, over windows starting at lines 1..NUM_LINES_STOCHASTIC_INPUT-NUM_YEARS-1
+// with equal probability (as lines_to_use), from running sums of revenue (as functions_policy_evaluation.get_revenue_window_means)
+void setRevenueWindowMeans()
+{
+    const int num_starts = NUM_LINES_STOCHASTIC_INPUT - NUM_YEARS - 1;
+    for (int k = 0; k < NUM_STOCHASTIC_SOURCES; k++)
+    {
+        double cumulative = 0.0;
+        for (int l = 0; l < num_starts + NUM_YEARS; l++)
+        {
+            cumulative += stochasticInput(k, l, INDEX_STOCHASTIC_REVENUE);
+            if (l < NUM_YEARS)
+            {
+                revenue_window_mean[k][l] = -cumulative;
+            }
+            if (l >= num_starts)
+            {
+                revenue_window_mean[k][l - num_starts] = (revenue_window_mean[k][l - num_starts] + cumulative) / num_starts;
+            }
+        }
+    }
+}
+#endif
+
 // calculate withdrawal (+)/deposit (-) from reserve fund at end of year, using fund balance, power price, and cash flow, and power price index as inputs. This version uses adjusted rev for RBF, then backcalculates withdrawal.
 double policyWithdrawal(const double f_fund_balance, const double f_debt, const double f_power_price_index,
                         const double f_cash_in, const ublas::vector<double> &f_dv_d,
@@ -569,6 +822,218 @@ double policyMaxFund_2dv(const double f_value)
     return value_edit;
 }
 
+#if (DPS_RUN_TYPE < 2) && (MAX_DEBT_QUANTILE_MODE == 1)
+// Streaming quantile sketch for max debt objective (log-spaced buckets, as DDSketch). Bucket k>0 counts values in
+// (min*gamma^(k-1), min*gamma^k], with gamma = (1+a)/(1-a) for a = QUANTILE_SKETCH_ACCURACY, and bucket 0 counts values <= min.
+// The quantile is returned as the midpoint 2*min*gamma^k/(gamma+1) of the bucket holding the requested rank, so its relative
+// error is at most a for quantiles in (QUANTILE_SKETCH_MIN_VALUE, QUANTILE_SKETCH_MAX_VALUE] (up to rounding at bucket edges),
+// and absolute error at most QUANTILE_SKETCH_MIN_VALUE below. Counts from separate sample chunks can be summed, giving exactly
+// the sketch of all samples. Same buckets as get_quantile_sketch in functions_policy_evaluation.py.
+double quantileSketchGamma()
+{
+    return (1. + QUANTILE_SKETCH_ACCURACY) / (1. - QUANTILE_SKETCH_ACCURACY);
+}
+
+// number of buckets in sketch
+int quantileSketchSize()
+{
+    return int(ceil(log(QUANTILE_SKETCH_MAX_VALUE / QUANTILE_SKETCH_MIN_VALUE) / log(quantileSketchGamma()))) + 1;
+}
+
+// add one value to sketch
+void quantileSketchAdd(std::vector<long> &f_counts, const double f_value)
+{
+    int key = 0;
+    if (f_value > QUANTILE_SKETCH_MIN_VALUE)
+    {
+        key = int(ceil(log(f_value / QUANTILE_SKETCH_MIN_VALUE) / log(quantileSketchGamma())));
+        key = min(max(key, 1), int(f_counts.size()) - 1);
+    }
+    f_counts[key] += 1;
+}
+
+// upper quantile from sketch, with same rank as boost tail_quantile<right>: n-th largest value, n = ceil(N * (1 - probability))
+double quantileSketchUpperQuantile(const std::vector<long> &f_counts, const double f_probability)
+{
+    double gamma = quantileSketchGamma();
+    long total = 0;
+    for (int k = 0; k < int(f_counts.size()); k++)
+    {
+        total += f_counts[k];
+    }
+    long n = max(long(ceil(total * (1. - f_probability))), 1L);
+    long cumulative = 0;
+    for (int k = int(f_counts.size()) - 1; k > 0; k--)
+    {
+        cumulative += f_counts[k];
+        if (cumulative >= n)
+        {
+            return 2. * QUANTILE_SKETCH_MIN_VALUE * pow(gamma, k) / (gamma + 1.);
+        }
+    }
+    return 0.;
+}
+#endif
+
+#if SAMPLE_PLAN_MODE == 1
+// read lines_to_use from sample plan file shared with python evaluations (see get_sample_plan in functions_policy_evaluation.py).
+// Returns 1 if read, 0 if file missing, or made for different seed/inputs or with fewer than NUM_SAMPLES samples.
+int readSamplePlan(const string &f_directory, const unsigned int f_seed_sample)
+{
+    std::stringstream filename;
+    filename << f_directory << "sample_plan_seedS" << f_seed_sample << ".bin";
+    FILE *plan_file = fopen(filename.str().c_str(), "rb");
+    if (plan_file == NULL)
+    {
+        return 0;
+    }
+    int header[SAMPLE_PLAN_HEADER_SIZE];
+    int valid = (fread(header, sizeof(int), SAMPLE_PLAN_HEADER_SIZE, plan_file) == SAMPLE_PLAN_HEADER_SIZE);
+    valid = valid && (header[0] == SAMPLE_PLAN_MAGIC) && (header[1] == SAMPLE_PLAN_VERSION) && (header[2] == int(f_seed_sample));
+    valid = valid && (header[3] >= NUM_SAMPLES) && (header[4] == NUM_LINES_STOCHASTIC_INPUT) && (header[5] == NUM_YEARS);
+    valid = valid && (fread(lines_to_use, sizeof(int), NUM_SAMPLES, plan_file) == NUM_SAMPLES);
+    fclose(plan_file);
+    if (!valid)
+    {
+        printf("Sample plan %s not used (mismatched or incomplete), sampling with rand()\n", filename.str().c_str());
+    }
+    return valid;
+}
+#endif
+
+#if SYNTHETIC_DATA_MODE == 1
+// memory-map synthetic_data.bin (or other f_name.bin) in f_directory (read-only & shared, so its pages are shared by all processes on
+// a node), pointing stochastic_columns of source f_source at its revenue, payoutCfd & power columns. Columns stored as float32 (compact
+// precision) are instead converted to double in stochastic_input and unmapped. Returns 0 (nothing used) if missing, mismatched, or
+// older than f_name.txt in f_directory.
+int mapSyntheticData(const string &f_directory, const string &f_name, const int f_source)
+{
+    string filename = f_directory + f_name + ".bin";
+    string text_filename = f_directory + f_name + ".txt";
+    const char *column_names[NUM_VARIABLES_STOCHASTIC_INPUT] = {"revenue", "payoutCfd", "power"}; // in INDEX_STOCHASTIC_* order
+    int fd = open(filename.c_str(), O_RDONLY);
+    if (fd < 0)
+    {
+        return 0;
+    }
+    struct stat file_stat;
+    struct stat text_stat;
+    int64_t header[SYNTHETIC_DATA_HEADER_SIZE];
+    int valid = (fstat(fd, &file_stat) == 0) && (pread(fd, header, sizeof(header), 0) == (ssize_t)sizeof(header));
+    valid = valid && ((stat(text_filename.c_str(), &text_stat) != 0) || (file_stat.st_mtime >= text_stat.st_mtime));
+    valid = valid && (header[0] == SYNTHETIC_DATA_MAGIC) && (header[1] == SYNTHETIC_DATA_VERSION) && (header[3] >= NUM_LINES_STOCHASTIC_INPUT);
+    valid = valid && (8 * SYNTHETIC_DATA_HEADER_SIZE + header[4] * (SYNTHETIC_DATA_NAME_SIZE + 16) <= file_stat.st_size);
+    void *mapped = MAP_FAILED;
+    if (valid)
+    {
+        mapped = mmap(NULL, file_stat.st_size, PROT_READ, MAP_SHARED, fd, 0);
+        valid = (mapped != MAP_FAILED);
+    }
+    close(fd);
+    const char *column_data[NUM_VARIABLES_STOCHASTIC_INPUT];
+    int64_t column_itemsize[NUM_VARIABLES_STOCHASTIC_INPUT];
+    int converted = 0;
+    for (int j = 0; valid && (j < NUM_VARIABLES_STOCHASTIC_INPUT); j++)
+    {
+        // find column by name, as float64 or float32 array of at least NUM_LINES_STOCHASTIC_INPUT rows
+        int found = 0;
+        for (int c = 0; c < header[4]; c++)
+        {
+            const char *descriptor = (const char *)mapped + 8 * SYNTHETIC_DATA_HEADER_SIZE + c * (SYNTHETIC_DATA_NAME_SIZE + 16);
+            int64_t offset;
+            memcpy(&offset, descriptor + SYNTHETIC_DATA_NAME_SIZE + 8, sizeof(offset));
+            int64_t itemsize = (strncmp(descriptor + SYNTHETIC_DATA_NAME_SIZE, "<f8", 8) == 0) ? (int64_t)sizeof(double) : ((strncmp(descriptor + SYNTHETIC_DATA_NAME_SIZE, "<f4", 8) == 0) ? (int64_t)sizeof(float) : 0);
+            if ((strncmp(descriptor, column_names[j], SYNTHETIC_DATA_NAME_SIZE) == 0) && (itemsize > 0) &&
+                (offset % itemsize == 0) && (offset + header[3] * itemsize <= file_stat.st_size))
+            {
+                column_data[j] = (const char *)mapped + offset;
+                column_itemsize[j] = itemsize;
+                converted = converted || (itemsize != (int64_t)sizeof(double));
+                found = 1;
+            }
+        }
+        valid = found;
+    }
+    if (valid && (converted == 0))
+    {
+        for (int j = 0; j < NUM_VARIABLES_STOCHASTIC_INPUT; j++)
+        {
+            stochastic_columns[f_source][j] = (const double *)column_data[j];
+        }
+        stochastic_row_stride[f_source] = 1;
+    }
+    else if (valid)
+    {
+        // float32 columns can't be used in place, so convert all columns to double in stochastic_input
+        for (int j = 0; j < NUM_VARIABLES_STOCHASTIC_INPUT; j++)
+        {
+            for (int i = 0; i < NUM_LINES_STOCHASTIC_INPUT; i++)
+            {
+                stochastic_input[f_source][i][j] = (column_itemsize[j] == (int64_t)sizeof(float)) ? (double)((const float *)column_data[j])[i] : ((const double *)column_data[j])[i];
+            }
+            stochastic_columns[f_source][j] = &stochastic_input[f_source][0][j];
+        }
+        stochastic_row_stride[f_source] = NUM_VARIABLES_STOCHASTIC_INPUT;
+        munmap(mapped, file_stat.st_size);
+    }
+    else
+    {
+        if (mapped != MAP_FAILED)
+        {
+            munmap(mapped, file_stat.st_size);
+        }
+        printf("Synthetic data %s not used (mismatched, incomplete or older than %s), reading %s\n", filename.c_str(), text_filename.c_str(), text_filename.c_str());
+    }
+    return valid;
+}
+#endif
+
+#if INSTRUMENTATION == 1
+// monotonic clock, in seconds
+double instrumentationClock()
+{
+    struct timespec t;
+    clock_gettime(CLOCK_MONOTONIC, &t);
+    return t.tv_sec + 1e-9 * t.tv_nsec;
+}
+
+// add one call of stage to profile
+void instrumentationRecord(const int f_stage, const double f_seconds, const long f_items)
+{
+    instrumentation_calls[f_stage] += 1;
+    instrumentation_seconds[f_stage] += f_seconds;
+    instrumentation_items[f_stage] += f_items;
+}
+
+// append stages with calls since last write to instrumentation_file (rows: stage,policy,calls,seconds,items), then reset
+void instrumentationWrite(const string &f_policy)
+{
+    FILE *profile_file = fopen(instrumentation_file.c_str(), instrumentation_file_started ? "a" : "w");
+    if (profile_file == NULL)
+    {
+        perror("Error opening instrumentation file");
+        return;
+    }
+    if (!instrumentation_file_started)
+    {
+        fprintf(profile_file, "stage,policy,calls,seconds,items\n");
+        instrumentation_file_started = 1;
+    }
+    for (int k = 0; k < NUM_INSTRUMENTATION_STAGES; k++)
+    {
+        if (instrumentation_calls[k] > 0)
+        {
+            fprintf(profile_file, "%s,%s,%ld,%.9g,%ld\n", instrumentation_stage_names[k], f_policy.c_str(), instrumentation_calls[k],
+                    instrumentation_seconds[k], instrumentation_items[k]);
+        }
+        instrumentation_calls[k] = 0;
+        instrumentation_seconds[k] = 0.;
+        instrumentation_items[k] = 0;
+    }
+    fclose(profile_file);
+}
+#endif
+
 int main(int argc, char *argv[])
 {
 
@@ -588,53 +1053,80 @@ int main(int argc, char *argv[])
     set_file = argv[4];       // directory where "sets" and "runtime" folders are located, for writing output
     retest_file = argv[5];    // file "retest" files are writen
 #endif
+#if (INSTRUMENTATION == 1) && (BORG_RUN_TYPE > 0)
+    std::stringstream instrumentation_filename;
+    instrumentation_filename << write_directory << "instrumentation_pid" << getpid() << ".csv";
+    instrumentation_file = instrumentation_filename.str();
+#elif INSTRUMENTATION == 1
+    instrumentation_file = retest_file + ".instrumentation.csv";
+#endif
 
-    // get stochastic inputs
-    for (int i = 0; i < NUM_LINES_STOCHASTIC_INPUT; i++)
-    {
-        for (int j = 0; j < NUM_VARIABLES_STOCHASTIC_INPUT; j++)
-        {
-            stochastic_input[i][j] = 0.0;
-        }
-    }
-
-    FILE *myfile;
-    string dir_synth = read_directory;
-    myfile = fopen(dir_synth.append("synthetic_data.txt").c_str(), "r");
-
+    // get stochastic inputs, for synthetic data (and its antithetic twin if ESTIMATOR_ANTITHETIC 1): memory-map synthetic_data.bin if
+    // SYNTHETIC_DATA_MODE 1 & usable, else parse synthetic_data.txt
     int linenum = 0;
-    char testbuffer[BUFFER_MAX_SIZE];
-
-    if (myfile == NULL)
-    {
-        perror("Error opening synthetic data file \n");
-    }
-    else
+    for (int k = 0; k < NUM_STOCHASTIC_SOURCES; k++)
     {
-        char buffer[BUFFER_MAX_SIZE];
-        fgets(buffer, BUFFER_MAX_SIZE, myfile); // eat header line
-        while (fgets(buffer, BUFFER_MAX_SIZE, myfile) != NULL)
+        linenum = 0;
+        int synthetic_data_mapped = 0;
+#if SYNTHETIC_DATA_MODE == 1
+        synthetic_data_mapped = mapSyntheticData(read_directory, stochastic_source_names[k], k);
+#endif
+        if (synthetic_data_mapped == 0)
         {
-            linenum++;
-            if (buffer[0] != '#')
+            for (int i = 0; i < NUM_LINES_STOCHASTIC_INPUT; i++)
             {
-                char *pStart = testbuffer;
-                char *pEnd;
-                for (int i = 0; i < BUFFER_MAX_SIZE; i++)
+                for (int j = 0; j < NUM_VARIABLES_STOCHASTIC_INPUT; j++)
                 {
-                    testbuffer[i] = buffer[i];
+                    stochastic_input[k][i][j] = 0.0;
                 }
-                for (int cols = 0; cols < NUM_VARIABLES_STOCHASTIC_INPUT; cols++)
+            }
+
+            FILE *myfile;
+            string dir_synth = read_directory;
+            myfile = fopen(dir_synth.append(stochastic_source_names[k]).append(".txt").c_str(), "r");
+
+            char testbuffer[BUFFER_MAX_SIZE];
+
+            if (myfile == NULL)
+            {
+                perror("Error opening synthetic data file \n");
+            }
+            else
+            {
+                char buffer[BUFFER_MAX_SIZE];
+                fgets(buffer, BUFFER_MAX_SIZE, myfile); // eat header line
+                while (fgets(buffer, BUFFER_MAX_SIZE, myfile) != NULL)
                 {
-                    stochastic_input[linenum - 1][cols] = strtod(pStart, &pEnd);
-                    pStart = pEnd;
-                    //                    printf("%f ",stochastic_input[linenum-1][cols]);
+                    linenum++;
+                    if (buffer[0] != '#')
+                    {
+                        char *pStart = testbuffer;
+                        char *pEnd;
+                        for (int i = 0; i < BUFFER_MAX_SIZE; i++)
+                        {
+                            testbuffer[i] = buffer[i];
+                        }
+                        for (int cols = 0; cols < NUM_VARIABLES_STOCHASTIC_INPUT; cols++)
+                        {
+                            stochastic_input[k][linenum - 1][cols] = strtod(pStart, &pEnd);
+                            pStart = pEnd;
+                            //                    printf("%f ",stochastic_input[linenum-1][cols]);
+                        }
+                        //                printf("\n");
+                    }
                 }
-                //                printf("\n");
             }
+            fclose(myfile);
+            for (int j = 0; j < NUM_VARIABLES_STOCHASTIC_INPUT; j++)
+            {
+                stochastic_columns[k][j] = &stochastic_input[k][0][j];
+            }
+            stochastic_row_stride[k] = NUM_VARIABLES_STOCHASTIC_INPUT;
         }
     }
-    fclose(myfile);
+#if ESTIMATOR_CONTROL_VARIATE == 1
+    setRevenueWindowMeans();
+#endif
 
     // read in LHC dv
     FILE *myfile2;
@@ -677,12 +1169,19 @@ int main(int argc, char *argv[])
     fclose(myfile2);
 
     // get samples from stochastic input file
-    srand(seed_sample);
-    for (int s = 0; s < NUM_SAMPLES; s++)
+    int sample_plan_read = 0;
+#if SAMPLE_PLAN_MODE == 1
+    sample_plan_read = readSamplePlan(read_directory, seed_sample);
+#endif
+    if (sample_plan_read == 0)
     {
-        //choose NUM_SAMPLES number of samples (starting year out of NUM_YEARS). Cant be 0, since need power_price_index[t-1], and cant be less than NUM_YEARS from end
-        lines_to_use[s] = rand() % (NUM_LINES_STOCHASTIC_INPUT - NUM_YEARS - 1) + 1;
-        //        printf("%d\n", lines_to_use[s]);
+        srand(seed_sample);
+        for (int s = 0; s < NUM_SAMPLES; s++)
+        {
+            //choose NUM_SAMPLES number of samples (starting year out of NUM_YEARS). Cant be 0, since need power_price_index[t-1], and cant be less than NUM_YEARS from end
+            lines_to_use[s] = rand() % (NUM_LINES_STOCHASTIC_INPUT - NUM_YEARS - 1) + 1;
+            //        printf("%d\n", lines_to_use[s]);
+        }
     }
 #if BORG_RUN_TYPE == 2
     // interface with Borg-MS
@@ -734,6 +1233,9 @@ int main(int argc, char *argv[])
     ofstream retest_write;
     retest_write.open(retest_file.c_str(), ios::out | ios::trunc);
     retest_write << std::setprecision(10);
+    ofstream variance_write; // estimator variance of each objective
+    variance_write.open((retest_file + ".variance").c_str(), ios::out | ios::trunc);
+    variance_write << std::setprecision(10);
 
     for (int i = 0; i < N_pareto; i++)
     {
@@ -758,6 +1260,11 @@ int main(int argc, char *argv[])
 
         // run dps with given dv
         portfolioProblem(problem_dv, problem_objs, problem_constraints);
+#if INSTRUMENTATION == 1
+        std::stringstream instrumentation_policy;
+        instrumentation_policy << i;
+        instrumentationWrite(instrumentation_policy.str());
+#endif
 
         for (int j = 0; j < (NUM_DV); ++j)
         {
@@ -771,8 +1278,13 @@ int main(int argc, char *argv[])
         {
             retest_write << problem_constraints[j] << "\n";
         }
+        for (int j = 0; j < NUM_OBJECTIVES; ++j)
+        {
+            variance_write << problem_objs_variance[j] << ((j < NUM_OBJECTIVES - 1) ? " " : "\n");
+        }
     }
     retest_write.close();
+    variance_write.close();
 
 #elif BORG_RUN_TYPE > 0
     // loop over uncertain parameters in LHC sample, borg each time
@@ -912,6 +1424,12 @@ int main(int argc, char *argv[])
 #if (BORG_RUN_TYPE == 2)
     BORG_Algorithm_ms_shutdown();
 #endif
+#if (INSTRUMENTATION == 1) && (BORG_RUN_TYPE > 0)
+    if (NFE_counter > 0)
+    {
+        instrumentationWrite("all");
+    }
+#endif
 
     return EXIT_SUCCESS;
 }
@@ -0,0 +1,23 @@
+######################################################################
+### backtest_policies.py - simulate policies in a borg .set/.resultfile over every feasible 20-yr window of the historical
+###     record (historical_data.csv, written by make_synthetic_data_plots.py), saving a policies x start years x metrics cube.
+### usage: python backtest_policies.py LHC_set set_file backtest_file [dps_run_type]
+######################################################################
+import sys
+from datetime import datetime
+
+### Project functions ###
+import functions_moea_output_plots
+import functions_policy_evaluation
+
+startTime = datetime.now()
+
+LHC_set = int(sys.argv[1])
+set_file = sys.argv[2]
+backtest_file = sys.argv[3]
+dps_run_type = int(sys.argv[4]) if len(sys.argv) > 4 else functions_moea_output_plots.DPS_RUN_TYPE
+
+cube, start_years = functions_policy_evaluation.backtest_set(set_file, backtest_file, LHC_set, dps_run_type)
+
+print(str(cube.shape[0]) + ' policies backtested over start years ' + str(start_years[0]) + '-' + str(start_years[-1]) +
+      ', output to ' + backtest_file, datetime.now() - startTime)
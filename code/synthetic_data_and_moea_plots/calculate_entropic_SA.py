@@ -20,6 +20,9 @@ from datetime import datetime
 ### Project functions ###
 import functions_moea_output_plots
 import functions_entropic_SA
+import functions_policy_evaluation
+import functions_instrumentation
+import functions_stochastic_inputs
 
 ##########################
 
@@ -42,40 +45,34 @@ elif objective_formulation == 4:
 
 
 ### entropic SA analysis
-samp = pd.read_csv(dir_data + 'generated_inputs/synthetic_data.txt', delimiter=' ')
+samp = functions_stochastic_inputs.read_synthetic_data(dir_data + 'generated_inputs/')
 samp_rev = samp.revenue.values
 samp_sswp = samp.payoutCfd.values
 samp_pow = samp.power.values
-samples = np.random.choice([int(x) for x in np.arange(1e6 - 21)], size=ns, replace=True)
+# first ns windows of sample plan used for retests (starting lines -> 0-based index of year before window)
+samples = functions_policy_evaluation.get_sample_plan(functions_policy_evaluation.SEED_SAMPLE_RETEST, ns, dir_data + 'generated_inputs/') - 1
+samp_rev_windows, samp_sswp_windows, samp_pow_windows = functions_moea_output_plots.get_sample_windows(samp_rev, samp_sswp, samp_pow, samples, ny)
 
 ### loop over policies in pareto set
 for m in policy_ranks:
   name = 'm'+str(m)
+  functions_instrumentation.set_policy(name)
   mi_dict = {}
   # get policy params
   dps_choice = dps.iloc[m,:]
-  dv_d, dv_c, dv_b, dv_w, dv_a = functions_moea_output_plots.get_dvs(dps_choice)
+  dps_policy = functions_moea_output_plots.RBFPolicy(dps_choice)
   # get trajectories through state space
   mi_dict['annRev'] = dps_choice['annRev']
   mi_dict['maxDebt'] = dps_choice['maxDebt']
   mi_dict['maxComplex'] = dps_choice['maxComplex']
   mi_dict['maxFund'] = dps_choice['maxFund']
 
-  ### simulate ns*ny trajectories
+  ### simulate ns*ny trajectories, all samples at once. rows of results ordered by sample, then year.
   results = np.empty([ns*ny, 9])
-  for s in range(ns):
-    start, end = s*ny, ny * (s + 1)
-    fund_hedge, fund_withdrawal, debt_hedge, debt_withdrawal, power_hedge, power_withdrawal, cash_in, action_hedge, action_withdrawal, adj_rev = functions_moea_output_plots.simulate(samp_rev[samples[s]:(samples[s]+ny+1)], samp_sswp[samples[s]:(samples[s]+ny+1)], samp_pow[samples[s]:(samples[s]+ny+1)])
-    results[start:end, 0] = fund_hedge
-    results[start:end, 1] = fund_withdrawal
-    results[start:end, 2] = debt_hedge
-    results[start:end, 3] = debt_withdrawal
-    results[start:end, 4] = power_hedge
-    results[start:end, 5] = power_withdrawal
-    results[start:end, 6] = cash_in
-    results[start:end, 7] = action_hedge
-    results[start:end, 8] = action_withdrawal
-    # results[start:end, 9] = adj_rev
+  sim_outputs = functions_moea_output_plots.simulate_batch(samp_rev_windows, samp_sswp_windows, samp_pow_windows, dps_policy)
+  # results columns = fund_hedge, fund_withdrawal, debt_hedge, debt_withdrawal, power_hedge, power_withdrawal, cash_in, action_hedge, action_withdrawal
+  for k in range(9):
+    results[:, k] = sim_outputs[k].reshape(ns*ny)
 
   print(name + ' simulation finished', datetime.now() - startTime)
   sys.stdout.flush()
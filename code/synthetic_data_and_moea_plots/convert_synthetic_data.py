@@ -0,0 +1,33 @@
+######################################################################
+### convert_synthetic_data.py - convert moea inputs between text (synthetic_data.txt) & binary (synthetic_data.bin, memory-mapped
+###     by main.cpp with SYNTHETIC_DATA_MODE 1 & by functions_policy_evaluation; see functions_stochastic_inputs.py) formats.
+###     Direction is set by the extension of input_file (.bin -> text, else text -> binary, with values stored at precision,
+###     float64 or float32). Prints header of binary file.
+### usage: python convert_synthetic_data.py input_file output_file [precision]
+######################################################################
+import sys
+import pandas as pd
+from datetime import datetime
+
+### Project functions ###
+import functions_stochastic_inputs
+
+startTime = datetime.now()
+
+input_file = sys.argv[1]
+output_file = sys.argv[2]
+precision = sys.argv[3] if len(sys.argv) > 3 else 'float64'
+
+if input_file.endswith('.bin'):
+  functions_stochastic_inputs.export_synthetic_data_text(input_file, output_file)
+  binary_file = input_file
+else:
+  synthetic_data = pd.read_csv(input_file, delimiter=' ', float_precision='round_trip')
+  provenance = functions_stochastic_inputs.get_synthetic_data_provenance('convert_synthetic_data.py', source=input_file)
+  functions_stochastic_inputs.save_synthetic_data_binary(output_file, synthetic_data, provenance, precision)
+  binary_file = output_file
+
+header = functions_stochastic_inputs.read_synthetic_data_header(binary_file)
+print('Rows: ' + str(header['num_rows']) + ', columns: ' + ', '.join(c + ' (' + d.str + ')' for c, d in zip(header['columns'], header['dtypes'])))
+print('Provenance: ' + str(header['provenance']))
+print('Finished, output to ' + output_file, datetime.now() - startTime)
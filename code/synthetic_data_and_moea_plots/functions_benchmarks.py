@@ -0,0 +1,258 @@
+##############################################################################################################
+### functions_benchmarks.py - reproducible benchmarks of the hot paths in synthetic data generation, policy simulation,
+###     entropic SA & output loading, at scaled-down sizes (BENCHMARK_PRESETS) with fixed seeds. Results are dicts that
+###     can be saved as json, with time & throughput per sample for each benchmark, and compared against a stored
+###     baseline to flag regressions. Run with run_benchmarks.py.
+##############################################################################################################
+import sys
+import json
+import platform
+import warnings
+import numpy as np
+import pandas as pd
+from time import perf_counter
+from datetime import datetime
+
+### Project functions ###
+import functions_clean_data
+import functions_synthetic_data
+import functions_revenues_contracts
+import functions_moea_output_plots
+import functions_policy_evaluation
+import functions_entropic_SA
+import functions_model_cache
+
+dir_downloaded_inputs = './../../data/downloaded_inputs/'
+dir_moea_output = './../../data/optimization_output/'
+
+
+##################################################################
+#### Constants
+##################################################################
+BENCHMARK_SEED = 1                    # seed for sample windows (synthetic data stages use their own fixed seeds)
+BENCHMARK_REGRESSION_TOLERANCE = 0.2  # flag as regression if min & median time per sample are both this fraction above baseline
+BENCHMARK_MIN_SECONDS = 0.2           # fast benchmarks are called repeatedly within each timing, for at least this long
+BENCHMARK_RESULTFILE = '4obj_2rbf_moreSeeds/DPS_4obj_2rbf_moreSeeds_borg_retest.resultfile'   # policies & loader benchmark
+BENCHMARK_PRESETS = {   # n_years: synthetic years generated, ns: sample windows (SA & simulation), npol: policies, repeats: timings
+  'small': {'n_years': 2000, 'ns': 100, 'npol': 10, 'repeats': 15},
+  'medium': {'n_years': 20000, 'ns': 500, 'npol': 50, 'repeats': 9},
+  'large': {'n_years': 200000, 'ns': 500, 'npol': 200, 'repeats': 3}}
+
+
+
+
+##################################################################
+#### Timing
+##################################################################
+
+### wall time per call of f() in each of repeats (at least one) timings, as array, and result of last call. A first, untimed
+###   call warms up (caches, compiled kernels) and sets the number of calls per timing, so each lasts at least min_seconds.
+def time_call(f, repeats=1, min_seconds=BENCHMARK_MIN_SECONDS):
+  start = perf_counter()
+  result = f()
+  number = max(1, int(np.ceil(min_seconds / max(perf_counter() - start, 1e-9))))
+  seconds = []
+  for _ in range(max(repeats, 1)):
+    start = perf_counter()
+    for _ in range(number):
+      result = f()
+    seconds.append((perf_counter() - start) / number)
+  return np.array(seconds), result
+
+
+
+### benchmark entry from seconds of each timing (time_call output): seconds (best timing) & median seconds, number of samples
+###   processed, time per sample (best & median) & throughput (best), and seconds of all timings
+def get_benchmark_entry(seconds, num_samples):
+  best, median = float(np.min(seconds)), float(np.median(seconds))
+  return {'seconds': best, 'median_seconds': median, 'samples': int(num_samples), 'seconds_per_sample': best / num_samples,
+          'median_seconds_per_sample': median / num_samples, 'samples_per_second': num_samples / best if best > 0 else np.inf,
+          'repeat_seconds': [float(x) for x in seconds]}
+
+
+
+### run f(*args) with module global name of module temporarily set to value (e.g. N_SAMPLES of synthetic data modules)
+def call_with_module_value(module, name, value, f, *args, **kwargs):
+  original = getattr(module, name)
+  setattr(module, name, value)
+  try:
+    return f(*args, **kwargs)
+  finally:
+    setattr(module, name, original)
+
+
+
+
+##################################################################
+#### Inputs
+##################################################################
+
+### historical swe, generation, power price & SFPUC sales from downloaded inputs, as in make_synthetic_data_plots.py
+def get_historical_inputs(dir_downloaded_inputs=dir_downloaded_inputs):
+  swe = functions_clean_data.get_clean_swe(dir_downloaded_inputs)
+  gen = functions_clean_data.get_historical_generation(dir_downloaded_inputs, swe).reset_index()
+  power = functions_clean_data.get_historical_power(dir_downloaded_inputs)
+  hp_GWh, hp_dolPerKwh, hp_dolM = functions_clean_data.get_historical_SFPUC_sales()
+  return {'swe': swe, 'gen': gen, 'power': power, 'hp_GWh': hp_GWh, 'hp_dolPerKwh': hp_dolPerKwh}
+
+
+
+### (n_years, 3) stochastic input (revenue, snow contract payout, power index) from benchmark synthetic data, in the layout of
+###   synthetic_data.txt. Swe index weights come from the revenue ~ swe regression, as in make_synthetic_data_plots.py, and
+###   the mean annual power price stands in for the power price index (same scale).
+def get_benchmark_stochastic_input(synthetic):
+  n_years = synthetic['sweSynth'].shape[0]
+  rev_wyr = synthetic['revSim'].values[:(12 * n_years)].reshape(n_years, 12).sum(axis=1)
+  swe = synthetic['sweSynth'][['danFeb', 'danApr']].values
+  coefs = np.linalg.lstsq(np.column_stack([np.ones(n_years), swe]), rev_wyr, rcond=None)[0]
+  swe_wt = pd.Series(swe @ (coefs[1:] / coefs[1:].sum()))
+  payout = functions_revenues_contracts.snow_contract_payout(None, swe_wt, contractType='cfd', lambdaRisk=0.25,
+                                                             strikeQuantile=0.5, capQuantile=0.95, redo=True, save=False)
+  power = synthetic['powSynth'].powPrice.values[:(12 * n_years)].reshape(n_years, 12).mean(axis=1)
+  return np.column_stack([rev_wyr, payout.values, power]), swe_wt
+
+
+
+
+##################################################################
+#### Benchmarks
+##################################################################
+
+### synthetic data stages at n_years years: synthetic_swe, synthetic_generation, synthetic_power, simulate_revenue, wang
+###   (cfd payouts). Adds results to benchmarks dict, and returns synthetic data for later benchmarks.
+def run_synthetic_benchmarks(benchmarks, historical, n_years, repeats):
+  synthetic = {}
+  stages = [('synthetic_swe', 'sweSynth', lambda: functions_synthetic_data.synthetic_swe(None, historical['swe'], redo=True)),
+            ('synthetic_generation', 'genSynth', lambda: functions_synthetic_data.synthetic_generation(
+               None, None, historical['gen'].copy(), synthetic['sweSynth'], redo=True)),
+            ('synthetic_power', 'powSynth', lambda: functions_synthetic_data.synthetic_power(None, historical['power'].copy(), redo=True))]
+  for name, key, f in stages:
+    seconds, synthetic[key] = call_with_module_value(functions_synthetic_data, 'N_SAMPLES', n_years, time_call, f, repeats)
+    benchmarks[name] = get_benchmark_entry(seconds, n_years)
+
+  seconds, (revHist, powHistSample, synthetic['revSim']) = time_call(
+    lambda: functions_revenues_contracts.simulate_revenue(None, historical['gen'].copy(), historical['hp_GWh'].copy(),
+                                                          historical['hp_dolPerKwh'], synthetic['genSynth'], synthetic['powSynth'],
+                                                          min(3600, 12 * n_years - historical['gen'].shape[0]), redo=True),
+    repeats)
+  benchmarks['simulate_revenue'] = get_benchmark_entry(seconds, n_years)
+
+  seconds, (synthetic['stochastic_input'], swe_wt) = time_call(lambda: get_benchmark_stochastic_input(synthetic), repeats)
+  seconds, _ = time_call(lambda: functions_revenues_contracts.wang(pd.DataFrame({'asset': swe_wt, 'prob': 1 / n_years}),
+                                                                   contractType='put', lam=0.25, k=swe_wt.quantile(0.5)), repeats)
+  benchmarks['wang'] = get_benchmark_entry(seconds, n_years)
+  return synthetic
+
+
+
+### policy simulation over ns sample windows of stochastic_input: simulate (one policy, loop over windows), simulate_batch (one
+###   policy, all windows) & get_sample_metrics (npol policies, all windows). Returns simulate_batch output for SA benchmarks.
+def run_simulation_benchmarks(benchmarks, stochastic_input, dvs, ns, repeats):
+  rng = np.random.default_rng(BENCHMARK_SEED)
+  ny = functions_policy_evaluation.NUM_YEARS
+  lines_to_use = rng.integers(1, stochastic_input.shape[0] - ny, ns)
+  revenue, payout, power = functions_policy_evaluation.get_sample_inputs(stochastic_input, lines_to_use, ny)
+  policy = functions_moea_output_plots.RBFPolicy(dvs[0])
+
+  seconds, _ = time_call(lambda: [functions_moea_output_plots.simulate(revenue[s], payout[s], power[s], policy) for s in range(ns)],
+                         repeats)
+  benchmarks['simulate'] = get_benchmark_entry(seconds, ns)
+  seconds, sim_outputs = time_call(lambda: functions_moea_output_plots.simulate_batch(revenue, payout, power, policy), repeats)
+  benchmarks['simulate_batch'] = get_benchmark_entry(seconds, ns)
+
+  policies = functions_policy_evaluation.get_policies(dvs)
+  params = functions_policy_evaluation.get_financial_params(functions_policy_evaluation.get_param_samples())
+  seconds, _ = time_call(lambda: functions_policy_evaluation.get_sample_metrics(policies, revenue, payout, power, params), repeats)
+  benchmarks['get_sample_metrics'] = get_benchmark_entry(seconds, dvs.shape[0] * ns)
+  return sim_outputs
+
+
+
+### entropic SA for hedge decision of one policy, from simulate_batch output over ns windows, as in calculate_entropic_SA.py:
+###   sort_bins (all attributes), then get_joint_probability & get_mutual_info (each input)
+def run_entropic_SA_benchmarks(benchmarks, sim_outputs, ns, repeats):
+  ny = sim_outputs[0].shape[1]
+  name = 'benchmark'
+  atts = ['fund', 'debt', 'power', 'hedge']
+  atts_cols = {'fund': 0, 'debt': 2, 'power': 4, 'hedge': 7}
+  dat = {name: {}}
+  def get_bins():
+    for att in atts:
+      (dat[name][att + '_binfreq'], dat[name][att + '_bincenter'], dat[name][att + '_binpoint']) = \
+        functions_entropic_SA.sort_bins(sim_outputs[atts_cols[att]].reshape(ns * ny), functions_entropic_SA.nbins_entropy, True)
+  def get_mutual_info():
+    functions_entropic_SA.get_joint_probability(dat, name, atts)
+    return [functions_entropic_SA.get_mutual_info(dat, name, atts, [[att, 'hedge'], [att], ['hedge']]) for att in atts[:-1]]
+  seconds, _ = time_call(get_bins, repeats)
+  benchmarks['sort_bins'] = get_benchmark_entry(seconds, ns * ny)
+  seconds, _ = call_with_module_value(functions_entropic_SA, 'ns', ns, time_call, get_mutual_info, repeats)
+  benchmarks['get_mutual_info'] = get_benchmark_entry(seconds, ns * ny)
+
+
+
+### loading optimization output: get_set (resultfile as DataFrame) & get_set_dvs (decision variables only)
+def run_loader_benchmarks(benchmarks, resultfile, repeats):
+  seconds, (pareto, ndv) = time_call(lambda: functions_moea_output_plots.get_set(resultfile, 4, 1), repeats)
+  benchmarks['get_set'] = get_benchmark_entry(seconds, pareto.shape[0])
+  seconds, dvs = time_call(lambda: functions_policy_evaluation.get_set_dvs(resultfile, ndv), repeats)
+  benchmarks['get_set_dvs'] = get_benchmark_entry(seconds, dvs.shape[0])
+  return dvs
+
+
+
+### run all benchmarks for preset (key of BENCHMARK_PRESETS). Returns dict with preset, sizes, seed, environment & benchmarks.
+def run_benchmarks(preset='small', dir_downloaded_inputs=dir_downloaded_inputs, dir_moea_output=dir_moea_output):
+  sizes = BENCHMARK_PRESETS[preset]
+  benchmarks = {}
+  with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    historical = get_historical_inputs(dir_downloaded_inputs)
+    dvs = run_loader_benchmarks(benchmarks, dir_moea_output + BENCHMARK_RESULTFILE, sizes['repeats'])[:sizes['npol']]
+    # fits are timed with the stages, so model cache is off
+    synthetic = call_with_module_value(functions_model_cache, 'MODEL_CACHE', False, run_synthetic_benchmarks, benchmarks, historical,
+                                       sizes['n_years'], sizes['repeats'])
+    sim_outputs = run_simulation_benchmarks(benchmarks, synthetic['stochastic_input'], dvs, sizes['ns'], sizes['repeats'])
+    run_entropic_SA_benchmarks(benchmarks, sim_outputs, sizes['ns'], sizes['repeats'])
+  return {'preset': preset, 'sizes': sizes, 'seed': BENCHMARK_SEED, 'date': datetime.now().isoformat(timespec='seconds'),
+          'machine': platform.node(), 'platform': platform.platform(), 'python': sys.version.split()[0],
+          'numpy': np.__version__, 'pandas': pd.__version__, 'simulation_backend': functions_moea_output_plots.SIMULATION_BACKEND,
+          'benchmarks': benchmarks}
+
+
+
+
+##################################################################
+#### Output & regression check
+##################################################################
+
+### write results (from run_benchmarks) as json
+def save_benchmarks(results, filename):
+  with open(filename, 'w') as f:
+    json.dump(results, f, indent=1)
+
+
+
+### read results written by save_benchmarks
+def read_benchmarks(filename):
+  with open(filename) as f:
+    return json.load(f)
+
+
+
+### compare time per sample of each benchmark in results against baseline (same preset). Returns table with one row per
+###   benchmark: baseline & current best seconds per sample, ratio of best (current / baseline), ratio of medians (best if
+###   baseline has no median) & whether it is a regression (both ratios above 1 + tolerance, so a single noisy timing, or a
+###   few slow ones, don't count). Benchmarks missing from baseline have NaN ratios.
+def compare_benchmarks(results, baseline, tolerance=BENCHMARK_REGRESSION_TOLERANCE):
+  if results['preset'] != baseline['preset']:
+    raise ValueError('Benchmark preset ' + results['preset'] + ' does not match baseline preset ' + baseline['preset'])
+  rows = []
+  for name, entry in results['benchmarks'].items():
+    base = baseline['benchmarks'].get(name, {})
+    base_best = base.get('seconds_per_sample', np.nan)
+    ratio = entry['seconds_per_sample'] / base_best
+    median_ratio = entry['median_seconds_per_sample'] / base.get('median_seconds_per_sample', base_best)
+    rows.append({'benchmark': name, 'baseline_seconds_per_sample': base_best, 'seconds_per_sample': entry['seconds_per_sample'],
+                 'ratio': ratio, 'median_ratio': median_ratio,
+                 'regression': bool((ratio > 1 + tolerance) and (median_ratio > 1 + tolerance))})
+  return pd.DataFrame(rows)
@@ -12,6 +12,8 @@ from datetime import datetime
 
 ### Project functions ###
 import functions_moea_output_plots
+import functions_policy_evaluation
+import functions_instrumentation
 
 sns.set_style('ticks')
 sns.set_context('paper', font_scale=1.55)
@@ -57,6 +59,7 @@ def get_probability_grid(xdat, ydat, xdomain, ydomain):
 
 
 
+@functions_instrumentation.instrument('sort_bins', items=lambda d, *args: len(d))
 def sort_bins(d, n_bins, try_sep_bins):
   separate_min = False
   separate_max = False
@@ -113,6 +116,7 @@ def sort_bins(d, n_bins, try_sep_bins):
 
 
 
+@functions_instrumentation.instrument('get_joint_probability')
 def get_joint_probability(dat, name, atts):
   nbintot = ns * ny
   ndim = len(atts)
@@ -141,11 +145,13 @@ def prob_log_prob(numerator_prob, denominator_prob = -1):
   return z
 
 
+@functions_instrumentation.instrument('get_entropy')
 def get_entropy(probs):
   entropy = - np.sum(prob_log_prob(probs))
   return entropy
 
 
+@functions_instrumentation.instrument('get_mutual_info')
 def get_mutual_info(dat, name, atts_full, atts_mi):
   mutual_info = 0
   probs = dat[name]['joint_freq']
@@ -269,13 +275,12 @@ def add_mi_table2(mi, policy_ranks):
 
 ### get dataframe of simulation results, output for parallel coords in R
 def get_parallel_coord_data(samp, dps, policy_ranks, ny, ns, fig_format):
-  np.random.seed(203)
-
-  ### get input samples
-  samples = np.random.choice([int(x) for x in np.arange(1e6 - 21)], size=ns, replace=True)
+  ### get input samples (first ns windows of sample plan used for retests)
+  samples = functions_policy_evaluation.get_sample_plan(functions_policy_evaluation.SEED_SAMPLE_RETEST, ns, dir_data + 'generated_inputs/') - 1
   samp_rev = samp.revenue.values
   samp_sswp = samp.payoutCfd.values
   samp_pow = samp.power.values
+  samp_rev_windows, samp_sswp_windows, samp_pow_windows = functions_moea_output_plots.get_sample_windows(samp_rev, samp_sswp, samp_pow, samples, ny)
 
   ### loop over policies in pareto set
   df = pd.DataFrame({'fund_hedge':[], 'fund_withdrawal':[], 'debt_hedge':[], 'debt_withdrawal':[], 'power_hedge':[],
@@ -284,22 +289,13 @@ def get_parallel_coord_data(samp, dps, policy_ranks, ny, ns, fig_format):
     name = 'm'+str(m)
     # get policy params
     dps_choice = dps.iloc[m,:]
-    dv_d, dv_c, dv_b, dv_w, dv_a = functions_moea_output_plots.get_dvs(dps_choice)
+    dps_policy = functions_moea_output_plots.RBFPolicy(dps_choice)
   
-    ### simulate ns*ny trajectories
+    ### simulate ns*ny trajectories, all samples at once. rows of results ordered by sample, then year.
     results = np.empty([ns*ny, 9])
-    for s in range(ns):
-      start, end = s*ny, ny * (s + 1)
-      fund_hedge, fund_withdrawal, debt_hedge, debt_withdrawal, power_hedge, power_withdrawal, cash_in, action_hedge, action_withdrawal, adj_rev = functions_moea_output_plots.simulate(samp_rev[samples[s]:(samples[s]+ny+1)], samp_sswp[samples[s]:(samples[s]+ny+1)], samp_pow[samples[s]:(samples[s]+ny+1)])
-      results[start:end, 0] = fund_hedge
-      results[start:end, 1] = fund_withdrawal
-      results[start:end, 2] = debt_hedge
-      results[start:end, 3] = debt_withdrawal
-      results[start:end, 4] = power_hedge
-      results[start:end, 5] = power_withdrawal
-      results[start:end, 6] = cash_in
-      results[start:end, 7] = action_hedge
-      results[start:end, 8] = action_withdrawal
+    sim_outputs = functions_moea_output_plots.simulate_batch(samp_rev_windows, samp_sswp_windows, samp_pow_windows, dps_policy)
+    for k in range(9):
+      results[:, k] = sim_outputs[k].reshape(ns*ny)
 
     df = df.append(pd.DataFrame({'fund_hedge':results[:, 0], 'fund_withdrawal':results[:, 1], 'debt_hedge':results[:, 2], 'debt_withdrawal':results[:, 3],
                                 'power_hedge':results[:, 4], 'power_withdrawal':results[:, 5], 'cash_in':results[:, 6], 'action_hedge':results[:, 7],
@@ -0,0 +1,145 @@
+##############################################################################################################
+### functions_instrumentation.py - low-overhead timers & counters for hot paths of the simulation, entropic SA & synthetic
+###     data pipelines. Switched on by setting environment variable INSTRUMENTATION=1 before running a script. When off,
+###     instrument() returns functions unchanged and timer() returns a shared no-op context, so there is no cost.
+###     Calls, seconds & items (e.g. samples) are aggregated per stage & per policy (see set_policy), and the profile is
+###     written at exit to INSTRUMENTATION_FILE (.json & .csv), with same csv columns as INSTRUMENTATION in main.cpp.
+###     Only the main process is profiled (pool workers exit without running exit handlers).
+##############################################################################################################
+import os
+import csv
+import json
+import atexit
+import functools
+import contextlib
+from time import perf_counter
+
+
+##################################################################
+#### Constants
+##################################################################
+INSTRUMENTATION = os.environ.get('INSTRUMENTATION', '0') not in ['', '0']
+INSTRUMENTATION_FILE = os.environ.get('INSTRUMENTATION_FILE', 'instrumentation_profile')   # written as .json & .csv
+PROFILE_COLUMNS = ['stage', 'policy', 'calls', 'seconds', 'items']
+ALL_POLICIES = 'all'                  # policy label for calls made outside set_policy
+
+profile = {}                          # (stage, policy) -> [calls, seconds, items]
+current = {'policy': ALL_POLICIES}    # policy label that calls are aggregated under
+null_timer = contextlib.nullcontext()
+
+
+
+
+##################################################################
+#### Timers & counters
+##################################################################
+
+### add one call of stage, taking seconds & processing items, to profile under current policy
+def record(stage, seconds, items=0):
+  entry = profile.setdefault((stage, current['policy']), [0, 0., 0])
+  entry[0] += 1
+  entry[1] += seconds
+  entry[2] += items
+
+
+
+### count items for stage without timing (no-op if instrumentation off)
+def count(stage, items=1):
+  if INSTRUMENTATION:
+    record(stage, 0., items)
+
+
+
+### aggregate following calls under policy label (e.g. 'm12' for policy rank 12), or ALL_POLICIES if None
+def set_policy(policy=None):
+  current['policy'] = ALL_POLICIES if policy is None else str(policy)
+
+
+
+### decorator timing every call of function as stage. items is an optional function of the call's arguments, giving the
+###   number of items (e.g. samples) processed. If instrumentation is off, the function is returned unchanged.
+def instrument(stage, items=None):
+  def decorator(f):
+    if not INSTRUMENTATION:
+      return f
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+      start = perf_counter()
+      result = f(*args, **kwargs)
+      record(stage, perf_counter() - start, 0 if items is None else items(*args, **kwargs))
+      return result
+    return wrapper
+  return decorator
+
+
+
+### context manager timing block as stage (shared no-op if instrumentation off)
+def timer(stage, items=0):
+  if not INSTRUMENTATION:
+    return null_timer
+  return timed_block(stage, items)
+
+
+
+@contextlib.contextmanager
+def timed_block(stage, items=0):
+  start = perf_counter()
+  try:
+    yield
+  finally:
+    record(stage, perf_counter() - start, items)
+
+
+
+
+##################################################################
+#### Profile output
+##################################################################
+
+### profile rows (dicts with PROFILE_COLUMNS), most time first
+def get_profile():
+  rows = [{'stage': k[0], 'policy': k[1], 'calls': v[0], 'seconds': v[1], 'items': v[2]} for k, v in profile.items()]
+  return sorted(rows, key=lambda r: -r['seconds'])
+
+
+
+### profile totals per stage, summed over policies
+def get_stage_totals():
+  totals = {}
+  for row in get_profile():
+    total = totals.setdefault(row['stage'], {'calls': 0, 'seconds': 0., 'items': 0})
+    for k in ['calls', 'seconds', 'items']:
+      total[k] += row[k]
+  return totals
+
+
+
+### write profile to filename.json (per-stage totals & all rows) & filename.csv (rows)
+def dump_profile(filename=None):
+  if filename is None:
+    filename = INSTRUMENTATION_FILE
+  rows = get_profile()
+  with open(filename + '.json', 'w') as f:
+    json.dump({'stages': get_stage_totals(), 'profile': rows}, f, indent=1)
+  with open(filename + '.csv', 'w', newline='') as f:
+    writer = csv.DictWriter(f, fieldnames=PROFILE_COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+
+### clear profile
+def reset_profile():
+  profile.clear()
+
+
+
+### write profile at exit, if anything was recorded
+def dump_profile_at_exit():
+  if len(profile) > 0:
+    dump_profile()
+
+
+
+if INSTRUMENTATION:
+  atexit.register(dump_profile_at_exit)
@@ -0,0 +1,153 @@
+##############################################################################################################
+### functions_model_cache.py - content-addressed cache of fitted statistical models (swe gamma marginals & copula, monthly
+###     generation regressions & AR(1,3), power price SARMA, revenue mtid regression), so that re-running the synthetic data
+###     pipeline reuses fits whose inputs haven't changed. Each fit is keyed by a hash of its input data, the model
+###     specification (name & source code of the fitting function) and the python & library versions, and pickled to
+###     MODEL_CACHE_DIR. Least recently used fits are evicted when the cache is larger than MODEL_CACHE_MAX_BYTES.
+###     Switched off by setting environment variable MODEL_CACHE=0 (fits are then always re-run). Changes to helper
+###     functions called by a fitting function aren't part of its key, so clear the cache (clear_model_cache) after editing them.
+##############################################################################################################
+import os
+import sys
+import pickle
+import hashlib
+import inspect
+import tempfile
+import importlib
+import numpy as np
+import pandas as pd
+
+### Project functions ###
+import functions_instrumentation
+
+
+##################################################################
+#### Constants
+##################################################################
+MODEL_CACHE = os.environ.get('MODEL_CACHE', '1') not in ['', '0']
+MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', './../../data/generated_inputs/model_cache/')
+MODEL_CACHE_MAX_BYTES = int(os.environ.get('MODEL_CACHE_MAX_BYTES', 50 * 2**20))   # evict least recently used fits above this
+MODEL_CACHE_LIBRARIES = ['numpy', 'pandas', 'scipy', 'statsmodels']   # library versions that are part of each key
+
+
+
+
+##################################################################
+#### Keys
+##################################################################
+
+### update hashlib object h with value: dataframe/series (index, columns, dtypes & values), numpy array (dtype, shape & bytes),
+###   dict/list/tuple (recursively), or anything else by its repr
+def hash_value(h, value):
+  h.update(type(value).__name__.encode())
+  if isinstance(value, pd.DataFrame):
+    h.update(repr([list(value.columns), [str(d) for d in value.dtypes]]).encode())
+    h.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+  elif isinstance(value, pd.Series):
+    h.update(repr([value.name, str(value.dtype)]).encode())
+    h.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+  elif isinstance(value, np.ndarray):
+    h.update(repr([str(value.dtype), value.shape]).encode())
+    h.update(np.ascontiguousarray(value).tobytes())
+  elif isinstance(value, dict):
+    for k in sorted(value, key=repr):
+      hash_value(h, k)
+      hash_value(h, value[k])
+  elif isinstance(value, (list, tuple)):
+    h.update(str(len(value)).encode())
+    for v in value:
+      hash_value(h, v)
+  else:
+    h.update(repr(value).encode())
+
+
+
+### key (hex sha256) for fitting model name with function fit on inputs args. None if source code of fit isn't available (e.g.
+###   defined in an interactive session or python -c), since changes to it then can't be detected.
+def get_model_key(name, fit, args):
+  try:
+    source = inspect.getsource(fit)
+  except (OSError, TypeError):
+    return None
+  h = hashlib.sha256()
+  hash_value(h, [name, source, sys.version] + [importlib.import_module(lib).__version__ for lib in MODEL_CACHE_LIBRARIES])
+  hash_value(h, list(args))
+  return h.hexdigest()
+
+
+
+
+##################################################################
+#### Cache
+##################################################################
+
+### fitted model name from fit(*args), from cache if inputs, specification & library versions are unchanged, else fitted & cached.
+###   fit is called on copies of dataframe/series/array inputs, so (unlike calling fit directly) inputs are never modified.
+###   Fits without available source code are never cached. Each process writes to its own temporary file, moved into place
+###   atomically, so concurrent jobs missing the cache for the same fit don't clash.
+def cached_fit(name, fit, *args):
+  args = [a.copy() if isinstance(a, (pd.DataFrame, pd.Series, np.ndarray)) else a for a in args]
+  key = get_model_key(name, fit, args) if MODEL_CACHE else None
+  if key is None:
+    return fit(*args)
+  filename = os.path.join(MODEL_CACHE_DIR, name + '_' + key + '.pkl')
+  if os.path.exists(filename):
+    try:
+      with open(filename, 'rb') as f:
+        model = pickle.load(f)
+      os.utime(filename)   # mark as recently used
+      functions_instrumentation.count('model_cache_hit')
+      return model
+    except (OSError, EOFError, pickle.UnpicklingError):
+      pass   # unreadable (e.g. partly written), so refit
+  functions_instrumentation.count('model_cache_miss')
+  model = fit(*args)
+  os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+  fd, tmp_filename = tempfile.mkstemp(suffix='.tmp', dir=MODEL_CACHE_DIR)
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_filename, filename)
+  except BaseException:
+    os.remove(tmp_filename)
+    raise
+  evict_model_cache(keep=filename)
+  return model
+
+
+
+### remove least recently used fits until cache is at most max_bytes (never removing file keep). Returns number removed. Files
+###   removed meanwhile by another process are skipped.
+def evict_model_cache(max_bytes=None, keep=None):
+  if max_bytes is None:
+    max_bytes = MODEL_CACHE_MAX_BYTES
+  if not os.path.isdir(MODEL_CACHE_DIR):
+    return 0
+  files = []
+  for f in os.listdir(MODEL_CACHE_DIR):
+    if f.endswith('.pkl'):
+      try:
+        stat = os.stat(os.path.join(MODEL_CACHE_DIR, f))
+        files.append((stat.st_mtime, stat.st_size, os.path.join(MODEL_CACHE_DIR, f)))
+      except FileNotFoundError:
+        pass
+  files = sorted(files)
+  total = sum(f[1] for f in files)
+  removed = 0
+  for mtime, size, f in files:
+    if total <= max_bytes:
+      break
+    if f != keep:
+      try:
+        os.remove(f)
+        removed += 1
+      except FileNotFoundError:
+        pass
+      total -= size
+  return removed
+
+
+
+### remove all cached fits
+def clear_model_cache():
+  return evict_model_cache(max_bytes=-1)
@@ -16,6 +16,11 @@ from matplotlib.lines import Line2D
 # from mpl_toolkits.mplot3d import Axes3D
 import copy
 # import itertools
+import multiprocessing
+
+### Project functions ###
+import functions_simulation_kernels
+import functions_instrumentation
 
 sns.set_style('ticks')
 sns.set_context('paper', font_scale=1.55)
@@ -598,6 +603,7 @@ def plot_4obj_brush(paretos, pareto_cols, constraints, lims3d, fig_format, table
 #### Constants for simulation, consistent with C++ version used for optimization
 ##################################################################
 DPS_RUN_TYPE = 1          # 0: 2dv version; 1: full DPS with RBFs, maxDebt formulation; 2: full DPS with RBFs, minRev formulation
+SIMULATION_BACKEND = 'numba'   # 'numba': compiled kernels from functions_simulation_kernels for dps simulation (if numba installed, else numpy); 'numpy': vectorized numpy only
 #BORG_RUN_TYPE 1       # 0: single run no borg; 1: borg run, serial; 2: borg parallel for cluster;
 # NUM_YEARS = 20                   #20yr sims
 # NUM_SAMPLES = 50000
@@ -662,14 +668,18 @@ Delta_debt = 1
 # discount_rate = 1 / (delta/100 + 1)
 interest_fund = (Delta_fund + delta)/100 + 1
 interest_debt = (Delta_debt + delta)/100 + 1
+INTEREST_FUND = interest_fund    # defaults used by simulation functions when no interest rates are passed
+INTEREST_DEBT = interest_debt
 # discount_factor = discount_rate ** np.arange(1, NUM_YEARS+1)
 # discount_normalization = 1 / np.sum(discount_factor)
 
 
 
-# get decision variables to use for simulation
+# get decision variables to use for simulation. Also sets module default policy (dps_policy) used by policy_hedge_dps &
+#   policy_withdrawal_dps when no policy is passed. For concurrent evaluation, build RBFPolicy objects and pass them explicitly.
 def get_dvs(dvs):
-    global dv_d, dv_c, dv_b, dv_w, dv_a
+    global dv_d, dv_c, dv_b, dv_w, dv_a, dps_policy
+    dps_policy = RBFPolicy(dvs)
     dv_d = np.zeros(NUM_DECISIONS_TOTAL)
     if (SHARED_RBFS == 0):
       dv_c = np.zeros(NUM_RBF * NUM_INPUTS_RBF * NUM_DECISIONS_TOTAL)
@@ -705,8 +715,110 @@ def get_dvs(dvs):
 
 
 
-### simulate hydro-financial model
-def simulate(revenue, payout, power, policy=-1, dps_run_type=-1):
+### RBF policy decisions. Policy arrays are indexed [decision, rbf, input] (centers, inv_radii_sq), [decision, rbf] (weights),
+###   and [decision] (dv_a, dv_d), with inputs ordered (fund, debt, power, cash_in). Any trailing dims of the policy arrays must
+###   broadcast against the state inputs, so the same functions serve single policies and policy banks.
+###   useinrbf multiplies each input before normalizing (1 = use input, 0 = leave out), as with USEINRBF_* flags in main.cpp.
+def rbf_hedge(centers, inv_radii_sq, weights, dv_a, dv_d, f_fund_balance, f_debt, f_power_price_index, useinrbf=(1, 1, 1)):
+  decision_order = 0
+  inputs = [f_fund_balance * useinrbf[0] / NORMALIZE_FUND, f_debt * useinrbf[1] / NORMALIZE_FUND,
+            f_power_price_index * useinrbf[2] / NORMALIZE_POWER_PRICE]
+  value = 0
+  for i in range(NUM_RBF):
+    # sum RBFs
+    arg_exp = 0
+    for j in range(3):
+      arg_exp = arg_exp - (inputs[j] - centers[decision_order, i, j]) ** 2 * inv_radii_sq[decision_order, i, j]
+    value = value + weights[decision_order, i] * np.exp(arg_exp)
+  # add constant term & scale to [0, NORMALIZE_SNOW_CONTRACT_SIZE]
+  value = np.maximum(np.minimum((value + dv_a[decision_order]) * NORMALIZE_SNOW_CONTRACT_SIZE, NORMALIZE_SNOW_CONTRACT_SIZE), 0)
+  # enforce minimum contract size
+  value = np.where(value < dv_d[decision_order] * NORMALIZE_SNOW_CONTRACT_SIZE, 0., value)
+  return value
+
+
+def rbf_withdrawal(centers, inv_radii_sq, weights, dv_a, dv_d, f_fund_balance, f_debt, f_power_price_index, f_cash_in, useinrbf=(1, 1, 1, 1)):
+  decision_order = 1
+  inputs = [f_fund_balance * useinrbf[0] / NORMALIZE_FUND, f_debt * useinrbf[1] / NORMALIZE_FUND,
+            f_power_price_index * useinrbf[2] / NORMALIZE_POWER_PRICE,
+            (f_cash_in * useinrbf[3] + NORMALIZE_REVENUE) / (2 * NORMALIZE_REVENUE)]
+  cash_out = 0
+  for i in range(NUM_RBF):
+    # sum RBFs
+    arg_exp = 0
+    for j in range(4):
+      arg_exp = arg_exp - (inputs[j] - centers[decision_order, i, j]) ** 2 * inv_radii_sq[decision_order, i, j]
+    cash_out = cash_out + weights[decision_order, i] * np.exp(arg_exp)
+  # add constant term
+  cash_out = cash_out + dv_a[decision_order]
+  # now scale back to [-NORMALIZE_REVENUE,NORMALIZE_REVENUE]
+  cash_out = np.maximum(np.minimum((cash_out * 2 * NORMALIZE_REVENUE) - NORMALIZE_REVENUE, NORMALIZE_REVENUE), -NORMALIZE_REVENUE)
+  # now write as withdrawal for policy return
+  withdrawal = cash_out - f_cash_in
+  # ensure that cant withdraw more than fund balance, or deposit more than cash flow
+  withdrawal = np.where(withdrawal > EPS, np.minimum(withdrawal, f_fund_balance),
+                        np.where(withdrawal < -EPS, np.maximum(withdrawal, -np.maximum(f_cash_in, 0)), withdrawal))
+  # ensure that (fund balance - withdrawal (+ deposit)) isnt larger than max fund size
+  max_fund = dv_d[decision_order] * NORMALIZE_FUND
+  withdrawal = np.where((f_fund_balance - withdrawal) > max_fund, f_fund_balance - max_fund, withdrawal)
+  return withdrawal
+
+
+
+### immutable dps policy, decoded from one row of a solution set (dvs first, as in get_dvs). Holds raw dvs plus precomputed
+###   inverse squared radii & normalized weights. hedge & withdraw take state inputs of any (broadcastable) shape. Policies share
+###   no module state, so several can be evaluated concurrently (threads, or pickled to worker processes).
+class RBFPolicy(object):
+  __slots__ = ('dvs', 'dv_d', 'dv_c', 'dv_b', 'dv_w', 'dv_a', 'centers', 'inv_radii_sq', 'weights')
+
+  def __init__(self, dvs):
+    dvs = np.array(np.asarray(dvs, dtype=float)[:NUM_DV])
+    n_d, n_c, n_b, n_w, n_a = get_dv_lengths()
+    bank = get_policy_bank(dvs)
+    attrs = {'dvs': dvs,
+             'dv_d': dvs[:n_d],
+             'dv_c': dvs[n_d:(n_d + n_c)],
+             'dv_b': np.maximum(dvs[(n_d + n_c):(n_d + n_c + n_b)], EPS),
+             'dv_w': dvs[(n_d + n_c + n_b):(n_d + n_c + n_b + n_w)],
+             'dv_a': dvs[(n_d + n_c + n_b + n_w):(n_d + n_c + n_b + n_w + n_a)],
+             'centers': bank['centers'][0],
+             'inv_radii_sq': bank['inv_radii_sq'][0],
+             'weights': bank['weights'][0]}
+    for k, v in attrs.items():
+      v.flags.writeable = False
+      object.__setattr__(self, k, v)
+
+  def __setattr__(self, name, value):
+    raise AttributeError('RBFPolicy is immutable')
+
+  def __delattr__(self, name):
+    raise AttributeError('RBFPolicy is immutable')
+
+  def __reduce__(self):
+    return (RBFPolicy, (self.dvs,))
+
+  ### hedging contract slope from current fund balance, debt & power price index
+  def hedge(self, f_fund_balance, f_debt, f_power_price_index, useinrbf=(1, 1, 1)):
+    return rbf_hedge(self.centers, self.inv_radii_sq, self.weights, self.dv_a, self.dv_d,
+                     f_fund_balance, f_debt, f_power_price_index, useinrbf)
+
+  ### withdrawal (+) or deposit (-) from fund balance, debt, power price index & cash flow
+  def withdraw(self, f_fund_balance, f_debt, f_power_price_index, f_cash_in, useinrbf=(1, 1, 1, 1)):
+    return rbf_withdrawal(self.centers, self.inv_radii_sq, self.weights, self.dv_a, self.dv_d,
+                          f_fund_balance, f_debt, f_power_price_index, f_cash_in, useinrbf)
+
+
+
+
+### simulate hydro-financial model. For dps simulation, policy can be an RBFPolicy (else uses policy from last get_dvs call).
+###   interest rates default to INTEREST_FUND & INTEREST_DEBT.
+@functions_instrumentation.instrument('simulate', items=lambda revenue, *args, **kwargs: 1)
+def simulate(revenue, payout, power, policy=-1, dps_run_type=-1, interest_fund=None, interest_debt=None):
+  if interest_fund is None:
+    interest_fund = INTEREST_FUND
+  if interest_debt is None:
+    interest_debt = INTEREST_DEBT
+  dps_policy_sim = policy if isinstance(policy, RBFPolicy) else None
   ### default simulation assumes dps simulation
   if dps_run_type < 0:
     ny = len(revenue) - 1
@@ -718,10 +830,10 @@ def simulate(revenue, payout, power, policy=-1, dps_run_type=-1):
     value_snow_contract = np.zeros(ny)
     cash_in = np.zeros(ny)
     for i in range(ny):
-      value_snow_contract[i] = policy_hedge_dps(fund[i], debt[i], power[i])
+      value_snow_contract[i] = policy_hedge_dps(fund[i], debt[i], power[i], policy=dps_policy_sim)
       net_payout_snow_contract = value_snow_contract[i] * payout[i+1]
       cash_in[i] = net_rev[i+1] + net_payout_snow_contract - debt[i] * interest_debt
-      withdrawal[i] = policy_withdrawal_dps(fund[i]*interest_fund, debt[i]*interest_debt, power[i+1], cash_in[i])
+      withdrawal[i] = policy_withdrawal_dps(fund[i]*interest_fund, debt[i]*interest_debt, power[i+1], cash_in[i], policy=dps_policy_sim)
       final_cashflow[i] = cash_in[i] + withdrawal[i]
       fund[i+1] = fund[i]*interest_fund - withdrawal[i]
       if (final_cashflow[i] < -EPS):
@@ -742,7 +854,7 @@ def simulate(revenue, payout, power, policy=-1, dps_run_type=-1):
         max_fund = policy.dv1
         value_snow_contract[i] = policy.dv2
       else:
-        value_snow_contract[i] = policy_hedge_dps(fund[i], debt[i], power[i])
+        value_snow_contract[i] = policy_hedge_dps(fund[i], debt[i], power[i], policy=dps_policy_sim)
       net_payout_snow_contract = value_snow_contract[i] * payout[i+1]
       cash_in[i] = net_rev[i+1] + net_payout_snow_contract - debt[i] * interest_debt
       if dps_run_type == 0:
@@ -750,7 +862,7 @@ def simulate(revenue, payout, power, policy=-1, dps_run_type=-1):
         final_cashflow[i] = policy_cashflow_post_withdrawal_2dv(fund[i] * interest_fund, cash_in[i], 0, max_fund)
         withdrawal[i] = final_cashflow[i] - cash_in[i]
       else:
-        withdrawal[i] = policy_withdrawal_dps(fund[i]*interest_fund, debt[i]*interest_debt, power[i+1], cash_in[i])
+        withdrawal[i] = policy_withdrawal_dps(fund[i]*interest_fund, debt[i]*interest_debt, power[i+1], cash_in[i], policy=dps_policy_sim)
         final_cashflow[i] = cash_in[i] + withdrawal[i]
       fund[i+1] = fund[i]*interest_fund - withdrawal[i]
       if (final_cashflow[i] < -EPS):
@@ -762,97 +874,237 @@ def simulate(revenue, payout, power, policy=-1, dps_run_type=-1):
 
 
 
-
-### get hedging contract slope each year from dps policy based on current conditions
-def policy_hedge_dps(f_fund_balance, f_debt, f_power_price_index, useinrbf_fund_hedge=1, useinrbf_debt_hedge=1, useinrbf_power_hedge=1):
-  decision_order = 0
-  value = 0
-  for i in range(NUM_RBF):
-    # sum RBFs
-    if (SHARED_RBFS == 1):
-      arg_exp = -((f_fund_balance * useinrbf_fund_hedge / NORMALIZE_FUND - dv_c[NUM_INPUTS_RBF * i]) ** 2) \
-                 / (dv_b[NUM_INPUTS_RBF * i]) ** 2
-      arg_exp += -((f_debt * useinrbf_debt_hedge / NORMALIZE_FUND - dv_c[NUM_INPUTS_RBF * i + 1]) ** 2) \
-                 / (dv_b[NUM_INPUTS_RBF * i + 1]) ** 2
-      arg_exp += -((f_power_price_index * useinrbf_power_hedge / NORMALIZE_POWER_PRICE - dv_c[NUM_INPUTS_RBF * i + 2]) ** 2) \
-                 / (dv_b[NUM_INPUTS_RBF * i + 2]) ** 2
+### simulate hydro-financial model for many trajectories at once. revenue, payout, power are (n_samples, ny+1) arrays, each row
+###   equivalent to the inputs of simulate(). Years are stepped sequentially, but all samples are stepped together in numpy.
+###   Returns same ten outputs as simulate(), each as (n_samples, ny) array. For dps policies, backend (default SIMULATION_BACKEND)
+###   selects compiled or numpy simulation, with identical results.
+@functions_instrumentation.instrument('simulate_batch', items=lambda revenue, *args, **kwargs: revenue.shape[0])
+def simulate_batch(revenue, payout, power, policy=-1, dps_run_type=-1, interest_fund=None, interest_debt=None, backend=None):
+  if interest_fund is None:
+    interest_fund = INTEREST_FUND
+  if interest_debt is None:
+    interest_debt = INTEREST_DEBT
+  if backend is None:
+    backend = SIMULATION_BACKEND
+  dps_policy_sim = policy if isinstance(policy, RBFPolicy) else None
+  ns = revenue.shape[0]
+  ny = revenue.shape[1] - 1
+  net_rev = revenue - MEAN_REVENUE * fixed_cost
+
+  if dps_run_type != 0 and functions_simulation_kernels.use_compiled(backend):
+    p = dps_policy_sim if dps_policy_sim is not None else dps_policy
+    fund, debt, cash_in, value_snow_contract, withdrawal, final_cashflow = functions_simulation_kernels.simulate_dps_kernel(
+      np.asarray(net_rev, dtype=float), np.asarray(payout, dtype=float), np.asarray(power, dtype=float), p.centers, p.inv_radii_sq,
+      p.weights, p.dv_a, p.dv_d, np.ones(3), np.ones(4), interest_fund, interest_debt, NORMALIZE_FUND, NORMALIZE_POWER_PRICE,
+      NORMALIZE_REVENUE, NORMALIZE_SNOW_CONTRACT_SIZE, EPS)
+    return (fund[:, :-1], fund[:, :-1]*interest_fund, debt[:, :-1], debt[:, :-1]*interest_debt, power[:, :-1], power[:, 1:], cash_in, value_snow_contract, withdrawal, final_cashflow)
+
+  fund = np.zeros([ns, ny + 1])
+  debt = np.zeros([ns, ny + 1])
+  final_cashflow = np.zeros([ns, ny])
+  withdrawal = np.zeros([ns, ny])
+  value_snow_contract = np.zeros([ns, ny])
+  cash_in = np.zeros([ns, ny])
+
+  for i in range(ny):
+    if dps_run_type == 0:
+      max_fund = policy.dv1
+      value_snow_contract[:, i] = policy.dv2
     else:
-      arg_exp = -((f_fund_balance * useinrbf_fund_hedge / NORMALIZE_FUND - dv_c[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i]) ** 2) \
-                 / (dv_b[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i]) ** 2
-      arg_exp += -((f_debt * useinrbf_debt_hedge / NORMALIZE_FUND - dv_c[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i + 1]) ** 2) \
-                 / (dv_b[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i + 1]) ** 2
-      arg_exp += -((f_power_price_index * useinrbf_power_hedge / NORMALIZE_POWER_PRICE - dv_c[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i + 2]) ** 2) \
-                 / (dv_b[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i + 2]) ** 2
-    value += dv_w[decision_order * NUM_RBF + i] * np.exp(arg_exp)
-  # add constant term & scale to [0, NORMALIZE_SNOW_CONTRACT_SIZE]
-  value = max(min((value + dv_a[decision_order]) * NORMALIZE_SNOW_CONTRACT_SIZE, NORMALIZE_SNOW_CONTRACT_SIZE), 0)
-  # enforce minimum contract size
-  if (value < dv_d[decision_order] * NORMALIZE_SNOW_CONTRACT_SIZE):
-    value = 0
+      value_snow_contract[:, i] = policy_hedge_dps(fund[:, i], debt[:, i], power[:, i], policy=dps_policy_sim)
+    net_payout_snow_contract = value_snow_contract[:, i] * payout[:, i+1]
+    cash_in[:, i] = net_rev[:, i+1] + net_payout_snow_contract - debt[:, i] * interest_debt
+    if dps_run_type == 0:
+      # rule for withdrawal (or deposit), after growing fund at interestFund from last year
+      final_cashflow[:, i] = policy_cashflow_post_withdrawal_2dv(fund[:, i] * interest_fund, cash_in[:, i], 0, max_fund)
+      withdrawal[:, i] = final_cashflow[:, i] - cash_in[:, i]
+    else:
+      withdrawal[:, i] = policy_withdrawal_dps(fund[:, i]*interest_fund, debt[:, i]*interest_debt, power[:, i+1], cash_in[:, i], policy=dps_policy_sim)
+      final_cashflow[:, i] = cash_in[:, i] + withdrawal[:, i]
+    fund[:, i+1] = fund[:, i]*interest_fund - withdrawal[:, i]
+    borrow = final_cashflow[:, i] < -EPS
+    debt[borrow, i+1] = -final_cashflow[borrow, i]
+    final_cashflow[borrow, i] = 0
 
-  return (value)
+  return (fund[:, :-1], fund[:, :-1]*interest_fund, debt[:, :-1], debt[:, :-1]*interest_debt, power[:, :-1], power[:, 1:], cash_in, value_snow_contract, withdrawal, final_cashflow)
 
 
 
+### get (n_samples, ny+1) blocks of revenue, payout & power from synthetic record, one row per starting index in samples
+def get_sample_windows(samp_rev, samp_sswp, samp_pow, samples, ny):
+  idx = np.asarray(samples)[:, np.newaxis] + np.arange(ny + 1)
+  return (samp_rev[idx], samp_sswp[idx], samp_pow[idx])
+
+
+
+
+
+### get hedging contract slope each year from dps policy based on current conditions. Works elementwise on array inputs.
+###   Uses policy (RBFPolicy) if given, else policy from last get_dvs call.
+@functions_instrumentation.instrument('policy_hedge_dps', items=lambda f_fund_balance, *args, **kwargs: np.size(f_fund_balance))
+def policy_hedge_dps(f_fund_balance, f_debt, f_power_price_index, useinrbf_fund_hedge=1, useinrbf_debt_hedge=1, useinrbf_power_hedge=1, policy=None):
+  if policy is None:
+    policy = dps_policy
+  value = policy.hedge(f_fund_balance, f_debt, f_power_price_index,
+                       (useinrbf_fund_hedge, useinrbf_debt_hedge, useinrbf_power_hedge))
+  return (value[()])
+
+
+
+
+
+### get withdrawal/deposit each year from dps policy based on current conditions. Works elementwise on array inputs.
+###   Uses policy (RBFPolicy) if given, else policy from last get_dvs call.
+@functions_instrumentation.instrument('policy_withdrawal_dps', items=lambda f_fund_balance, *args, **kwargs: np.size(f_fund_balance))
+def policy_withdrawal_dps(f_fund_balance, f_debt, f_power_price_index, f_cash_in, useinrbf_fund_withdrawal=1, useinrbf_debt_withdrawal=1, useinrbf_power_withdrawal=1, useinrbf_cashin_withdrawal=1, policy=None):
+  if policy is None:
+    policy = dps_policy
+  withdrawal = policy.withdraw(f_fund_balance, f_debt, f_power_price_index, f_cash_in,
+                               (useinrbf_fund_withdrawal, useinrbf_debt_withdrawal, useinrbf_power_withdrawal, useinrbf_cashin_withdrawal))
+  return withdrawal[()]
+
 
 
-### get withdrawal/deposit each year from dps policy based on current conditions
-def policy_withdrawal_dps(f_fund_balance, f_debt, f_power_price_index, f_cash_in, useinrbf_fund_withdrawal=1, useinrbf_debt_withdrawal=1, useinrbf_power_withdrawal=1, useinrbf_cashin_withdrawal=1):
-  decision_order = 1
-  cash_out = 0
-  for i in range(NUM_RBF):
-    # sum RBFs
-    if (SHARED_RBFS == 0):
-      arg_exp = -((f_fund_balance * useinrbf_fund_withdrawal / NORMALIZE_FUND - dv_c[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i]) ** 2) \
-                    / (dv_b[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i]) ** 2\
-                -((f_debt * useinrbf_debt_withdrawal / NORMALIZE_FUND - dv_c[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i + 1]) ** 2) \
-                    / (dv_b[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i + 1]) ** 2\
-                -((f_power_price_index * useinrbf_power_withdrawal / NORMALIZE_POWER_PRICE - dv_c[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i + 2]) ** 2) \
-                    / (dv_b[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i + 2]) ** 2\
-                -(((f_cash_in * useinrbf_cashin_withdrawal + NORMALIZE_REVENUE) / (2 * NORMALIZE_REVENUE) - dv_c[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i + 3]) ** 2) \
-                    / (dv_b[(decision_order * NUM_INPUTS_RBF * NUM_RBF) + NUM_INPUTS_RBF * i + 3]) ** 2
-      cash_out += dv_w[decision_order * NUM_RBF + i] * np.exp(arg_exp)
-    elif (SHARED_RBFS == 1):
-      arg_exp = -((f_fund_balance * useinrbf_fund_withdrawal / NORMALIZE_FUND - dv_c[NUM_INPUTS_RBF * i]) ** 2) \
-                    / (dv_b[NUM_INPUTS_RBF * i]) ** 2\
-                -((f_debt * useinrbf_debt_withdrawal / NORMALIZE_FUND - dv_c[NUM_INPUTS_RBF * i + 1]) ** 2) \
-                    / (dv_b[NUM_INPUTS_RBF * i + 1]) ** 2\
-                -((f_power_price_index * useinrbf_power_withdrawal / NORMALIZE_POWER_PRICE - dv_c[NUM_INPUTS_RBF * i + 2]) ** 2) \
-                    / (dv_b[NUM_INPUTS_RBF * i + 2]) ** 2\
-                -(((f_cash_in * useinrbf_cashin_withdrawal + NORMALIZE_REVENUE) / (2 * NORMALIZE_REVENUE) - dv_c[NUM_INPUTS_RBF * i + 3]) ** 2) \
-                    / (dv_b[NUM_INPUTS_RBF * i + 3]) ** 2
-      cash_out += dv_w[decision_order * NUM_RBF + i] * np.exp(arg_exp)
-    else:
-      cash_out += 0
-  # add constant term
-  cash_out += dv_a[decision_order]
-  # now scale back to [-NORMALIZE_REVENUE,NORMALIZE_REVENUE]
-  cash_out = max(min((cash_out * 2 * NORMALIZE_REVENUE) - NORMALIZE_REVENUE, NORMALIZE_REVENUE), -NORMALIZE_REVENUE)
-  # now write as withdrawal for policy return
-  withdrawal = cash_out - f_cash_in
-  # ensure that cant withdraw more than fund balance
-  if (withdrawal > EPS):
-    withdrawal = min(withdrawal, f_fund_balance)
-  elif (withdrawal < -EPS):
-    withdrawal = max(withdrawal, -max(f_cash_in, 0))
-  if ((f_fund_balance - withdrawal) > dv_d[decision_order] * NORMALIZE_FUND):
-    withdrawal = (f_fund_balance - (dv_d[decision_order] * NORMALIZE_FUND))
-  return withdrawal
 
 
 ### get hedging contract slope each year from static 2-dv policy based on current conditions
+@functions_instrumentation.instrument('policy_cashflow_post_withdrawal_2dv', items=lambda fund_balance, *args, **kwargs: np.size(fund_balance))
 def policy_cashflow_post_withdrawal_2dv(fund_balance, cash_in, cashflow_target, maxFund):
-  if (cash_in < cashflow_target):
-    if (fund_balance < EPS):
-      x = cash_in
-    else:
-      x = min(cash_in + fund_balance, cashflow_target)
+  # (works elementwise if fund_balance & cash_in are arrays)
+  x = np.where(cash_in < cashflow_target,
+               np.where(fund_balance < EPS, cash_in, np.minimum(cash_in + fund_balance, cashflow_target)),
+               np.where(fund_balance > (maxFund - EPS), cash_in + (fund_balance - maxFund),
+                        np.maximum(cash_in - (maxFund - fund_balance), cashflow_target)))
+  return(x[()])
+
+
+
+
+######################## policy bank: decode & simulate many dps policies at once ############################
+
+### get lengths of dv_d, dv_c, dv_b, dv_w, dv_a blocks in decision variable vector (same layout as get_dvs)
+def get_dv_lengths():
+  n_d = NUM_DECISIONS_TOTAL
+  if (SHARED_RBFS == 0):
+    n_c = NUM_RBF * NUM_INPUTS_RBF * NUM_DECISIONS_TOTAL
   else:
-    if (fund_balance > (maxFund - EPS)):
-      x = cash_in + (fund_balance - maxFund)
-    else:
-      x = max(cash_in - (maxFund - fund_balance), cashflow_target)
-  return(x)
+    n_c = NUM_RBF * NUM_INPUTS_RBF
+  if (SHARED_RBFS == 2):
+    n_w = NUM_RBF
+  else:
+    n_w = NUM_RBF * NUM_DECISIONS_TOTAL
+  n_a = NUM_DECISIONS_TOTAL
+  return (n_d, n_c, n_c, n_w, n_a)
+
+
+
+### decode every row of a solution set (dataframe from get_set, or array with dvs in first NUM_DV columns) into stacked arrays.
+###   Returns dict with centers & inv_radii_sq (policies x decisions x rbfs x 4 inputs), weights (policies x decisions x rbfs,
+###   normalized to sum to 1 as in get_dvs), and dv_a & dv_d (policies x decisions). Inputs are always (fund, debt, power, cash_in);
+###   inputs not used by a decision have zero inverse radius, decisions without rbfs (SHARED_RBFS==2 withdrawal) have zero weights.
+def get_policy_bank(dps):
+  dvs = np.atleast_2d(np.asarray(dps, dtype=float)[..., :NUM_DV])
+  npol = dvs.shape[0]
+  n_d, n_c, n_b, n_w, n_a = get_dv_lengths()
+  dv_d = dvs[:, :n_d]
+  dv_c = dvs[:, n_d:(n_d + n_c)]
+  dv_b = np.maximum(dvs[:, (n_d + n_c):(n_d + n_c + n_b)], EPS)
+  dv_w = dvs[:, (n_d + n_c + n_b):(n_d + n_c + n_b + n_w)]
+  dv_a = dvs[:, (n_d + n_c + n_b + n_w):(n_d + n_c + n_b + n_w + n_a)]
+
+  centers = np.zeros([npol, NUM_DECISIONS_TOTAL, NUM_RBF, 4])
+  inv_radii_sq = np.zeros([npol, NUM_DECISIONS_TOTAL, NUM_RBF, 4])
+  weights = np.zeros([npol, NUM_DECISIONS_TOTAL, NUM_RBF])
+  if (SHARED_RBFS == 0):
+    centers[:, :, :, :NUM_INPUTS_RBF] = dv_c.reshape([npol, NUM_DECISIONS_TOTAL, NUM_RBF, NUM_INPUTS_RBF])
+    inv_radii_sq[:, :, :, :NUM_INPUTS_RBF] = 1 / dv_b.reshape([npol, NUM_DECISIONS_TOTAL, NUM_RBF, NUM_INPUTS_RBF]) ** 2
+  else:
+    centers[:, :, :, :NUM_INPUTS_RBF] = dv_c.reshape([npol, 1, NUM_RBF, NUM_INPUTS_RBF])
+    inv_radii_sq[:, :, :, :NUM_INPUTS_RBF] = 1 / dv_b.reshape([npol, 1, NUM_RBF, NUM_INPUTS_RBF]) ** 2
+  # hedge decision never uses cash_in input
+  inv_radii_sq[:, 0, :, 3] = 0.
+  if (SHARED_RBFS == 2):
+    weights[:, 0, :] = dv_w
+  else:
+    weights[:, :, :] = dv_w.reshape([npol, NUM_DECISIONS_TOTAL, NUM_RBF])
+  # normalize weights
+  wsum = weights.sum(axis=2, keepdims=True)
+  weights = np.where(wsum > 0, weights / np.where(wsum > 0, wsum, 1.), weights)
+
+  return {'centers': centers, 'inv_radii_sq': inv_radii_sq, 'weights': weights, 'dv_a': dv_a, 'dv_d': dv_d}
+
+
+
+### get subset of policies from policy bank (idx = slice or array of policy indices)
+def get_policy_bank_subset(bank, idx):
+  return {k: v[idx] for k, v in bank.items()}
+
+
+
+### hedge & withdrawal decisions for all policies in bank. state inputs are (n_policies, n_samples) arrays.
+def get_policy_bank_kernel_args(bank):
+  # move policy axis last & add sample axis, so policy arrays broadcast against (n_policies, n_samples) states
+  return [np.moveaxis(bank[k], 0, -1)[..., np.newaxis] for k in ['centers', 'inv_radii_sq', 'weights', 'dv_a', 'dv_d']]
+
+
+def policy_hedge_bank(bank, f_fund_balance, f_debt, f_power_price_index, useinrbf=(1, 1, 1)):
+  return rbf_hedge(*get_policy_bank_kernel_args(bank), f_fund_balance, f_debt, f_power_price_index, useinrbf)
+
+
+def policy_withdrawal_bank(bank, f_fund_balance, f_debt, f_power_price_index, f_cash_in, useinrbf=(1, 1, 1, 1)):
+  return rbf_withdrawal(*get_policy_bank_kernel_args(bank), f_fund_balance, f_debt, f_power_price_index, f_cash_in, useinrbf)
+
+
+
+### simulate every policy in bank over shared set of sample trajectories. revenue, payout, power are (n_samples, ny+1) arrays,
+###   as in simulate_batch. Returns same ten outputs as simulate(), each as (n_policies, n_samples, ny) array.
+@functions_instrumentation.instrument('simulate_policy_bank', items=lambda bank, revenue, *args, **kwargs: bank['dv_a'].shape[0] * revenue.shape[0])
+def simulate_policy_bank(bank, revenue, payout, power, interest_fund=None, interest_debt=None):
+  if interest_fund is None:
+    interest_fund = INTEREST_FUND
+  if interest_debt is None:
+    interest_debt = INTEREST_DEBT
+  npol = bank['dv_a'].shape[0]
+  ns = revenue.shape[0]
+  ny = revenue.shape[1] - 1
+  net_rev = revenue - MEAN_REVENUE * fixed_cost
+  fund = np.zeros([npol, ns, ny + 1])
+  debt = np.zeros([npol, ns, ny + 1])
+  final_cashflow = np.zeros([npol, ns, ny])
+  withdrawal = np.zeros([npol, ns, ny])
+  value_snow_contract = np.zeros([npol, ns, ny])
+  cash_in = np.zeros([npol, ns, ny])
+
+  for i in range(ny):
+    value_snow_contract[:, :, i] = policy_hedge_bank(bank, fund[:, :, i], debt[:, :, i], power[np.newaxis, :, i])
+    cash_in[:, :, i] = net_rev[:, i+1] + value_snow_contract[:, :, i] * payout[:, i+1] - debt[:, :, i] * interest_debt
+    withdrawal[:, :, i] = policy_withdrawal_bank(bank, fund[:, :, i]*interest_fund, debt[:, :, i]*interest_debt,
+                                                 power[np.newaxis, :, i+1], cash_in[:, :, i])
+    final_cashflow[:, :, i] = cash_in[:, :, i] + withdrawal[:, :, i]
+    fund[:, :, i+1] = fund[:, :, i]*interest_fund - withdrawal[:, :, i]
+    borrow = final_cashflow[:, :, i] < -EPS
+    debt[:, :, i+1][borrow] = -final_cashflow[:, :, i][borrow]
+    final_cashflow[:, :, i][borrow] = 0
+
+  power_hedge = np.broadcast_to(power[:, :-1], [npol, ns, ny])
+  power_withdrawal = np.broadcast_to(power[:, 1:], [npol, ns, ny])
+  return (fund[:, :, :-1], fund[:, :, :-1]*interest_fund, debt[:, :, :-1], debt[:, :, :-1]*interest_debt, power_hedge, power_withdrawal,
+          cash_in, value_snow_contract, withdrawal, final_cashflow)
+
+
+
+### simulate_policy_bank over chunks of policies in a pool of processes (default one per core, ~4 chunks per process).
+###   Returns same outputs, with policies in bank order.
+def simulate_policy_bank_parallel(bank, revenue, payout, power, nprocs=None, policies_per_chunk=None, interest_fund=None, interest_debt=None):
+  npol = bank['dv_a'].shape[0]
+  if nprocs is None:
+    nprocs = multiprocessing.cpu_count()
+  if policies_per_chunk is None:
+    policies_per_chunk = int(np.ceil(npol / (4 * nprocs)))
+  chunks = [get_policy_bank_subset(bank, slice(start, start + policies_per_chunk)) for start in range(0, npol, policies_per_chunk)]
+  with multiprocessing.Pool(nprocs) as pool:
+    results = pool.starmap(simulate_policy_bank, [(chunk, revenue, payout, power, interest_fund, interest_debt) for chunk in chunks])
+  return tuple(np.concatenate([r[k] for r in results], axis=0) for k in range(10))
 
 
 
@@ -938,7 +1190,7 @@ def plot_example_simulation(ref_2dv_2obj_retest, ref_dps_2obj_retest, fig_format
     policy = policies[j]
     dps_run_type = dps_run_types[j]
     if dps_run_type == 1:
-      dv_d, dv_c, dv_b, dv_w, dv_a = get_dvs(policy)
+      policy = RBFPolicy(policy)
 
     ### loop over realizations
     for i in range(2):
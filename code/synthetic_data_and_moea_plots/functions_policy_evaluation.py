@@ -0,0 +1,1067 @@
+##############################################################################################################
+### functions_policy_evaluation.py - python version of the portfolioProblem objective evaluation in main.cpp, for re-evaluating
+###     (retesting) sets of policies without rebuilding the C++ model. Vectorized across samples & policies.
+##############################################################################################################
+import os
+import numpy as np
+import pandas as pd
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+### Project functions ###
+import functions_moea_output_plots
+import functions_simulation_kernels
+import functions_stochastic_inputs
+import functions_instrumentation
+
+dir_generated_inputs = './../../data/generated_inputs/'
+
+
+##################################################################
+#### Constants, consistent with C++ version used for optimization (others shared with functions_moea_output_plots)
+##################################################################
+NUM_YEARS = 20                        # 20yr sims
+NUM_SAMPLES = 50000
+NUM_LINES_STOCHASTIC_INPUT = 999999   # synthetic_data.txt has 1M rows
+NUM_PARAM_SAMPLES = 151               # number of LHC samples in param file. Last line is values for SFPUC, Oct 2016.
+MIN_SNOW_CONTRACT = 0.05              # DPS_RUN_TYPE==0 only: if contract slope dv < $0.05M/inch, act as if 0.
+MIN_MAX_FUND = 0.05                   # DPS_RUN_TYPE==0 only: if max fund dv < $0.05M, act as if 0.
+EPS_CONS1 = 0.05                      # max average debt increase in final year, for debt-steal constraint
+Q_MAX_DEBT = 0.95                     # quantile of max debt used in objective
+MAX_CHUNK_ELEMENTS = 1000000          # max policies*samples evaluated at once, to bound memory use
+SAMPLES_PER_CHUNK = 10000             # samples per chunk for streaming evaluation
+QUANTILE_SKETCH_ACCURACY = 0.0005     # streaming evaluation only: relative accuracy of max debt quantile sketch
+QUANTILE_SKETCH_MIN_VALUE = 0.001     # streaming evaluation only: max debt values <= this ($M) counted as zero
+QUANTILE_SKETCH_MAX_VALUE = 10000.    # streaming evaluation only: max debt values above this ($M) counted in top bucket
+RACING_INITIAL_SAMPLES = 1000        # racing evaluation only: samples in first batch (doubled each batch after)
+RACING_CONFIDENCE_Z = 3.              # racing evaluation only: policy dropped if dominated at this many standard errors
+ESTIMATOR_BATCHES = 20                # estimator variance only: batches of sample windows for variance of q95 max debt
+ESTIMATOR_CONTROL_MIN_VARIANCE = 1e-4 # control variate unused (beta 0) if its variance is below this fraction of objective's
+INPUT_MASK_NAMES = ['fund_hedge', 'debt_hedge', 'power_hedge', 'fund_withdrawal', 'debt_withdrawal', 'power_withdrawal',
+                    'cashin_withdrawal']   # rbf inputs that can be left out (useinrbf masks), as USEINRBF_* in main.cpp
+SEED_SAMPLE_RETEST = 2                # seed_sample used to retest optimization output (run_retest_ref.sh)
+SAMPLE_PLAN_MAGIC = 1314014032        # sample plan file header (int32 values): magic ('PCRN'), version, seed_sample, num_samples,
+SAMPLE_PLAN_VERSION = 1               #   NUM_LINES_STOCHASTIC_INPUT, NUM_YEARS, 2 unused. Then num_samples int32 lines_to_use.
+SAMPLE_PLAN_HEADER_SIZE = 8           #   Same format read by main.cpp with SAMPLE_PLAN_MODE 1.
+BACKTEST_METRIC_NAMES = ['annualized_cashflow', 'max_debt', 'debt_steal', 'min_cashflow', 'hedge_frequency',
+                         'max_fund_balance']   # metrics (from get_sample_metrics) on last axis of historical backtest cube
+OBJECTIVE_EPSILONS = {'annRev': 0.075, 'maxDebt': 0.225, 'minRev': 0.225, 'maxComplex': 0.05,
+                      'maxFund': 0.225}   # borg epsilons, as EPS_* in main.cpp
+
+MEAN_REVENUE = functions_moea_output_plots.MEAN_REVENUE
+EPS = functions_moea_output_plots.EPS
+
+
+
+
+##################################################################
+#### Inputs: synthetic data, financial parameters, sample plan
+##################################################################
+
+### read synthetic data used by moea (revenue, snow contract payout, power price index), as (NUM_LINES, 3) array. Memory-mapped
+###   from synthetic_data.bin if current (see functions_stochastic_inputs.use_synthetic_data_binary), else read from text.
+###   name gives other synthetic data files (e.g. synthetic_data_antithetic).
+def get_stochastic_input(dir_generated_inputs=dir_generated_inputs, name=functions_stochastic_inputs.SYNTHETIC_DATA_NAME):
+  if functions_stochastic_inputs.use_synthetic_data_binary(dir_generated_inputs, name):
+    return functions_stochastic_inputs.get_synthetic_data_array(dir_generated_inputs + name + '.bin')
+  samp = pd.read_csv(dir_generated_inputs + name + '.txt', delimiter=' ')
+  return samp.iloc[:, :3].values
+
+
+
+### synthetic data & its antithetic twin (synthetic_data_antithetic, from make_synthetic_data_streaming.py), as (NUM_LINES, 6)
+###   array (copied into memory) with the twin in columns 3-5, for antithetic estimates (see evaluate_objectives_estimator)
+def get_stochastic_input_antithetic(dir_generated_inputs=dir_generated_inputs):
+  name = functions_stochastic_inputs.SYNTHETIC_DATA_NAME
+  return np.column_stack([get_stochastic_input(dir_generated_inputs, name),
+                          get_stochastic_input(dir_generated_inputs, name + functions_stochastic_inputs.ANTITHETIC_SUFFIX)])
+
+
+
+### read LHC sample of financial parameters (c, delta, Delta_fund, Delta_debt, lam, lam_prem_shift). Last row = SFPUC baseline.
+def get_param_samples(dir_generated_inputs=dir_generated_inputs):
+  return pd.read_csv(dir_generated_inputs + 'param_LHC_sample_withLamPremShift.txt', sep=' ').iloc[:NUM_PARAM_SAMPLES, :]
+
+
+
+### get params used in portfolioProblem from one row of LHC sample (default = SFPUC baseline), as in main.cpp
+def get_financial_params(param_samples, lhc_set=-1):
+  param = param_samples.iloc[lhc_set, :]
+  delta = param['delta']
+  return {'cost_fraction': param['c'],
+          'discount_rate': 1. / (delta / 100. + 1.),
+          'interest_fund': (param['Delta_fund'] + delta) / 100. + 1.,
+          'interest_debt': (param['Delta_debt'] + delta) / 100. + 1.,
+          'lambda_prem_shift': param['lam_prem_shift']}
+
+
+
+### params for several rows of LHC sample (default all), each as (n_lhc_sets,) array. Objective functions below broadcast over
+###   leading axis of params like this, evaluating every policy under every param sample while sharing sample windows.
+def get_financial_params_samples(param_samples, lhc_sets=None):
+  if lhc_sets is None:
+    lhc_sets = range(param_samples.shape[0])
+  params = [get_financial_params(param_samples, lhc_set) for lhc_set in lhc_sets]
+  return {k: np.array([param[k] for param in params]) for k in params[0].keys()}
+
+
+
+### reproduce sequence from C library srand(seed)/rand() (glibc TYPE_3 additive feedback generator), so python evaluations
+###   can use the exact sample plan from the C++ model run with a given seed_sample
+def get_rand_glibc(seed, n):
+  r = np.zeros(n + 344, dtype=np.int64)
+  r[0] = seed if seed != 0 else 1
+  for i in range(1, 31):
+    r[i] = (16807 * r[i - 1]) % 2147483647
+  for i in range(31, 34):
+    r[i] = r[i - 31]
+  for i in range(34, n + 344):
+    r[i] = (r[i - 31] + r[i - 3]) % 4294967296
+  return (r[344:] >> 1).astype(np.int64)
+
+
+
+### get starting lines of sampled 20-yr windows, as lines_to_use in main.cpp (can't be 0, since need power index for year before)
+def get_lines_to_use(seed_sample, num_samples=NUM_SAMPLES):
+  return get_rand_glibc(seed_sample, num_samples) % (NUM_LINES_STOCHASTIC_INPUT - NUM_YEARS - 1) + 1
+
+
+
+### sample plan file for seed_sample, shared by main.cpp & python evaluations so all use identical sample windows
+def get_sample_plan_filename(seed_sample, dir_generated_inputs=dir_generated_inputs):
+  return dir_generated_inputs + 'sample_plan_seedS' + str(seed_sample) + '.bin'
+
+
+
+### write lines_to_use for seed_sample to sample plan file (written to temp file then renamed, so readers never see partial file)
+def write_sample_plan(filename, seed_sample, num_samples=NUM_SAMPLES):
+  header = np.zeros(SAMPLE_PLAN_HEADER_SIZE, dtype='<i4')
+  header[:6] = [SAMPLE_PLAN_MAGIC, SAMPLE_PLAN_VERSION, seed_sample, num_samples, NUM_LINES_STOCHASTIC_INPUT, NUM_YEARS]
+  filename_temp = filename + '.' + str(os.getpid()) + '.tmp'
+  with open(filename_temp, 'wb') as f:
+    header.tofile(f)
+    get_lines_to_use(seed_sample, num_samples).astype('<i4').tofile(f)
+  os.replace(filename_temp, filename)
+
+
+
+### header of sample plan file as dict, or None if file missing or not a sample plan of current version
+def get_sample_plan_header(filename):
+  if not os.path.exists(filename):
+    return None
+  header = np.fromfile(filename, dtype='<i4', count=SAMPLE_PLAN_HEADER_SIZE)
+  if (header.shape[0] < SAMPLE_PLAN_HEADER_SIZE) or (header[0] != SAMPLE_PLAN_MAGIC) or (header[1] != SAMPLE_PLAN_VERSION):
+    return None
+  return {'seed_sample': int(header[2]), 'num_samples': int(header[3]), 'num_lines_stochastic_input': int(header[4]),
+          'num_years': int(header[5])}
+
+
+
+### memory-map lines_to_use (read-only int32) from sample plan file
+def read_sample_plan(filename):
+  header = get_sample_plan_header(filename)
+  if header is None:
+    raise ValueError('Not a sample plan file (version ' + str(SAMPLE_PLAN_VERSION) + '): ' + filename)
+  return np.memmap(filename, dtype='<i4', mode='r', offset=SAMPLE_PLAN_HEADER_SIZE * 4, shape=(header['num_samples'],))
+
+
+
+### get first num_samples lines_to_use for seed_sample from sample plan file, writing the file first if it doesn't exist, is
+###   too short, or was made for different inputs. Same values as get_lines_to_use (a longer plan starts with the shorter one).
+def get_sample_plan(seed_sample, num_samples=NUM_SAMPLES, dir_generated_inputs=dir_generated_inputs):
+  filename = get_sample_plan_filename(seed_sample, dir_generated_inputs)
+  header = get_sample_plan_header(filename)
+  if (header is None) or (header['seed_sample'] != seed_sample) or (header['num_samples'] < num_samples) or \
+     (header['num_lines_stochastic_input'] != NUM_LINES_STOCHASTIC_INPUT) or (header['num_years'] != NUM_YEARS):
+    write_sample_plan(filename, seed_sample, max(num_samples, NUM_SAMPLES))
+  return read_sample_plan(filename)[:num_samples]
+
+
+
+### get (num_samples, NUM_YEARS+1) windows of revenue, payout, power index for sample plan. Column 0 is the year before the
+###   window (only power index used), consistent with simulate_batch.
+def get_sample_inputs(stochastic_input, lines_to_use, ny=NUM_YEARS):
+  windows = functions_moea_output_plots.get_sample_windows(stochastic_input[:, 0], stochastic_input[:, 1], stochastic_input[:, 2],
+                                                           np.asarray(lines_to_use) - 1, ny)
+  return tuple(w.astype(float, copy=False) for w in windows)   # float64 even if stored as float32, as main.cpp
+
+
+
+
+##################################################################
+#### Objectives
+##################################################################
+
+### decode policies from rows of decision variables. dps formulations give a policy bank, 2dv formulation an (n_policies, 2)
+###   array of (max fund, contract slope) with minimum size thresholds applied.
+def get_policies(dvs, dps_run_type=None):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  if dps_run_type > 0:
+    return functions_moea_output_plots.get_policy_bank(dvs)
+  else:
+    dvs = np.atleast_2d(np.asarray(dvs, dtype=float)[..., :2])
+    return np.where(dvs < [MIN_MAX_FUND, MIN_SNOW_CONTRACT], 0., dvs)
+
+
+
+### number of policies in output of get_policies
+def get_num_policies(policies):
+  if isinstance(policies, dict):
+    return policies['dv_a'].shape[0]
+  else:
+    return policies.shape[0]
+
+
+
+### withdrawal (+)/deposit (-) for 2dv formulation, as policyWithdrawal_2dv in main.cpp (works elementwise on arrays)
+def policy_withdrawal_2dv(f_fund_balance, f_cash_in, f_max_fund_size):
+  withdrawal = np.where(f_cash_in < -EPS,
+                        np.where(f_fund_balance < EPS, 0., np.minimum(-f_cash_in, f_fund_balance)),
+                        np.where(f_fund_balance > (f_max_fund_size - EPS), f_fund_balance - f_max_fund_size,
+                                 np.maximum(-(f_max_fund_size - f_fund_balance), -f_cash_in)))
+  return withdrawal
+
+
+
+### simulate policies over sample windows (from get_sample_inputs), returning per-sample metrics aggregated into objectives
+###   by portfolioProblem, each as (n_policies, n_samples) array: annualized_cashflow, max_debt, debt_steal, min_cashflow,
+###   hedge_frequency, max_fund_balance. For dps policies, backend (default SIMULATION_BACKEND in functions_moea_output_plots)
+###   selects compiled or numpy simulation, with identical results. Params can be scalars (from get_financial_params) or arrays
+###   of the same shape (e.g. from get_financial_params_samples), in which case metrics are (param_shape..., n_policies, n_samples).
+###   Similarly useinrbf (dps only) can be input masks (..., 7) for INPUT_MASK_NAMES (e.g. from get_input_masks), with leading
+###   axes broadcast against params (scenario shape, see get_scenario_shape).
+@functions_instrumentation.instrument('get_sample_metrics', items=lambda policies, revenue, *args, **kwargs: get_num_policies(policies) * revenue.shape[0])
+def get_sample_metrics(policies, revenue, payout, power, params, dps_run_type=None, backend=None, useinrbf=None):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  if backend is None:
+    backend = functions_moea_output_plots.SIMULATION_BACKEND
+  npol = get_num_policies(policies)
+  ns = revenue.shape[0]
+  ny = revenue.shape[1] - 1
+  scenario_shape = get_scenario_shape(params, useinrbf)
+  state_shape = scenario_shape + (npol, ns)
+  if useinrbf is None:
+    useinrbf = np.ones(len(INPUT_MASK_NAMES))
+  useinrbf = np.broadcast_to(useinrbf, scenario_shape + (len(INPUT_MASK_NAMES),))
+
+  if dps_run_type > 0 and functions_simulation_kernels.use_compiled(backend):
+    # compiled kernel takes one set of params & masks, so loop over scenarios (sample windows shared)
+    params = {k: np.broadcast_to(params[k], scenario_shape) for k in params.keys()}
+    metrics = [get_sample_metrics_compiled(policies, revenue, payout, power, {k: params[k][j] for k in params.keys()}, dps_run_type,
+                                           useinrbf[j]) for j in np.ndindex(scenario_shape)]
+    return {k: np.stack([m[k] for m in metrics]).reshape(state_shape) for k in metrics[0].keys()}
+
+  # params & input masks with trailing axes for policies & samples
+  param_shape = np.shape(params['interest_fund'])
+  interest_fund, interest_debt, cost_fraction, lambda_prem_shift = \
+    [np.reshape(params[k], param_shape + (1, 1)) for k in ['interest_fund', 'interest_debt', 'cost_fraction', 'lambda_prem_shift']]
+  useinrbf = [useinrbf[..., j, np.newaxis, np.newaxis] for j in range(len(INPUT_MASK_NAMES))]
+
+  # create discounting factor
+  discount_factor = np.reshape(params['discount_rate'], param_shape + (1, 1, 1)) ** np.arange(1, ny + 1)
+  discount_normalization = 1.0 / np.sum(discount_factor, axis=-1)
+
+  if dps_run_type > 0:
+    kernel_args = functions_moea_output_plots.get_policy_bank_kernel_args(policies)
+    hedge_frequency = np.zeros(state_shape, dtype=bool)
+  else:
+    fixed_max_fund = policies[:, 0, np.newaxis]
+    fixed_snow_contract_slope = policies[:, 1, np.newaxis]
+    hedge_frequency = np.broadcast_to(fixed_snow_contract_slope > EPS, state_shape)
+
+  fund_balance = np.zeros(state_shape)
+  debt = np.zeros(state_shape)
+  debt_prev = np.zeros(state_shape)
+  max_fund_balance = np.zeros(state_shape)
+  max_debt = np.zeros(state_shape)
+  min_cashflow = np.full(state_shape, np.inf)
+  annualized_cashflow = np.zeros(state_shape)
+
+  for i in range(ny):
+    net_rev = revenue[:, i+1] - MEAN_REVENUE * cost_fraction
+    net_payout = payout[:, i+1] - lambda_prem_shift
+    # find next policy-derived index insurance and reserve fund withdrawal
+    if dps_run_type > 0:
+      snow_contract_slope = functions_moea_output_plots.rbf_hedge(*kernel_args, fund_balance, debt, power[:, i], useinrbf[:3])
+      hedge_frequency |= np.abs(snow_contract_slope) > EPS
+      cash_in = net_rev + snow_contract_slope * net_payout - debt * interest_debt
+      fund_withdrawal = functions_moea_output_plots.rbf_withdrawal(*kernel_args, fund_balance * interest_fund, debt * interest_debt,
+                                                                   power[:, i+1], cash_in, useinrbf[3:])
+    else:
+      cash_in = net_rev + fixed_snow_contract_slope * net_payout - debt * interest_debt
+      fund_withdrawal = policy_withdrawal_2dv(fund_balance * interest_fund, cash_in, fixed_max_fund)
+    adjusted_revenue = cash_in + fund_withdrawal
+
+    debt_prev = debt
+    if dps_run_type < 2:
+      borrow = adjusted_revenue < -EPS
+      debt = np.where(borrow, -adjusted_revenue, 0.)
+      adjusted_revenue = np.where(borrow, 0., adjusted_revenue)
+    fund_balance = fund_balance * interest_fund - fund_withdrawal
+
+    annualized_cashflow += adjusted_revenue * discount_factor[..., i]
+    max_fund_balance = np.maximum(max_fund_balance, fund_balance)
+    max_debt = np.maximum(max_debt, debt)
+    min_cashflow = np.minimum(min_cashflow, adjusted_revenue)
+
+  annualized_cashflow = discount_normalization * (annualized_cashflow + ((fund_balance * interest_fund * discount_factor[..., 0]) -
+                                                                          (debt * interest_debt * discount_factor[..., 0])) *
+                                                  discount_factor[..., ny - 1])
+
+  return {'annualized_cashflow': annualized_cashflow, 'max_debt': max_debt, 'debt_steal': debt - debt_prev,
+          'min_cashflow': min_cashflow, 'hedge_frequency': hedge_frequency.astype(float), 'max_fund_balance': max_fund_balance}
+
+
+
+### get_sample_metrics for dps policies with compiled kernel, for one set of (scalar) params & one input mask
+def get_sample_metrics_compiled(policies, revenue, payout, power, params, dps_run_type, useinrbf):
+  ny = revenue.shape[1] - 1
+  net_rev = revenue - MEAN_REVENUE * params['cost_fraction']
+  net_payout = payout - params['lambda_prem_shift']
+  discount_factor = params['discount_rate'] ** np.arange(1, ny + 1)
+  discount_normalization = 1.0 / np.sum(discount_factor)
+  metrics = functions_simulation_kernels.sample_metrics_dps_kernel(
+    net_rev, net_payout, np.asarray(power, dtype=float), policies['centers'], policies['inv_radii_sq'], policies['weights'],
+    policies['dv_a'], policies['dv_d'], np.asarray(useinrbf[:3], dtype=float), np.asarray(useinrbf[3:], dtype=float), discount_factor,
+    discount_normalization, params['interest_fund'], params['interest_debt'], dps_run_type == 2, functions_moea_output_plots.NORMALIZE_FUND, functions_moea_output_plots.NORMALIZE_POWER_PRICE,
+    functions_moea_output_plots.NORMALIZE_REVENUE, functions_moea_output_plots.NORMALIZE_SNOW_CONTRACT_SIZE, EPS)
+  return dict(zip(['annualized_cashflow', 'max_debt', 'debt_steal', 'min_cashflow', 'hedge_frequency', 'max_fund_balance'], metrics))
+
+
+
+### shape of leading (scenario) axes of metrics & objectives: param arrays broadcast against input masks (without mask axis)
+def get_scenario_shape(params, useinrbf=None):
+  if useinrbf is None:
+    return np.shape(params['interest_fund'])
+  return np.broadcast_shapes(np.shape(params['interest_fund']), np.shape(useinrbf)[:-1])
+
+
+
+### all 2^7 input masks (1 = use input, 0 = leave out) for INPUT_MASK_NAMES, starting with all inputs used
+def get_input_masks():
+  return np.array(list(itertools.product([1., 0.], repeat=len(INPUT_MASK_NAMES))))
+
+
+
+### upper tail quantile of each row, as boost tail_quantile<right> accumulator in main.cpp: the n-th largest value,
+###   with n = ceil(n_samples * (1 - q))
+def get_tail_quantile(x, q=Q_MAX_DEBT):
+  n = int(np.ceil(x.shape[-1] * (1. - q)))
+  return -np.partition(-x, n - 1, axis=-1)[..., n - 1]
+
+
+
+##################################################################
+#### Streaming quantile sketch for max debt objective (as MAX_DEBT_QUANTILE_MODE 1 in main.cpp)
+####   Log-spaced buckets (as DDSketch): bucket k>0 counts values in (min*gamma^(k-1), min*gamma^k], with
+####   gamma = (1+a)/(1-a) for relative accuracy a, and bucket 0 counts values <= min. Quantiles are returned as the midpoint
+####   2*min*gamma^k/(gamma+1) of the bucket holding the requested rank, so for quantiles in (min, max] the relative error is
+####   at most a (up to rounding at bucket edges), and below min the absolute error is at most min. Memory is fixed by
+####   (a, min, max) regardless of number of samples, and sketches of separate sample chunks sum to exactly the sketch of all
+####   samples, in any order.
+##################################################################
+
+### gamma & number of buckets for quantile sketch
+def get_quantile_sketch_size(relative_accuracy=QUANTILE_SKETCH_ACCURACY, min_value=QUANTILE_SKETCH_MIN_VALUE,
+                             max_value=QUANTILE_SKETCH_MAX_VALUE):
+  gamma = (1. + relative_accuracy) / (1. - relative_accuracy)
+  return gamma, int(np.ceil(np.log(max_value / min_value) / np.log(gamma))) + 1
+
+
+
+### bucket counts of each row of x (non-negative values, e.g. (n_policies, n_samples) max debt). Returns (..., n_buckets) array.
+def get_quantile_sketch(x, relative_accuracy=QUANTILE_SKETCH_ACCURACY, min_value=QUANTILE_SKETCH_MIN_VALUE,
+                        max_value=QUANTILE_SKETCH_MAX_VALUE):
+  gamma, nb = get_quantile_sketch_size(relative_accuracy, min_value, max_value)
+  x = np.asarray(x, dtype=float)
+  nrow = int(np.prod(x.shape[:-1]))
+  keys = np.zeros(x.shape, dtype=np.int64)
+  above = x > min_value
+  keys[above] = np.clip(np.ceil(np.log(x[above] / min_value) / np.log(gamma)), 1, nb - 1)
+  keys = keys.reshape(nrow, -1) + np.arange(nrow)[:, np.newaxis] * nb
+  return np.bincount(keys.ravel(), minlength=nrow * nb).reshape(x.shape[:-1] + (nb,))
+
+
+
+### upper tail quantile from sketch, with same rank as get_tail_quantile (n-th largest, n = ceil(n_samples * (1 - q)))
+def get_quantile_from_sketch(counts, q=Q_MAX_DEBT, relative_accuracy=QUANTILE_SKETCH_ACCURACY, min_value=QUANTILE_SKETCH_MIN_VALUE,
+                             max_value=QUANTILE_SKETCH_MAX_VALUE):
+  gamma, nb = get_quantile_sketch_size(relative_accuracy, min_value, max_value)
+  n = np.maximum(np.ceil(np.sum(counts, axis=-1) * (1. - q)), 1)
+  cumulative_from_top = np.cumsum(counts[..., ::-1], axis=-1)
+  key = nb - 1 - np.argmax(cumulative_from_top >= n[..., np.newaxis], axis=-1)
+  return np.where(key > 0, 2. * min_value * gamma ** key / (gamma + 1.), 0.)
+
+
+
+
+##################################################################
+#### Aggregate objectives
+##################################################################
+
+### reduce per-sample metrics to summary that can be merged across sample chunks (sums over samples, max debt sketch).
+###   If squares, also sums of squares ('<metric>_sq'), for standard errors of means.
+def get_metric_summary(metrics, squares=False):
+  summary = {k: np.sum(metrics[k], axis=-1) for k in ['annualized_cashflow', 'debt_steal', 'min_cashflow', 'hedge_frequency',
+                                                       'max_fund_balance']}
+  if squares:
+    summary.update({k + '_sq': np.sum(metrics[k] ** 2, axis=-1) for k in ['annualized_cashflow', 'min_cashflow', 'hedge_frequency',
+                                                                         'max_fund_balance']})
+  summary['num_samples'] = np.full(metrics['annualized_cashflow'].shape[:-1], metrics['annualized_cashflow'].shape[-1])
+  summary['max_debt_sketch'] = get_quantile_sketch(metrics['max_debt'])
+  return summary
+
+
+
+### merge summaries for same policies over different sample chunks
+def merge_metric_summaries(summaries):
+  return {k: np.sum([summary[k] for summary in summaries], axis=0) for k in summaries[0].keys()}
+
+
+
+### join summaries for different policies over same samples (policies on last axis, or before buckets for max debt sketch)
+def concatenate_metric_summaries(summaries):
+  return {k: np.concatenate([summary[k] for summary in summaries], axis=(-2 if k == 'max_debt_sketch' else -1))
+          for k in summaries[0].keys()}
+
+
+
+### aggregate merged summary into objectives & constraints, as get_objectives_from_metrics but with q95 max debt from sketch
+def get_objectives_from_summary(summary, dps_run_type=None, num_objectives=functions_moea_output_plots.NUM_OBJECTIVES):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  ns = summary['num_samples']
+  objs = [-summary['annualized_cashflow'] / ns]
+  if dps_run_type < 2:
+    objs.append(get_quantile_from_sketch(summary['max_debt_sketch']))
+  else:
+    objs.append(-summary['min_cashflow'] / ns)
+  if num_objectives > 2:
+    objs.append(summary['hedge_frequency'] / ns)
+    objs.append(summary['max_fund_balance'] / ns)
+  if dps_run_type < 2:
+    constraints = np.maximum(0.0, summary['debt_steal'] / ns - EPS_CONS1)[..., np.newaxis]
+  else:
+    constraints = np.zeros(ns.shape + (0,))
+  return np.stack(objs, axis=-1), constraints
+
+
+
+### objective names (as columns of get_set), for formulation dps_run_type with num_objectives
+def get_objective_names(dps_run_type=None, num_objectives=functions_moea_output_plots.NUM_OBJECTIVES):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  return ['annRev', 'maxDebt' if dps_run_type < 2 else 'minRev', 'maxComplex', 'maxFund'][:num_objectives]
+
+
+
+### aggregate per-sample metrics into objectives & constraints, as problem_objs & problem_constraints in portfolioProblem
+###   (annualized cashflow negated for minimization). Returns (n_policies, num_objectives) & (n_policies, num_constraints) arrays
+###   (with leading param axes if metrics have them).
+def get_objectives_from_metrics(metrics, dps_run_type=None, num_objectives=functions_moea_output_plots.NUM_OBJECTIVES):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  objs = [-np.mean(metrics['annualized_cashflow'], axis=-1)]
+  if dps_run_type < 2:
+    objs.append(get_tail_quantile(metrics['max_debt']))
+  else:
+    objs.append(-np.mean(metrics['min_cashflow'], axis=-1))
+  if num_objectives > 2:
+    objs.append(np.mean(metrics['hedge_frequency'], axis=-1))
+    objs.append(np.mean(metrics['max_fund_balance'], axis=-1))
+  if dps_run_type < 2:
+    constraints = np.maximum(0.0, np.mean(metrics['debt_steal'], axis=-1) - EPS_CONS1)[..., np.newaxis]
+  else:
+    constraints = np.zeros(objs[0].shape + (0,))
+  return np.stack(objs, axis=-1), constraints
+
+
+
+### objectives & constraints for rows of decision variables (dvs first, as in .set/.resultfile) over sample plan lines_to_use.
+###   Policies are evaluated in chunks of policies_per_chunk (default: bounded by MAX_CHUNK_ELEMENTS) to limit memory.
+###   If streaming, samples are also evaluated in chunks of samples_per_chunk and reduced to mergeable summaries, so memory
+###   does not grow with number of samples, and q95 max debt comes from quantile sketch (see above for error bound).
+###   With param arrays from get_financial_params_samples, returns (n_lhc_sets, n_policies, ...) arrays for every combination,
+###   and likewise with input masks useinrbf (see get_sample_metrics).
+def evaluate_objectives(dvs, stochastic_input, lines_to_use, params, dps_run_type=None,
+                        num_objectives=functions_moea_output_plots.NUM_OBJECTIVES, policies_per_chunk=None, streaming=False,
+                        samples_per_chunk=SAMPLES_PER_CHUNK, useinrbf=None):
+  if streaming:
+    summaries = []
+    for start in range(0, len(lines_to_use), samples_per_chunk):
+      revenue, payout, power = get_sample_inputs(stochastic_input, lines_to_use[start:(start + samples_per_chunk)])
+      summaries.append(get_summary_samples(dvs, revenue, payout, power, params, dps_run_type, policies_per_chunk, useinrbf=useinrbf))
+    return get_objectives_from_summary(merge_metric_summaries(summaries), dps_run_type, num_objectives)
+  else:
+    revenue, payout, power = get_sample_inputs(stochastic_input, lines_to_use)
+    return evaluate_objectives_samples(dvs, revenue, payout, power, params, dps_run_type, num_objectives, policies_per_chunk,
+                                       useinrbf)
+
+
+
+### same as evaluate_objectives (not streaming), with sample windows from get_sample_inputs
+def evaluate_objectives_samples(dvs, revenue, payout, power, params, dps_run_type=None,
+                                num_objectives=functions_moea_output_plots.NUM_OBJECTIVES, policies_per_chunk=None, useinrbf=None):
+  dvs = np.atleast_2d(np.asarray(dvs, dtype=float))
+  if policies_per_chunk is None:
+    policies_per_chunk = max(1, int(MAX_CHUNK_ELEMENTS // (revenue.shape[0] * np.prod(get_scenario_shape(params, useinrbf)))))
+  objs, constraints = [], []
+  for start in range(0, dvs.shape[0], policies_per_chunk):
+    policies = get_policies(dvs[start:(start + policies_per_chunk)], dps_run_type)
+    metrics = get_sample_metrics(policies, revenue, payout, power, params, dps_run_type, useinrbf=useinrbf)
+    o, c = get_objectives_from_metrics(metrics, dps_run_type, num_objectives)
+    objs.append(o)
+    constraints.append(c)
+  return np.concatenate(objs, axis=-2), np.concatenate(constraints, axis=-2)
+
+
+
+### mergeable metric summary for all policies over sample windows from get_sample_inputs, evaluating policies in chunks
+def get_summary_samples(dvs, revenue, payout, power, params, dps_run_type=None, policies_per_chunk=None, squares=False,
+                        useinrbf=None):
+  dvs = np.atleast_2d(np.asarray(dvs, dtype=float))
+  if policies_per_chunk is None:
+    policies_per_chunk = max(1, int(MAX_CHUNK_ELEMENTS // (revenue.shape[0] * np.prod(get_scenario_shape(params, useinrbf)))))
+  summaries = []
+  for start in range(0, dvs.shape[0], policies_per_chunk):
+    policies = get_policies(dvs[start:(start + policies_per_chunk)], dps_run_type)
+    summaries.append(get_metric_summary(get_sample_metrics(policies, revenue, payout, power, params, dps_run_type,
+                                                           useinrbf=useinrbf), squares))
+  return concatenate_metric_summaries(summaries)
+
+
+
+### evaluate_objectives in a pool of processes (default one per core). Not streaming: chunks of policies (~4 per process, each
+###   further split to bound memory). Streaming: chunks of samples, each worker returning a summary for all policies, merged
+###   here. Returns objectives & constraints with policies in input order.
+def evaluate_objectives_parallel(dvs, stochastic_input, lines_to_use, params, dps_run_type=None,
+                                 num_objectives=functions_moea_output_plots.NUM_OBJECTIVES, nprocs=None, policies_per_chunk=None,
+                                 streaming=False, samples_per_chunk=SAMPLES_PER_CHUNK):
+  dvs = np.atleast_2d(np.asarray(dvs, dtype=float))
+  if nprocs is None:
+    nprocs = multiprocessing.cpu_count()
+  if streaming:
+    with multiprocessing.Pool(nprocs) as pool:
+      summaries = pool.starmap(get_summary_samples,
+                               [(dvs,) + tuple(get_sample_inputs(stochastic_input, lines_to_use[start:(start + samples_per_chunk)])) +
+                                (params, dps_run_type, policies_per_chunk) for start in range(0, len(lines_to_use), samples_per_chunk)])
+    return get_objectives_from_summary(merge_metric_summaries(summaries), dps_run_type, num_objectives)
+  revenue, payout, power = get_sample_inputs(stochastic_input, lines_to_use)
+  if policies_per_chunk is None:
+    policies_per_chunk = int(np.ceil(dvs.shape[0] / (4 * nprocs)))
+  chunks = [dvs[start:(start + policies_per_chunk)] for start in range(0, dvs.shape[0], policies_per_chunk)]
+  with multiprocessing.Pool(nprocs) as pool:
+    results = pool.starmap(evaluate_objectives_samples, [(chunk, revenue, payout, power, params, dps_run_type, num_objectives)
+                                                         for chunk in chunks])
+  return np.concatenate([r[0] for r in results], axis=-2), np.concatenate([r[1] for r in results], axis=-2)
+
+
+
+
+### input leave-one-out experiment for dps policies: objectives of each policy with each input mask (default all 2^7 from
+###   get_input_masks), all over the same samples in one pass (see evaluate_objectives for other args). Returns table with one
+###   row per (mask, policy): mask values, policy index (row of dvs), objectives (annRev positive, as get_set) & constraints.
+def evaluate_input_masks(dvs, stochastic_input, lines_to_use, params, masks=None, dps_run_type=None,
+                         num_objectives=functions_moea_output_plots.NUM_OBJECTIVES, policies_per_chunk=None):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  if masks is None:
+    masks = get_input_masks()
+  masks = np.atleast_2d(masks)
+  objs, constraints = evaluate_objectives(dvs, stochastic_input, lines_to_use, params, dps_run_type, num_objectives,
+                                          policies_per_chunk, useinrbf=masks)
+  num_masks, npol = objs.shape[:2]
+  table = pd.DataFrame(np.repeat(masks, npol, axis=0), columns=INPUT_MASK_NAMES)
+  table['policy'] = np.tile(np.arange(npol), num_masks)
+  objective_names = get_objective_names(dps_run_type, num_objectives)
+  objs = objs.reshape(num_masks * npol, num_objectives)
+  objs[:, 0] *= -1
+  for k in range(num_objectives):
+    table[objective_names[k]] = objs[:, k]
+  if constraints.shape[-1] > 0:
+    table['constraint'] = constraints.reshape(num_masks * npol)
+  return table
+
+
+
+
+##################################################################
+#### Variance-reduced estimators (as ESTIMATOR_ANTITHETIC & ESTIMATOR_CONTROL_VARIATE in main.cpp)
+####   Antithetic: half the sample windows are simulated on the synthetic data & the other half on its antithetic twin at the
+####   same lines, and each mean objective is the mean over pairs. Control variate: mean objectives are adjusted with the unhedged
+####   annualized net revenue of each sample window, whose expectation over uniformly sampled windows is computed exactly from
+####   the synthetic data, with coefficient beta = cov(objective, control) / var(control) fitted on the same samples.
+####   q95 max debt is always the tail quantile over all simulated windows, with variance from quantiles of batches of windows.
+####   Variances treat sample windows as independent, so for revenue-driven objectives they understate the spread across sample
+####   plans when windows overlap in the record (about 2x for NUM_SAMPLES 20-year windows of the 1M-year record).
+##################################################################
+
+### mean revenue in each year of sample window, over windows starting at lines 1..num_lines-ny-1 with equal probability (as
+###   get_lines_to_use), from revenue column of synthetic data. Returns (ny,) array.
+def get_revenue_window_means(revenue, ny=NUM_YEARS, num_lines=NUM_LINES_STOCHASTIC_INPUT):
+  num_starts = num_lines - ny - 1
+  cumulative = np.concatenate([[0.], np.cumsum(np.asarray(revenue[:num_lines], dtype=float))])
+  return (cumulative[(num_starts + 1):(num_starts + ny + 1)] - cumulative[1:(ny + 1)]) / num_starts
+
+
+
+### discounting weights of each year in annualized cashflow (discount factors times normalization), with shape param_shape + (1, ny)
+def get_discount_weights(params, ny=NUM_YEARS):
+  param_shape = np.shape(params['discount_rate'])
+  discount_factor = np.reshape(params['discount_rate'], param_shape + (1, 1)) ** np.arange(1, ny + 1)
+  return discount_factor / np.sum(discount_factor, axis=-1, keepdims=True)
+
+
+
+### control variate for each sample window (from get_sample_inputs): unhedged annualized net revenue (no contract, fund or debt).
+###   Returns param_shape + (1, n_samples) array, broadcasting against per-sample metrics.
+def get_control_samples(revenue, params):
+  ny = revenue.shape[1] - 1
+  cost_fraction = np.reshape(params['cost_fraction'], np.shape(params['cost_fraction']) + (1, 1))
+  weights = get_discount_weights(params, ny)
+  return np.sum((revenue[np.newaxis, :, 1:] - MEAN_REVENUE * cost_fraction[..., np.newaxis]) * weights[..., np.newaxis, :], axis=-1)
+
+
+
+### exact expectation of control variate (see get_control_samples) over uniformly sampled windows of synthetic data with revenue
+###   column revenue. Returns param_shape + (1,) array, broadcasting against objectives.
+def get_control_mean(revenue, params, ny=NUM_YEARS):
+  cost_fraction = np.reshape(params['cost_fraction'], np.shape(params['cost_fraction']) + (1,))
+  return np.sum(get_revenue_window_means(revenue, ny) * get_discount_weights(params, ny), axis=-1) - MEAN_REVENUE * cost_fraction
+
+
+
+### per-sample values x (..., n_samples) averaged over antithetic pairs (sample k of first half & sample k of second half)
+def get_antithetic_pairs(x):
+  n = x.shape[-1] // 2
+  return (x[..., :n] + x[..., n:(2 * n)]) / 2
+
+
+
+### estimate of mean of per-sample values y (..., n_samples) & its variance. Means over antithetic pairs if antithetic, and
+###   adjusted with control variate (per-sample control, broadcasting against y, with expectation control_mean) if control given,
+###   unless control is nearly constant (variance below ESTIMATOR_CONTROL_MIN_VARIANCE times that of y, where beta blows up).
+def get_estimator_mean(y, control=None, control_mean=None, antithetic=False):
+  if antithetic:
+    y = get_antithetic_pairs(y)
+  n = y.shape[-1]
+  estimate = np.mean(y, axis=-1)
+  if control is None:
+    return estimate, np.var(y, axis=-1, ddof=1) / n
+  c = np.broadcast_to(get_antithetic_pairs(control) if antithetic else control, y.shape)
+  c_mean = np.mean(c, axis=-1)
+  dy, dc = y - estimate[..., np.newaxis], c - c_mean[..., np.newaxis]
+  syy, scc, syc = np.sum(dy * dy, axis=-1), np.sum(dc * dc, axis=-1), np.sum(dy * dc, axis=-1)
+  use = scc > ESTIMATOR_CONTROL_MIN_VARIANCE * syy
+  beta = np.where(use, syc / np.where(use, scc, 1.), 0.)
+  return estimate - beta * (c_mean - control_mean), np.maximum(syy - beta * syc, 0.) / (n - 1) / n
+
+
+
+### estimate of q95 of per-sample values x (..., n_samples) over all samples (as get_tail_quantile) & its variance, from tail
+###   quantiles of num_batches batches of consecutive sample windows (each batch keeping both halves of its antithetic pairs)
+def get_estimator_tail_quantile(x, antithetic=False, num_batches=ESTIMATOR_BATCHES):
+  num_units = x.shape[-1] // 2 if antithetic else x.shape[-1]
+  bounds = (np.arange(num_batches + 1) * num_units) // num_batches
+  batch_quantiles = []
+  for b in range(num_batches):
+    use = np.arange(bounds[b], bounds[b + 1])
+    if antithetic:
+      use = np.concatenate([use, use + num_units])
+    batch_quantiles.append(get_tail_quantile(x[..., use]))
+  return get_tail_quantile(x), np.var(np.stack(batch_quantiles, axis=-1), axis=-1, ddof=1) / num_batches
+
+
+
+### aggregate per-sample metrics into objectives & constraints (as get_objectives_from_metrics) with the estimators above, and
+###   estimated variance of each objective. Samples are antithetic pairs (first & second half) if antithetic, and cashflow
+###   objectives (annualized & min cashflow) use control variate if control given (see evaluate_objectives_estimator); hedging
+###   frequency & max fund balance are plain means, since the control doesn't reduce their variance and could move hedging
+###   frequency outside [0, 1]. Constraint is the plain mean over all samples.
+def get_estimator_objectives(metrics, control=None, control_mean=None, antithetic=False, dps_run_type=None,
+                             num_objectives=functions_moea_output_plots.NUM_OBJECTIVES):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  estimates = [get_estimator_mean(-metrics['annualized_cashflow'], control, control_mean, antithetic)]
+  if dps_run_type < 2:
+    estimates.append(get_estimator_tail_quantile(metrics['max_debt'], antithetic))
+  else:
+    estimates.append(get_estimator_mean(-metrics['min_cashflow'], control, control_mean, antithetic))
+  if num_objectives > 2:
+    estimates.append(get_estimator_mean(metrics['hedge_frequency'], antithetic=antithetic))
+    estimates.append(get_estimator_mean(metrics['max_fund_balance'], antithetic=antithetic))
+  if dps_run_type < 2:
+    constraints = np.maximum(0.0, np.mean(metrics['debt_steal'], axis=-1) - EPS_CONS1)[..., np.newaxis]
+  else:
+    constraints = np.zeros(estimates[0][0].shape + (0,))
+  return np.stack([e[0] for e in estimates], axis=-1), constraints, np.stack([e[1] for e in estimates], axis=-1)
+
+
+
+### objectives, constraints & estimator variance of each objective (see get_estimator_objectives) for rows of dvs over sample
+###   plan lines_to_use. If antithetic, stochastic_input is from get_stochastic_input_antithetic, and the first half of
+###   lines_to_use is simulated on both the synthetic data & its twin (same number of simulated windows as without). If
+###   control_variate, cashflow objectives are adjusted with the unhedged annualized net revenue (exact expectation from the whole
+###   synthetic data, averaged over data & twin if antithetic). With neither, objectives are the same as evaluate_objectives.
+def evaluate_objectives_estimator(dvs, stochastic_input, lines_to_use, params, dps_run_type=None,
+                                  num_objectives=functions_moea_output_plots.NUM_OBJECTIVES, policies_per_chunk=None,
+                                  antithetic=False, control_variate=False):
+  dvs = np.atleast_2d(np.asarray(dvs, dtype=float))
+  if antithetic:
+    lines_to_use = lines_to_use[:(len(lines_to_use) // 2)]
+    sources = [stochastic_input[:, :3], stochastic_input[:, 3:6]]
+  else:
+    sources = [stochastic_input]
+  revenue, payout, power = [np.concatenate(w, axis=0) for w in zip(*[get_sample_inputs(x, lines_to_use) for x in sources])]
+  control, control_mean = None, None
+  if control_variate:
+    control = get_control_samples(revenue, params)
+    control_mean = np.mean([get_control_mean(x[:, 0], params) for x in sources], axis=0)
+  if policies_per_chunk is None:
+    policies_per_chunk = max(1, int(MAX_CHUNK_ELEMENTS // (revenue.shape[0] * np.prod(get_scenario_shape(params)))))
+  objs, constraints, variances = [], [], []
+  for start in range(0, dvs.shape[0], policies_per_chunk):
+    policies = get_policies(dvs[start:(start + policies_per_chunk)], dps_run_type)
+    metrics = get_sample_metrics(policies, revenue, payout, power, params, dps_run_type)
+    o, c, v = get_estimator_objectives(metrics, control, control_mean, antithetic, dps_run_type, num_objectives)
+    objs.append(o)
+    constraints.append(c)
+    variances.append(v)
+  return np.concatenate(objs, axis=-2), np.concatenate(constraints, axis=-2), np.concatenate(variances, axis=-2)
+
+
+
+
+##################################################################
+#### Storage precision: error in objectives when stochastic inputs are stored at reduced precision (e.g. float32
+####   synthetic_data.bin, see functions_stochastic_inputs.get_storage_dtype). Simulation is always in float64, so the only
+####   difference is rounding of the inputs, which is compared against borg epsilons.
+##################################################################
+
+### compare objectives of rows of dvs from stochastic inputs as stored (float64) and rounded to precision, over sample plan
+###   lines_to_use. Returns table with one row per objective: max & mean absolute difference, max relative difference,
+###   borg epsilon, max difference as fraction of epsilon, and number of policies whose epsilon box changes.
+def get_precision_report(dvs, stochastic_input, lines_to_use, params, precision='float32', dps_run_type=None,
+                         num_objectives=functions_moea_output_plots.NUM_OBJECTIVES, policies_per_chunk=None):
+  revenue, payout, power = get_sample_inputs(stochastic_input, lines_to_use)
+  objs = evaluate_objectives_samples(dvs, revenue, payout, power, params, dps_run_type, num_objectives, policies_per_chunk)[0]
+  dtype = functions_stochastic_inputs.STORAGE_PRECISIONS[precision]
+  revenue, payout, power = [x.astype(dtype).astype(float) for x in (revenue, payout, power)]
+  objs_rounded = evaluate_objectives_samples(dvs, revenue, payout, power, params, dps_run_type, num_objectives,
+                                             policies_per_chunk)[0]
+  objective_names = get_objective_names(dps_run_type, num_objectives)
+  epsilons = np.array([OBJECTIVE_EPSILONS[name] for name in objective_names])
+  diff = np.abs(objs_rounded - objs)
+  report = pd.DataFrame({'max_abs_diff': diff.max(axis=0), 'mean_abs_diff': diff.mean(axis=0),
+                         'max_rel_diff': (diff / np.maximum(np.abs(objs), EPS)).max(axis=0), 'epsilon': epsilons},
+                        index=pd.Index(objective_names, name='objective'))
+  report['max_diff_over_epsilon'] = report['max_abs_diff'] / epsilons
+  report['epsilon_box_changes'] = (np.floor(objs_rounded / epsilons) != np.floor(objs / epsilons)).sum(axis=0)
+  return report
+
+
+
+
+##################################################################
+#### Process pool with shared stochastic inputs
+####   Stochastic inputs are placed once in shared memory (or memory-mapped from a .npy file), and each worker process attaches
+####   a read-only view when it starts, so only one copy is held in RAM however many workers are used. Only chunks of decision
+####   variables & results are sent between processes.
+##################################################################
+worker_input = {}   # shared memory block & array view of stochastic inputs, in each worker process
+
+
+
+### worker process initializer: attach stochastic inputs from spec (see functions_stochastic_inputs.attach_array)
+def init_worker_shared_input(spec):
+  worker_input['shm'], worker_input['stochastic_input'] = functions_stochastic_inputs.attach_array(spec)
+
+
+
+### worker process task: run func(dvs, stochastic_input, *args) with attached stochastic inputs
+def run_chunk_shared_input(func, dvs, args):
+  return func(dvs, worker_input['stochastic_input'], *args)
+
+
+
+### apply func(dvs_chunk, stochastic_input, *args) to chunks of policies in a pool of processes (default one per core, ~4 chunks
+###   per process), yielding results one chunk at a time, in policy order, as they finish. stochastic_input can be an array
+###   (copied once into shared memory, freed when done, unless memory-mapped from file, e.g. synthetic_data.bin, which workers
+###   map themselves) or a spec from functions_stochastic_inputs (shared memory or memmap).
+###   func must be a module-level function, so it can be sent to workers.
+def map_policies_shared_input(func, dvs, stochastic_input, args=(), nprocs=None, policies_per_chunk=None):
+  dvs = np.atleast_2d(np.asarray(dvs, dtype=float))
+  if nprocs is None:
+    nprocs = multiprocessing.cpu_count()
+  if policies_per_chunk is None:
+    policies_per_chunk = int(np.ceil(dvs.shape[0] / (4 * nprocs)))
+  if isinstance(stochastic_input, dict):
+    shm, spec = None, stochastic_input
+  else:
+    shm, spec = None, functions_stochastic_inputs.get_memmap_spec(stochastic_input)
+    if spec is None:
+      shm, spec = functions_stochastic_inputs.share_array(stochastic_input)
+  try:
+    with ProcessPoolExecutor(nprocs, initializer=init_worker_shared_input, initargs=(spec,)) as executor:
+      chunks = [dvs[start:(start + policies_per_chunk)] for start in range(0, dvs.shape[0], policies_per_chunk)]
+      for result in executor.map(run_chunk_shared_input, [func] * len(chunks), chunks, [args] * len(chunks)):
+        yield result
+  finally:
+    functions_stochastic_inputs.release_shared_array(shm, unlink=True)
+
+
+
+### evaluate_objectives for chunks of policies in a pool of processes sharing one copy of stochastic inputs (array or spec, see
+###   map_policies_shared_input). Yields (objectives, constraints) for each chunk of policies, in policy order.
+def iterate_objectives_shared(dvs, stochastic_input, lines_to_use, params, dps_run_type=None,
+                              num_objectives=functions_moea_output_plots.NUM_OBJECTIVES, nprocs=None, policies_per_chunk=None,
+                              streaming=False, samples_per_chunk=SAMPLES_PER_CHUNK):
+  args = (lines_to_use, params, dps_run_type, num_objectives, None, streaming, samples_per_chunk)
+  for result in map_policies_shared_input(evaluate_objectives, dvs, stochastic_input, args, nprocs, policies_per_chunk):
+    yield result
+
+
+
+### same as iterate_objectives_shared, returning objectives & constraints for all policies
+def evaluate_objectives_shared(dvs, stochastic_input, lines_to_use, params, dps_run_type=None,
+                               num_objectives=functions_moea_output_plots.NUM_OBJECTIVES, nprocs=None, policies_per_chunk=None,
+                               streaming=False, samples_per_chunk=SAMPLES_PER_CHUNK):
+  results = list(iterate_objectives_shared(dvs, stochastic_input, lines_to_use, params, dps_run_type, num_objectives, nprocs,
+                                           policies_per_chunk, streaming, samples_per_chunk))
+  return np.concatenate([r[0] for r in results], axis=-2), np.concatenate([r[1] for r in results], axis=-2)
+
+
+
+
+##################################################################
+#### Racing evaluation: samples in increasing batches, stopping early for policies that are dominated by a reference set
+####   with high confidence. After each batch, each objective gets an optimistic (lower) confidence bound: mean objectives
+####   -/+ confidence_z standard errors, and q95 max debt at the quantile confidence_z binomial standard errors below 0.95 in
+####   the quantile sketch. Policies whose bounds are Pareto-dominated by a point of the reference set get no more samples.
+##################################################################
+
+### read reference set of objectives (minimized, as .reference files in optimization_output)
+def get_reference_set(reference_file, num_objectives=functions_moea_output_plots.NUM_OBJECTIVES):
+  return np.atleast_2d(np.loadtxt(reference_file))[:, :num_objectives]
+
+
+
+### lower confidence bounds of objectives (minimized) from merged summary with squares
+def get_objective_lower_bounds(summary, dps_run_type=None, num_objectives=functions_moea_output_plots.NUM_OBJECTIVES,
+                               confidence_z=RACING_CONFIDENCE_Z):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  ns = summary['num_samples']
+  def get_mean_bound(k, sign):
+    mean = summary[k] / ns
+    standard_error = np.sqrt(np.maximum(summary[k + '_sq'] / ns - mean ** 2, 0.) / ns)
+    return sign * mean - confidence_z * standard_error
+  lower = [get_mean_bound('annualized_cashflow', -1.)]
+  if dps_run_type < 2:
+    q = np.maximum(Q_MAX_DEBT - confidence_z * np.sqrt(Q_MAX_DEBT * (1. - Q_MAX_DEBT) / ns), 0.)
+    lower.append(get_quantile_from_sketch(summary['max_debt_sketch'], q))
+  else:
+    lower.append(get_mean_bound('min_cashflow', -1.))
+  if num_objectives > 2:
+    lower.append(get_mean_bound('hedge_frequency', 1.))
+    lower.append(get_mean_bound('max_fund_balance', 1.))
+  return np.stack(lower, axis=-1)
+
+
+
+### True for each row of objs (minimized) that is Pareto-dominated by a point of reference
+def get_dominated(objs, reference):
+  dominated = np.zeros(objs.shape[0], dtype=bool)
+  for point in reference:
+    dominated |= np.all(point <= objs, axis=1) & np.any(point < objs, axis=1)
+  return dominated
+
+
+
+### racing version of evaluate_objectives (single set of params): samples in lines_to_use are evaluated in batches of
+###   initial_samples, then doubling, and policies are dropped once dominated by reference (from get_reference_set) with
+###   confidence_z. Returns objectives & constraints (from samples used, with q95 max debt from quantile sketch as in streaming
+###   evaluation), number of samples used, and whether each policy was dropped as dominated.
+def evaluate_objectives_racing(dvs, stochastic_input, lines_to_use, params, reference, dps_run_type=None,
+                               num_objectives=functions_moea_output_plots.NUM_OBJECTIVES, initial_samples=RACING_INITIAL_SAMPLES,
+                               confidence_z=RACING_CONFIDENCE_Z, policies_per_chunk=None):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  dvs = np.atleast_2d(np.asarray(dvs, dtype=float))
+  active = np.arange(dvs.shape[0])
+  num_samples = np.zeros(dvs.shape[0], dtype=int)
+  dominated = np.zeros(dvs.shape[0], dtype=bool)
+  summary = None
+  start, end = 0, min(initial_samples, len(lines_to_use))
+  while (active.shape[0] > 0) and (start < end):
+    revenue, payout, power = get_sample_inputs(stochastic_input, lines_to_use[start:end])
+    summary_batch = get_summary_samples(dvs[active], revenue, payout, power, params, dps_run_type, policies_per_chunk, squares=True)
+    if summary is None:
+      summary = summary_batch
+    else:
+      for k in summary.keys():
+        summary[k][active] += summary_batch[k]
+    num_samples[active] = end
+    if end < len(lines_to_use):
+      lower = get_objective_lower_bounds({k: v[active] for k, v in summary.items()}, dps_run_type, num_objectives, confidence_z)
+      dominated[active] = get_dominated(lower, reference)
+      active = active[~dominated[active]]
+    start, end = end, min(2 * end, len(lines_to_use))
+  objs, constraints = get_objectives_from_summary(summary, dps_run_type, num_objectives)
+  return objs, constraints, num_samples, dominated
+
+
+
+
+##################################################################
+#### Historical backtest: policies simulated over every ny-year window of the historical record (historical_data.csv from
+####   make_synthetic_data_plots.py), each start year treated as one sample window, so all policies & start years are
+####   simulated together by get_sample_metrics.
+##################################################################
+
+### read historical data (water years 1987-2016: swe index, snow contract payout (cfd), generation, power price, revenue
+###   (rev), power price index (powIndex)). 1987 only has power index, used for decisions in first year of 1988 window.
+def get_historical_data(dir_generated_inputs=dir_generated_inputs):
+  return pd.read_csv(dir_generated_inputs + 'historical_data.csv', sep=' ', index_col=0)
+
+
+
+### feasible start years (first simulated water year) for ny-year windows: revenue & payout known for all ny years, and
+###   power index for year before
+def get_historical_start_years(historical, ny=NUM_YEARS):
+  years = historical.index.values
+  known_flows = historical[['rev', 'cfd']].notna().all(axis=1).values
+  known_power = historical['powIndex'].notna().values
+  return np.array([years[i] for i in range(1, len(years) - ny + 1)
+                   if known_flows[i:(i + ny)].all() and known_power[(i - 1):(i + ny)].all()], dtype=int)
+
+
+
+### (n_start_years, ny+1) windows of revenue, payout, power index for start years, in same layout as get_sample_inputs
+###   (column 0 is year before window, only power index used)
+def get_historical_inputs(historical, start_years, ny=NUM_YEARS):
+  rows = historical.index.get_indexer(np.asarray(start_years) - 1)[:, np.newaxis] + np.arange(ny + 1)
+  return historical['rev'].values[rows], historical['cfd'].values[rows], historical['powIndex'].values[rows]
+
+
+
+### simulate rows of decision variables over every feasible historical start year (default from get_historical_start_years).
+###   Returns cube (n_policies, n_start_years, len(BACKTEST_METRIC_NAMES)) of per-window metrics (with leading param axes
+###   if params are arrays, see get_sample_metrics), and start years.
+def backtest_policies(dvs, historical, params, start_years=None, dps_run_type=None, ny=NUM_YEARS, backend=None):
+  if start_years is None:
+    start_years = get_historical_start_years(historical, ny)
+  revenue, payout, power = get_historical_inputs(historical, start_years, ny)
+  metrics = get_sample_metrics(get_policies(np.atleast_2d(dvs), dps_run_type), revenue, payout, power, params, dps_run_type,
+                               backend)
+  return np.stack([metrics[k] for k in BACKTEST_METRIC_NAMES], axis=-1), np.asarray(start_years)
+
+
+
+##################################################################
+#### Retest set files, as BORG_RUN_TYPE 0 in main.cpp
+##################################################################
+
+### read decision variables from borg .set file (lines starting with '#' skipped)
+def get_set_dvs(set_file, num_dv):
+  pareto = np.atleast_2d(np.loadtxt(set_file, comments='#'))
+  return pareto[:, :num_dv]
+
+
+
+### re-evaluate all policies in set_file with sample plan from seed_sample & financial params from row lhc_set of LHC sample,
+###   writing retest_file in same format as main.cpp (dvs, objectives, constraints; 10 significant digits).
+###   Set streaming=True for bounded-memory evaluation (e.g. with num_samples much larger than NUM_SAMPLES). Otherwise
+###   objectives come from evaluate_objectives_estimator (with antithetic and/or control_variate estimators, as main.cpp with
+###   ESTIMATOR_*), and estimator variance of each objective is written to retest_file + '.variance' (one line per policy).
+def retest_set(set_file, retest_file, seed_sample, lhc_set=NUM_PARAM_SAMPLES - 1, dps_run_type=None,
+               num_objectives=functions_moea_output_plots.NUM_OBJECTIVES, nprocs=None, dir_generated_inputs=dir_generated_inputs,
+               num_samples=NUM_SAMPLES, streaming=False, antithetic=False, control_variate=False):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  if streaming and (antithetic or control_variate):
+    raise ValueError('Antithetic & control variate estimators are not available with streaming evaluation')
+  num_dv = functions_moea_output_plots.NUM_DV if dps_run_type > 0 else 2
+  dvs = get_set_dvs(set_file, num_dv)
+  if antithetic:
+    stochastic_input = get_stochastic_input_antithetic(dir_generated_inputs)
+  else:
+    stochastic_input = get_stochastic_input(dir_generated_inputs)
+  params = get_financial_params(get_param_samples(dir_generated_inputs), lhc_set)
+  lines_to_use = get_sample_plan(seed_sample, num_samples, dir_generated_inputs)
+  if streaming:
+    objs, constraints = evaluate_objectives_shared(dvs, stochastic_input, lines_to_use, params, dps_run_type, num_objectives, nprocs,
+                                                   streaming=streaming)
+  else:
+    results = list(map_policies_shared_input(evaluate_objectives_estimator, dvs, stochastic_input,
+                                             (lines_to_use, params, dps_run_type, num_objectives, None, antithetic, control_variate),
+                                             nprocs))
+    objs, constraints, variances = [np.concatenate([r[k] for r in results], axis=-2) for k in range(3)]
+    with open(retest_file + '.variance', 'w') as f:
+      for i in range(dvs.shape[0]):
+        f.write(' '.join(['%.10g' % x for x in variances[i]]) + '\n')
+  with open(retest_file, 'w') as f:
+    for i in range(dvs.shape[0]):
+      f.write(' '.join(['%.10g' % x for x in np.concatenate([dvs[i], objs[i], constraints[i]])]) + '\n')
+  return dvs, objs, constraints
+
+
+
+### screen all policies in set_file against reference_file with racing evaluation (see evaluate_objectives_racing), writing
+###   race_file with dvs, objectives, constraints, then number of samples used & 1 if dropped as dominated (else 0).
+def race_set(set_file, race_file, reference_file, seed_sample, lhc_set=NUM_PARAM_SAMPLES - 1, dps_run_type=None,
+             num_objectives=functions_moea_output_plots.NUM_OBJECTIVES, dir_generated_inputs=dir_generated_inputs,
+             num_samples=NUM_SAMPLES, initial_samples=RACING_INITIAL_SAMPLES, confidence_z=RACING_CONFIDENCE_Z):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  num_dv = functions_moea_output_plots.NUM_DV if dps_run_type > 0 else 2
+  dvs = get_set_dvs(set_file, num_dv)
+  stochastic_input = get_stochastic_input(dir_generated_inputs)
+  params = get_financial_params(get_param_samples(dir_generated_inputs), lhc_set)
+  lines_to_use = get_sample_plan(seed_sample, num_samples, dir_generated_inputs)
+  reference = get_reference_set(reference_file, num_objectives)
+  objs, constraints, samples_used, dominated = evaluate_objectives_racing(dvs, stochastic_input, lines_to_use, params, reference,
+                                                                           dps_run_type, num_objectives, initial_samples, confidence_z)
+  with open(race_file, 'w') as f:
+    for i in range(dvs.shape[0]):
+      f.write(' '.join(['%.10g' % x for x in np.concatenate([dvs[i], objs[i], constraints[i]])]) + ' ' + str(samples_used[i]) +
+              ' ' + str(int(dominated[i])) + '\n')
+  return dvs, objs, constraints, samples_used, dominated
+
+
+
+### report error in objectives of all policies in set_file when stochastic inputs are stored at precision (see
+###   get_precision_report), with sample plan from seed_sample & financial params from row lhc_set of LHC sample,
+###   writing report_file (.csv).
+def report_precision_set(set_file, report_file, seed_sample, lhc_set=NUM_PARAM_SAMPLES - 1, precision='float32',
+                         dps_run_type=None, num_objectives=functions_moea_output_plots.NUM_OBJECTIVES,
+                         dir_generated_inputs=dir_generated_inputs, num_samples=NUM_SAMPLES):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  num_dv = functions_moea_output_plots.NUM_DV if dps_run_type > 0 else 2
+  dvs = get_set_dvs(set_file, num_dv)
+  stochastic_input = get_stochastic_input(dir_generated_inputs)
+  params = get_financial_params(get_param_samples(dir_generated_inputs), lhc_set)
+  lines_to_use = get_sample_plan(seed_sample, num_samples, dir_generated_inputs)
+  report = get_precision_report(dvs, stochastic_input, lines_to_use, params, precision, dps_run_type, num_objectives)
+  report.to_csv(report_file)
+  return dvs, report
+
+
+
+### backtest all policies in set_file (.set/.resultfile, dvs first) over historical record with financial params from row lhc_set
+###   of LHC sample (see backtest_policies), saving backtest_file (.npz) with cube, start_years, metric_names & dvs.
+def backtest_set(set_file, backtest_file, lhc_set=NUM_PARAM_SAMPLES - 1, dps_run_type=None, dir_generated_inputs=dir_generated_inputs,
+                 ny=NUM_YEARS):
+  if dps_run_type is None:
+    dps_run_type = functions_moea_output_plots.DPS_RUN_TYPE
+  num_dv = functions_moea_output_plots.NUM_DV if dps_run_type > 0 else 2
+  dvs = get_set_dvs(set_file, num_dv)
+  historical = get_historical_data(dir_generated_inputs)
+  params = get_financial_params(get_param_samples(dir_generated_inputs), lhc_set)
+  cube, start_years = backtest_policies(dvs, historical, params, None, dps_run_type, ny)
+  np.savez_compressed(backtest_file, cube=cube, start_years=start_years, metric_names=np.array(BACKTEST_METRIC_NAMES), dvs=dvs)
+  return cube, start_years
@@ -13,6 +13,11 @@ import seaborn as sbn
 from scipy import stats as st
 from scipy.optimize import minimize
 
+### Project functions ###
+import functions_instrumentation
+import functions_model_cache
+import functions_stochastic_inputs
+
 
 sbn.set_style('ticks')
 sbn.set_context('paper', font_scale=1.55)
@@ -31,6 +36,57 @@ eps = 1e-13
 ############## Returns dataframe of monthly revenues ($M/mnth) #########################################
 ##########################################################################
 
+### fitted revenue model (dict): constant monthly muni demand & rates from last year of SFPUC sales, and fraction of surplus
+###   gen sold to mtid, from regression of mtid sales on historical gen above muni demand (adds aboveMuni & mtid columns to gen,
+###   and estMtid to hp_GWh)
+def fit_revenue_model(gen, hp_GWh, hp_dolPerKwh):
+  ### rel b/w swe/gen and mtid
+  # plt.scatter(hp_GWh.mtid.loc[2010:2016], swe.danWtAvg.loc[2010:2016])
+  # np.corrcoef(hp_GWh.mtid.loc[2010:2016], swe.danWtAvg.loc[2010:2016])
+  # get total amt above muni demand in each yr
+  gen['aboveMuni'] = gen.tot - hp_GWh['M'].iloc[hp_GWh.shape[0] - 1] / 12
+  gen['mtid'] = gen.aboveMuni.apply(lambda x: max(x, 0))
+  # gen.mtid.loc[(gen.wmnth < 7) ] = 0     # assume mtid only buys power Apr-Sept
+  hp_GWh['estMtid'] = np.nan
+  hp_GWh.estMtid.loc[2010:2016] = gen.loc[gen.wyear > 2009, :].groupby('wyear').sum().mtid
+  # plt.scatter(hp_GWh.estMtid.loc[2010:2016], hp_GWh.mtid.loc[2010:2016])
+  # np.corrcoef(hp_GWh.estMtid.loc[2010:2016], hp_GWh.mtid.loc[2010:2016])
+  # reg to get percentage estimated for mtid
+  lmMtid = sm.ols(formula='mtid ~ est-1',
+                  data=pd.DataFrame({'mtid': hp_GWh.mtid.loc[2010:2016], 'est': hp_GWh.estMtid.loc[2010:2016]}))
+  lmMtid = lmMtid.fit()
+  # print(lmMtid.summary())
+
+  # plt.scatter(hp_GWh.estMtid.loc[2010:2016], lmMtid.predict())
+  mtidGrowFrac = lmMtid.params[0]
+  # gen.mtid = gen.mtid * mtidGrowFrac
+  # gen['aboveMuniMtid'] = np.where(gen.aboveMuni > 0, gen.aboveMuni - gen.mtid, gen.aboveMuni)
+  # plt.plot(gen.wmnth.loc[gen.wyear==2012],gen.aboveMuni.loc[gen.wyear==2012])
+  # plt.plot(gen.aboveMuni)
+  # plt.plot(gen.aboveMuniMtid)
+  # plt.plot(gen.mtid)
+
+  return {'dem_M_GWh': hp_GWh['M'].iloc[hp_GWh.shape[0] - 1] / 12, 'mtidFrac': mtidGrowFrac,
+          'rate_DolPerkWh_M': hp_dolPerKwh['M'].iloc[hp_dolPerKwh.shape[0] - 1],
+          'rate_DolPerkWh_mtid': hp_dolPerKwh['mtid'].iloc[hp_dolPerKwh.shape[0] - 1]}
+
+
+
+### revenue model: monthly gen & price, assume const demand to muni, 48% surplus (from regression in fit_revenue_model) to mtid
+###   throughout year (only if mtid rate < wholesale). Rest to Wholesale. Also must buy power to meet unmet muni.
+###   sampGen_GWh & sampPow_DolPerkWh are series.
+def revenue_model_milDollars(sampGen_GWh, sampPow_DolPerkWh, dem_M_GWh, mtidFrac, rate_DolPerkWh_M,
+                       rate_DolPerkWh_mtid):
+  dem_mtid_GWh = np.maximum((sampGen_GWh - dem_M_GWh) * mtidFrac, 0)
+  dem_mtid_GWh.loc[(sampPow_DolPerkWh < rate_DolPerkWh_mtid).values] = 0
+  # dem_mtid_GWh.loc[(dem_mtid_GWh.index % 12 < 6)] = 0  # assume mtid only buys power Apr-Sept
+  rev = (dem_M_GWh * rate_DolPerkWh_M + dem_mtid_GWh * rate_DolPerkWh_mtid + \
+         (sampGen_GWh - dem_M_GWh - dem_mtid_GWh) * sampPow_DolPerkWh)
+  return (rev)  # returns revenues in $Mil
+
+
+
+@functions_instrumentation.instrument('simulate_revenue')
 def simulate_revenue(dir_generated_inputs, gen, hp_GWh, hp_dolPerKwh, genSynth, powSynth, powHistSampleStart, redo = False, save = False):
   if (redo):
     # nYr = int(len(powSynth) / 12)
@@ -38,60 +94,18 @@ def simulate_revenue(dir_generated_inputs, gen, hp_GWh, hp_dolPerKwh, genSynth,
     # for i in range(1, nYr):
     #     yrSim[0, (12 * i):(12 * (i + 1))] = i
 
-    ### rel b/w swe/gen and mtid
-    # plt.scatter(hp_GWh.mtid.loc[2010:2016], swe.danWtAvg.loc[2010:2016])
-    # np.corrcoef(hp_GWh.mtid.loc[2010:2016], swe.danWtAvg.loc[2010:2016])
-    # get total amt above muni demand in each yr
-    gen['aboveMuni'] = gen.tot - hp_GWh['M'].iloc[hp_GWh.shape[0] - 1] / 12
-    gen['mtid'] = gen.aboveMuni.apply(lambda x: max(x, 0))
-    # gen.mtid.loc[(gen.wmnth < 7) ] = 0     # assume mtid only buys power Apr-Sept
-    hp_GWh['estMtid'] = np.nan
-    hp_GWh.estMtid.loc[2010:2016] = gen.loc[gen.wyear > 2009, :].groupby('wyear').sum().mtid
-    # plt.scatter(hp_GWh.estMtid.loc[2010:2016], hp_GWh.mtid.loc[2010:2016])
-    # np.corrcoef(hp_GWh.estMtid.loc[2010:2016], hp_GWh.mtid.loc[2010:2016])
-    # reg to get percentage estimated for mtid
-    lmMtid = sm.ols(formula='mtid ~ est-1',
-                    data=pd.DataFrame({'mtid': hp_GWh.mtid.loc[2010:2016], 'est': hp_GWh.estMtid.loc[2010:2016]}))
-    lmMtid = lmMtid.fit()
-    # print(lmMtid.summary())
-
-    # plt.scatter(hp_GWh.estMtid.loc[2010:2016], lmMtid.predict())
-    mtidGrowFrac = lmMtid.params[0]
-    # gen.mtid = gen.mtid * mtidGrowFrac
-    # gen['aboveMuniMtid'] = np.where(gen.aboveMuni > 0, gen.aboveMuni - gen.mtid, gen.aboveMuni)
-    # plt.plot(gen.wmnth.loc[gen.wyear==2012],gen.aboveMuni.loc[gen.wyear==2012])
-    # plt.plot(gen.aboveMuni)
-    # plt.plot(gen.aboveMuniMtid)
-    # plt.plot(gen.mtid)
-
-
-    # revenue model: monthly gen & price, assume const demand to muni, 48% surplus (from regression above) to mtid throughout year (only if mtid rate < wholesale).
-    # Rest to Wholesale. Also must buy power to meet unmet muni.
-    def revenue_model_milDollars(sampGen_GWh, sampPow_DolPerkWh, dem_M_GWh, mtidFrac, rate_DolPerkWh_M,
-                           rate_DolPerkWh_mtid):
-      dem_mtid_GWh = np.maximum((sampGen_GWh - dem_M_GWh) * mtidFrac, 0)
-      dem_mtid_GWh.loc[(sampPow_DolPerkWh < rate_DolPerkWh_mtid).values] = 0
-      # dem_mtid_GWh.loc[(dem_mtid_GWh.index % 12 < 6)] = 0  # assume mtid only buys power Apr-Sept
-      rev = (dem_M_GWh * rate_DolPerkWh_M + dem_mtid_GWh * rate_DolPerkWh_mtid + \
-             (sampGen_GWh - dem_M_GWh - dem_mtid_GWh) * sampPow_DolPerkWh)
-      return (rev)  # returns revenues in $Mil
+    revModel = functions_model_cache.cached_fit('revenue', fit_revenue_model, gen, hp_GWh, hp_dolPerKwh)
 
     # simulated revs for synthetic time series
-    revSim = revenue_model_milDollars(genSynth.gen,
-                                powSynth.powPrice/1000,
-                                hp_GWh['M'].iloc[hp_GWh.shape[0] - 1] / 12,
-                                mtidGrowFrac,
-                                hp_dolPerKwh['M'].iloc[hp_dolPerKwh.shape[0] - 1] ,
-                                hp_dolPerKwh['mtid'].iloc[hp_dolPerKwh.shape[0] - 1] )
+    revSim = revenue_model_milDollars(genSynth.gen, powSynth.powPrice/1000, revModel['dem_M_GWh'], revModel['mtidFrac'],
+                                      revModel['rate_DolPerkWh_M'], revModel['rate_DolPerkWh_mtid'])
     # choose power price series to use with historical data
     powHistSample = powSynth.powPrice.iloc[powHistSampleStart:(powHistSampleStart+len(gen.tot))].reset_index(drop=True)
     # simulated revs for historical generation w/ random synth power price & current fixed muni/mtid rates
     revHist = pd.DataFrame({'rev': revenue_model_milDollars(gen.tot.reset_index(drop=True),
                                                       powSynth.powPrice.iloc[3600:(3600+len(gen.tot))].reset_index(drop=True)/1000,
-                                                      hp_GWh['M'].iloc[hp_GWh.shape[0] - 1] / 12,
-                                                      mtidGrowFrac,
-                                                      hp_dolPerKwh['M'].iloc[hp_dolPerKwh.shape[0] - 1],
-                                                      hp_dolPerKwh['mtid'].iloc[hp_dolPerKwh.shape[0] - 1]),
+                                                      revModel['dem_M_GWh'], revModel['mtidFrac'], revModel['rate_DolPerkWh_M'],
+                                                      revModel['rate_DolPerkWh_mtid']),
                             'wmnth': gen.wmnth,
                             'wyear': gen.wyear})
 
@@ -117,6 +131,7 @@ def simulate_revenue(dir_generated_inputs, gen, hp_GWh, hp_dolPerKwh, genSynth,
 ############## Returns dataframe with net payout #########################################
 ##########################################################################
 
+@functions_instrumentation.instrument('wang', items=lambda df, *args, **kwargs: df.shape[0])
 def wang(df, contractType, lam, k, cap=-1., premOnly=False, lastYrTrig=-1., count=0):  # df should be dataframe with columns 'asset' and 'prob'; contractType is 'put' or 'call'
   # print(count)
   if contractType == 'put':
@@ -155,6 +170,7 @@ def wang(df, contractType, lam, k, cap=-1., premOnly=False, lastYrTrig=-1., coun
 ############## Returns dataframe with net payout #########################################
 ##########################################################################
 
+@functions_instrumentation.instrument('snow_contract_payout')
 def snow_contract_payout(dir_generated_inputs, sweWtSynth, contractType = 'put', lambdaRisk = 0.25, strikeQuantile = 0.6,
                        capQuantile = 0.95, redo = False, save = False):
 
@@ -203,6 +219,7 @@ def snow_contract_payout(dir_generated_inputs, sweWtSynth, contractType = 'put',
 ############## Returns dataframe with net payout #########################################
 ##########################################################################
 
+@functions_instrumentation.instrument('snow_contract_payout_hist')
 def snow_contract_payout_hist(sweWtHist, sweWtSynth, payoutCfdSim, capQuantile = 0.95):
   capX = sweWtSynth.quantile(capQuantile)
   capY = np.min(payoutCfdSim)
@@ -270,6 +287,7 @@ def plot_contract(dir_figs, sweWtSynth, payoutCfdSim, fig_format, lambda_shifts)
 ############## Returns dataframe with net payout #########################################
 ##########################################################################
 
+@functions_instrumentation.instrument('power_price_index')
 def power_price_index(powSynth, genSynth, revSim, hp_GWh):
   nYr = int(len(powSynth) / 12)
   yrSim = np.full((1, nYr * 12), 0)
@@ -322,12 +340,18 @@ def power_price_index(powSynth, genSynth, revSim, hp_GWh):
 
 ##########################################################################
 ######### save synthetic data needed for moea ###########
-############## Saves csv, no return #########################################
+############## Saves binary (synthetic_data.bin, memory-mapped by moea & evaluation; float32 values if precision is ##########
+############## 'float32') & csv (if text), no return #########################################
 ##########################################################################
-def save_synthetic_data_moea(dir_generated_inputs, revSimWyr, payoutCfdSim, powerIndex):
+@functions_instrumentation.instrument('save_synthetic_data_moea')
+def save_synthetic_data_moea(dir_generated_inputs, revSimWyr, payoutCfdSim, powerIndex, text = True, precision = 'float64'):
   synthetic_data = pd.DataFrame({'revenue': revSimWyr.values, 'payoutCfd': payoutCfdSim.values,
                                  'power': powerIndex}).iloc[1:, :].reset_index(drop=True)[['revenue', 'payoutCfd', 'power']]
-  synthetic_data.to_csv(dir_generated_inputs + 'synthetic_data.txt',sep=' ', index=False)
+  if (text):
+    synthetic_data.to_csv(dir_generated_inputs + 'synthetic_data.txt',sep=' ', index=False)
+  provenance = functions_stochastic_inputs.get_synthetic_data_provenance('make_synthetic_data_plots.py', n_years=len(revSimWyr),
+                                                                         seeds={'swe': 1, 'gen': 2, 'power': 3})
+  functions_stochastic_inputs.save_synthetic_data_binary(dir_generated_inputs + 'synthetic_data.bin', synthetic_data, provenance, precision)
 
 
 
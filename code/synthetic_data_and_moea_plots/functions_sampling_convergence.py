@@ -0,0 +1,133 @@
+##############################################################################################################
+### functions_sampling_convergence.py - convergence study of objective estimates with pseudo-random (mc) vs randomized
+###     quasi-monte carlo (qmc, scrambled Sobol) synthetic records. For each record length, independent replicate records
+###     are generated (parallel-mode streams of functions_synthetic_streaming, one per replicate, with a fixed calibration of
+###     swe index, cfd & power price index), objectives of a set of policies are estimated over every 20-year window of each
+###     record, and the estimate error is the standard deviation across replicates. This is compared with the error of the
+###     estimate used by the moea today: NUM_SAMPLES random windows from a 1M year mc record.
+##############################################################################################################
+import numpy as np
+import pandas as pd
+
+### Project functions ###
+import functions_moea_output_plots
+import functions_policy_evaluation
+import functions_stochastic_inputs
+import functions_synthetic_streaming
+
+
+##################################################################
+#### Constants
+##################################################################
+CONVERGENCE_YEARS = [2**k for k in range(10, 18)]   # record lengths compared (each estimate uses all windows of the record)
+CONVERGENCE_REPLICATES = 8                          # independent records per sampling & record length
+CONVERGENCE_SAMPLINGS = ['mc', 'qmc']
+CONVERGENCE_BASELINE_YEARS = functions_policy_evaluation.NUM_LINES_STOCHASTIC_INPUT + 1   # record length of baseline (mc) estimate
+CONVERGENCE_ROOT_SEED = 2024                        # replicate r uses streams spawned from (CONVERGENCE_ROOT_SEED, r)
+
+
+
+
+##################################################################
+#### Replicate records & objective estimates
+##################################################################
+
+### (nYears, 3) moea inputs (revenue, payoutCfd & power, as synthetic_data.txt) for replicate record with sampling, from its own
+###   stream (after burn in, so every row has a power price index), with fixed calibration
+def get_replicate_record(models, calibration, nYears, replicate, sampling='mc', root_seed=CONVERGENCE_ROOT_SEED):
+  synthetic_data = functions_synthetic_streaming.get_parallel_synthetic_data_chunk(models, calibration, (root_seed, replicate), 0, 0,
+                                                                                   nYears, sampling)
+  return synthetic_data[functions_stochastic_inputs.SYNTHETIC_DATA_COLUMNS].values
+
+
+
+### lines_to_use for every 20-year window of record with nYears (same convention as sample plan: first line is 1)
+def get_all_windows(nYears, ny=functions_policy_evaluation.NUM_YEARS):
+  return np.arange(1, nYears - ny + 1)
+
+
+
+### lines_to_use for num_samples windows drawn uniformly with replacement from record with nYears (as get_lines_to_use)
+def get_random_windows(nYears, num_samples, replicate, root_seed=CONVERGENCE_ROOT_SEED, ny=functions_policy_evaluation.NUM_YEARS):
+  random_state = np.random.default_rng(np.random.SeedSequence((root_seed, replicate)))
+  return random_state.integers(1, nYears - ny + 1, num_samples)
+
+
+
+### table of objective estimates (minimized, as evaluate_objectives) of rows of dvs for each sampling, record length in years &
+###   replicate, over all windows of each record. If baseline_years is given, also adds estimates from num_samples random windows
+###   of mc records with baseline_years (sampling 'baseline'), as the moea evaluates objectives.
+def run_sampling_convergence(models, calibration, dvs, params, years=CONVERGENCE_YEARS, replicates=CONVERGENCE_REPLICATES,
+                             samplings=CONVERGENCE_SAMPLINGS, baseline_years=CONVERGENCE_BASELINE_YEARS,
+                             num_samples=functions_policy_evaluation.NUM_SAMPLES, dps_run_type=None,
+                             num_objectives=functions_moea_output_plots.NUM_OBJECTIVES):
+  objective_names = functions_policy_evaluation.get_objective_names(dps_run_type, num_objectives)
+  runs = [(sampling, nYears) for sampling in samplings for nYears in years]
+  if baseline_years is not None:
+    runs.append(('baseline', baseline_years))
+  rows = []
+  for sampling, nYears in runs:
+    for replicate in range(replicates):
+      record = get_replicate_record(models, calibration, nYears, replicate, 'mc' if sampling == 'baseline' else sampling)
+      if sampling == 'baseline':
+        lines_to_use = get_random_windows(nYears, num_samples, replicate)
+      else:
+        lines_to_use = get_all_windows(nYears)
+      objs = functions_policy_evaluation.evaluate_objectives(dvs, record, lines_to_use, params, dps_run_type, num_objectives)[0]
+      table = pd.DataFrame(objs, columns=objective_names)
+      table.insert(0, 'policy', np.arange(objs.shape[0]))
+      table.insert(0, 'replicate', replicate)
+      table.insert(0, 'windows', len(lines_to_use))
+      table.insert(0, 'years', nYears)
+      table.insert(0, 'sampling', sampling)
+      rows.append(table)
+  return pd.concat(rows, ignore_index=True)
+
+
+
+
+##################################################################
+#### Estimate error & equivalent record length
+##################################################################
+
+### estimate error for each sampling, record length & objective: standard deviation across replicates for each policy, then
+###   root mean square over policies. Returns table indexed by (sampling, years, windows) with one column per objective.
+def get_convergence_error(results):
+  objective_names = [c for c in results.columns if c not in ['sampling', 'years', 'windows', 'replicate', 'policy']]
+  error = results.groupby(['sampling', 'years', 'windows', 'policy'])[objective_names].std(ddof=1)
+  return np.sqrt((error ** 2).groupby(level=['sampling', 'years', 'windows']).mean())
+
+
+
+### power law fit error = scale * years^-rate (least squares in log-log, over record lengths with nonzero error) for each
+###   sampling (except baseline) & objective. Returns table indexed by (sampling, objective) with rate & scale.
+def get_convergence_rates(error):
+  rows = []
+  for sampling in [s for s in error.index.get_level_values('sampling').unique() if s != 'baseline']:
+    e = error.xs(sampling, level='sampling')
+    years = e.index.get_level_values('years').values.astype(float)
+    for objective in e.columns:
+      use = e[objective].values > 0
+      if use.sum() > 1:
+        slope, intercept = np.polyfit(np.log(years[use]), np.log(e[objective].values[use]), 1)
+        rows.append({'sampling': sampling, 'objective': objective, 'rate': -slope, 'scale': np.exp(intercept)})
+      else:
+        rows.append({'sampling': sampling, 'objective': objective, 'rate': np.nan, 'scale': np.nan})
+  return pd.DataFrame(rows).set_index(['sampling', 'objective'])
+
+
+
+### record length (years, all windows evaluated) each sampling needs to reach the baseline estimate error, for each objective,
+###   from the power law fits of get_convergence_rates. Returns table indexed by objective, with baseline error & windows, and
+###   rate & equivalent years for each sampling (NaN if baseline error is 0 or error doesn't fall with record length, e.g. fund
+###   rarely used by these policies).
+def get_equivalent_years(error, rates):
+  baseline = error.xs('baseline', level='sampling')
+  table = pd.DataFrame({'baseline_error': baseline.iloc[0], 'baseline_windows': baseline.index.get_level_values('windows')[0]})
+  table.index.name = 'objective'
+  for sampling in rates.index.get_level_values('sampling').unique():
+    r = rates.xs(sampling, level='sampling').reindex(table.index)
+    table[sampling + '_rate'] = r['rate']
+    table[sampling + '_years'] = (r['scale'] / table['baseline_error'].where(table['baseline_error'] > 0)) ** \
+                                 (1 / r['rate'].where(r['rate'] > 0))
+  return table
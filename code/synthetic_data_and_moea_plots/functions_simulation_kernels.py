@@ -0,0 +1,196 @@
+##############################################################################################################
+### functions_simulation_kernels.py - compiled (numba) kernels for simulating dps policies, used by simulate_batch in
+###     functions_moea_output_plots & get_sample_metrics in functions_policy_evaluation when SIMULATION_BACKEND is 'numba'.
+###     numba is optional: if it isn't installed, the numpy versions are used instead. Kernels loop over samples in parallel and
+###     repeat the floating point operations of the numpy versions in the same order, so results are bit-for-bit identical
+###     whenever numpy's exp comes from the system math library (as in main.cpp). On CPUs where numpy dispatches its own AVX512
+###     exp, that can differ in the last bit, so results agree to ~1e-14 instead (NPY_DISABLE_CPU_FEATURES="AVX512F AVX512_SKX"
+###     restores exact agreement).
+##############################################################################################################
+import os
+import numpy as np
+
+try:
+  import numba
+  HAS_NUMBA = True
+  prange = numba.prange
+  # parallel kernels run before forking worker processes (multiprocessing Pool/ProcessPoolExecutor) can hang at exit with the tbb
+  #   threading layer, so default to workqueue unless set with NUMBA_THREADING_LAYER
+  if 'NUMBA_THREADING_LAYER' not in os.environ:
+    numba.config.THREADING_LAYER = 'workqueue'
+except ImportError:
+  HAS_NUMBA = False
+  prange = range
+
+
+
+### compile function with numba if installed, else leave as python function
+def jit(parallel=False):
+  def decorator(f):
+    if HAS_NUMBA:
+      return numba.njit(parallel=parallel, cache=True)(f)
+    else:
+      return f
+  return decorator
+
+
+
+### True if compiled kernels should be used for backend ('numba' or 'numpy')
+def use_compiled(backend):
+  if backend not in ['numba', 'numpy']:
+    raise ValueError('Unknown simulation backend: ' + str(backend))
+  return (backend == 'numba') and HAS_NUMBA
+
+
+
+
+##################################################################
+#### RBF policy decisions for single state, as rbf_hedge & rbf_withdrawal in functions_moea_output_plots
+#### (policy arrays for one policy: centers & inv_radii_sq (decision, rbf, input), weights (decision, rbf), dv_a & dv_d (decision))
+##################################################################
+@jit()
+def rbf_hedge_scalar(centers, inv_radii_sq, weights, dv_a, dv_d, f_fund_balance, f_debt, f_power_price_index, useinrbf,
+                     normalize_fund, normalize_power_price, normalize_snow_contract_size):
+  decision_order = 0
+  input_0 = f_fund_balance * useinrbf[0] / normalize_fund
+  input_1 = f_debt * useinrbf[1] / normalize_fund
+  input_2 = f_power_price_index * useinrbf[2] / normalize_power_price
+  value = 0.
+  for i in range(centers.shape[1]):
+    # sum RBFs
+    arg_exp = 0. - (input_0 - centers[decision_order, i, 0]) ** 2 * inv_radii_sq[decision_order, i, 0]
+    arg_exp = arg_exp - (input_1 - centers[decision_order, i, 1]) ** 2 * inv_radii_sq[decision_order, i, 1]
+    arg_exp = arg_exp - (input_2 - centers[decision_order, i, 2]) ** 2 * inv_radii_sq[decision_order, i, 2]
+    value = value + weights[decision_order, i] * np.exp(arg_exp)
+  # add constant term & scale to [0, normalize_snow_contract_size]
+  value = max(min((value + dv_a[decision_order]) * normalize_snow_contract_size, normalize_snow_contract_size), 0.)
+  # enforce minimum contract size
+  if value < dv_d[decision_order] * normalize_snow_contract_size:
+    value = 0.
+  return value
+
+
+
+@jit()
+def rbf_withdrawal_scalar(centers, inv_radii_sq, weights, dv_a, dv_d, f_fund_balance, f_debt, f_power_price_index, f_cash_in, useinrbf,
+                          normalize_fund, normalize_power_price, normalize_revenue, eps):
+  decision_order = 1
+  input_0 = f_fund_balance * useinrbf[0] / normalize_fund
+  input_1 = f_debt * useinrbf[1] / normalize_fund
+  input_2 = f_power_price_index * useinrbf[2] / normalize_power_price
+  input_3 = (f_cash_in * useinrbf[3] + normalize_revenue) / (2 * normalize_revenue)
+  cash_out = 0.
+  for i in range(centers.shape[1]):
+    # sum RBFs
+    arg_exp = 0. - (input_0 - centers[decision_order, i, 0]) ** 2 * inv_radii_sq[decision_order, i, 0]
+    arg_exp = arg_exp - (input_1 - centers[decision_order, i, 1]) ** 2 * inv_radii_sq[decision_order, i, 1]
+    arg_exp = arg_exp - (input_2 - centers[decision_order, i, 2]) ** 2 * inv_radii_sq[decision_order, i, 2]
+    arg_exp = arg_exp - (input_3 - centers[decision_order, i, 3]) ** 2 * inv_radii_sq[decision_order, i, 3]
+    cash_out = cash_out + weights[decision_order, i] * np.exp(arg_exp)
+  # add constant term
+  cash_out = cash_out + dv_a[decision_order]
+  # now scale back to [-normalize_revenue, normalize_revenue]
+  cash_out = max(min((cash_out * 2 * normalize_revenue) - normalize_revenue, normalize_revenue), -normalize_revenue)
+  # now write as withdrawal for policy return
+  withdrawal = cash_out - f_cash_in
+  # ensure that cant withdraw more than fund balance, or deposit more than cash flow
+  if withdrawal > eps:
+    withdrawal = min(withdrawal, f_fund_balance)
+  elif withdrawal < -eps:
+    withdrawal = max(withdrawal, -max(f_cash_in, 0.))
+  # ensure that (fund balance - withdrawal (+ deposit)) isnt larger than max fund size
+  max_fund = dv_d[decision_order] * normalize_fund
+  if (f_fund_balance - withdrawal) > max_fund:
+    withdrawal = f_fund_balance - max_fund
+  return withdrawal
+
+
+
+
+##################################################################
+#### Simulation kernels
+##################################################################
+
+### trajectories for one dps policy over (n_samples, ny+1) sample windows, as dps version of simulate_batch. Returns fund & debt
+###   (n_samples, ny+1), and cash_in, value_snow_contract, withdrawal, final_cashflow (n_samples, ny).
+@jit(parallel=True)
+def simulate_dps_kernel(net_rev, payout, power, centers, inv_radii_sq, weights, dv_a, dv_d, useinrbf_hedge, useinrbf_withdrawal,
+                        interest_fund, interest_debt, normalize_fund, normalize_power_price, normalize_revenue,
+                        normalize_snow_contract_size, eps):
+  ns = net_rev.shape[0]
+  ny = net_rev.shape[1] - 1
+  fund = np.zeros((ns, ny + 1))
+  debt = np.zeros((ns, ny + 1))
+  final_cashflow = np.zeros((ns, ny))
+  withdrawal = np.zeros((ns, ny))
+  value_snow_contract = np.zeros((ns, ny))
+  cash_in = np.zeros((ns, ny))
+  for s in prange(ns):
+    for i in range(ny):
+      value_snow_contract[s, i] = rbf_hedge_scalar(centers, inv_radii_sq, weights, dv_a, dv_d, fund[s, i], debt[s, i], power[s, i],
+                                                   useinrbf_hedge, normalize_fund, normalize_power_price, normalize_snow_contract_size)
+      net_payout_snow_contract = value_snow_contract[s, i] * payout[s, i+1]
+      cash_in[s, i] = net_rev[s, i+1] + net_payout_snow_contract - debt[s, i] * interest_debt
+      withdrawal[s, i] = rbf_withdrawal_scalar(centers, inv_radii_sq, weights, dv_a, dv_d, fund[s, i] * interest_fund,
+                                               debt[s, i] * interest_debt, power[s, i+1], cash_in[s, i], useinrbf_withdrawal,
+                                               normalize_fund, normalize_power_price, normalize_revenue, eps)
+      final_cashflow[s, i] = cash_in[s, i] + withdrawal[s, i]
+      fund[s, i+1] = fund[s, i] * interest_fund - withdrawal[s, i]
+      if final_cashflow[s, i] < -eps:
+        debt[s, i+1] = -final_cashflow[s, i]
+        final_cashflow[s, i] = 0.
+  return fund, debt, cash_in, value_snow_contract, withdrawal, final_cashflow
+
+
+
+### per-sample objective metrics for bank of dps policies (policy arrays with leading policy axis) over (n_samples, ny+1)
+###   sample windows, as dps version of get_sample_metrics. net_rev & net_payout already adjusted for cost_fraction &
+###   lambda_prem_shift. useinrbf_hedge (3) & useinrbf_withdrawal (4) are input masks. If no_debt (DPS_RUN_TYPE 2), negative
+###   cash flows are not covered by debt. Returns annualized_cashflow, max_debt, debt_steal, min_cashflow, hedge_frequency,
+###   max_fund_balance, each (n_policies, n_samples).
+@jit(parallel=True)
+def sample_metrics_dps_kernel(net_rev, net_payout, power, centers, inv_radii_sq, weights, dv_a, dv_d, useinrbf_hedge,
+                              useinrbf_withdrawal, discount_factor, discount_normalization, interest_fund, interest_debt, no_debt,
+                              normalize_fund, normalize_power_price, normalize_revenue, normalize_snow_contract_size, eps):
+  npol = centers.shape[0]
+  ns = net_rev.shape[0]
+  ny = net_rev.shape[1] - 1
+  annualized_cashflow = np.zeros((npol, ns))
+  max_debt = np.zeros((npol, ns))
+  debt_steal = np.zeros((npol, ns))
+  min_cashflow = np.full((npol, ns), np.inf)
+  hedge_frequency = np.zeros((npol, ns))
+  max_fund_balance = np.zeros((npol, ns))
+  for k in prange(npol * ns):
+    p = k // ns
+    s = k % ns
+    fund_balance = 0.
+    debt = 0.
+    debt_prev = 0.
+    for i in range(ny):
+      snow_contract_slope = rbf_hedge_scalar(centers[p], inv_radii_sq[p], weights[p], dv_a[p], dv_d[p], fund_balance, debt,
+                                             power[s, i], useinrbf_hedge, normalize_fund, normalize_power_price,
+                                             normalize_snow_contract_size)
+      if abs(snow_contract_slope) > eps:
+        hedge_frequency[p, s] = 1.
+      cash_in = net_rev[s, i+1] + snow_contract_slope * net_payout[s, i+1] - debt * interest_debt
+      fund_withdrawal = rbf_withdrawal_scalar(centers[p], inv_radii_sq[p], weights[p], dv_a[p], dv_d[p], fund_balance * interest_fund,
+                                              debt * interest_debt, power[s, i+1], cash_in, useinrbf_withdrawal, normalize_fund,
+                                              normalize_power_price, normalize_revenue, eps)
+      adjusted_revenue = cash_in + fund_withdrawal
+      debt_prev = debt
+      if not no_debt:
+        if adjusted_revenue < -eps:
+          debt = -adjusted_revenue
+          adjusted_revenue = 0.
+        else:
+          debt = 0.
+      fund_balance = fund_balance * interest_fund - fund_withdrawal
+      annualized_cashflow[p, s] += adjusted_revenue * discount_factor[i]
+      max_fund_balance[p, s] = max(max_fund_balance[p, s], fund_balance)
+      max_debt[p, s] = max(max_debt[p, s], debt)
+      min_cashflow[p, s] = min(min_cashflow[p, s], adjusted_revenue)
+    annualized_cashflow[p, s] = discount_normalization * (annualized_cashflow[p, s] + ((fund_balance * interest_fund * discount_factor[0]) -
+                                                                                      (debt * interest_debt * discount_factor[0])) * discount_factor[ny - 1])
+    debt_steal[p, s] = debt - debt_prev
+  return annualized_cashflow, max_debt, debt_steal, min_cashflow, hedge_frequency, max_fund_balance
@@ -0,0 +1,251 @@
+##############################################################################################################
+### functions_stochastic_inputs.py - python functions for storing & sharing the stochastic inputs used by the moea
+###     (synthetic_data.txt: revenue, snow contract payout, power price index) between processes without copying, including
+###     a self-describing binary version of synthetic_data.txt (synthetic_data.bin) that is memory-mapped by python & main.cpp.
+##############################################################################################################
+import os
+import sys
+import json
+import mmap
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+
+##################################################################
+#### Constants
+##################################################################
+SYNTHETIC_DATA_COLUMNS = ['revenue', 'payoutCfd', 'power']   # columns of synthetic_data.txt, in order used by moea
+SYNTHETIC_DATA_MAGIC = 1145985363     # binary synthetic data header (int64 values): magic ('SYND'), version, data offset, num rows,
+SYNTHETIC_DATA_VERSION = 1            #   num columns, provenance offset & size, 1 unused. Then for each column: name (null padded
+SYNTHETIC_DATA_HEADER_SIZE = 8        #   to SYNTHETIC_DATA_NAME_SIZE bytes), numpy dtype (8 bytes, e.g. '<f8') & int64 file offset.
+SYNTHETIC_DATA_NAME_SIZE = 32         #   Then provenance (utf-8 json). Columns are contiguous, one after another from data offset
+SYNTHETIC_DATA_ALIGNMENT = 4096       #   (a multiple of this, so page aligned). Same format read by main.cpp with SYNTHETIC_DATA_MODE 1.
+STORAGE_PRECISIONS = {'float64': np.float64, 'float32': np.float32}   # float dtype of stored values, for each storage precision
+SYNTHETIC_DATA_NAME = 'synthetic_data'   # synthetic data file name (.bin or .txt) in generated inputs directory
+ANTITHETIC_SUFFIX = '_antithetic'   # suffix of file name of antithetic twin of synthetic data (e.g. synthetic_data_antithetic.bin)
+CALENDAR_COLUMNS = ['wyr', 'wmnth', 'wyear']   # integer-valued columns, stored as smallest int type holding them in compact storage
+
+
+
+
+##################################################################
+#### Sharing arrays between processes
+####   Shared memory blocks need python 3.8+ (multiprocessing.shared_memory is imported only where used, so scripts that
+####   don't share arrays still run on older versions).
+##################################################################
+
+
+
+### copy array into new shared memory block. Returns block (keep a reference until done, then release_shared_array with
+###   unlink=True) and spec that other processes pass to attach_array.
+def share_array(x):
+  from multiprocessing import shared_memory
+  x = np.ascontiguousarray(x)
+  shm = shared_memory.SharedMemory(create=True, size=max(x.nbytes, 1))
+  view = np.ndarray(x.shape, dtype=x.dtype, buffer=shm.buf)
+  view[...] = x
+  return shm, {'shm_name': shm.name, 'shape': x.shape, 'dtype': x.dtype.str}
+
+
+
+### save array as .npy file that other processes can memory-map. Returns spec for attach_array.
+def save_array_memmap(filename, x):
+  np.save(filename, np.ascontiguousarray(x))
+  return {'filename': filename}
+
+
+
+### spec for attach_array of array memory-mapped directly from a file (e.g. from get_synthetic_data_array), or None if x isn't one
+###   (other arrays, or views of memmaps)
+def get_memmap_spec(x):
+  if isinstance(x, np.memmap) and isinstance(x.base, mmap.mmap) and (x.flags.c_contiguous or x.flags.f_contiguous):
+    return {'memmap_file': x.filename, 'offset': x.offset, 'shape': x.shape, 'dtype': x.dtype.str,
+            'order': 'C' if x.flags.c_contiguous else 'F'}
+  return None
+
+
+
+### read-only, zero-copy view of array from spec (shared memory block from share_array, .npy file from save_array_memmap, or
+###   memory-mapped file from get_memmap_spec). Returns shared memory block (None for memmap; keep a reference as long as the
+###   view is used) and array.
+def attach_array(spec):
+  if 'shm_name' in spec:
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=spec['shm_name'])
+    x = np.ndarray(spec['shape'], dtype=np.dtype(spec['dtype']), buffer=shm.buf)
+    x.flags.writeable = False
+    return shm, x
+  elif 'memmap_file' in spec:
+    return None, np.memmap(spec['memmap_file'], dtype=np.dtype(spec['dtype']), mode='r', offset=spec['offset'],
+                           shape=tuple(spec['shape']), order=spec['order'])
+  else:
+    return None, np.load(spec['filename'], mmap_mode='r')
+
+
+
+### close shared memory block, and free it if unlink (only by process that created it, once no longer used anywhere)
+def release_shared_array(shm, unlink=False):
+  if shm is not None:
+    shm.close()
+    if unlink:
+      shm.unlink()
+
+
+
+
+##################################################################
+#### Storage precision: float64 (default), or compact float32 with int8/int16 calendar columns
+##################################################################
+
+### storage dtype of column values x at precision: float dtype of precision for float columns, and for calendar columns in compact
+###   storage (precision other than float64), the smallest signed int type (int8, int16, int32, int64) that holds their values
+def get_storage_dtype(x, precision='float64', calendar=False):
+  x = np.asarray(x)
+  if calendar and (precision != 'float64'):
+    low, high = (np.min(x), np.max(x)) if x.size > 0 else (0, 0)
+    for d in [np.int8, np.int16, np.int32, np.int64]:
+      if (np.iinfo(d).min <= low) and (high <= np.iinfo(d).max):
+        return np.dtype(d)
+  if np.issubdtype(x.dtype, np.floating):
+    return np.dtype(STORAGE_PRECISIONS[precision])
+  return x.dtype
+
+
+
+### copy of dataframe (e.g. sweSynth, genSynth, powSynth) stored at precision: for float32, float columns as float32 & calendar
+###   columns (CALENDAR_COLUMNS, e.g. wyr & wmnth) as int8/int16/int32, about halving memory & i/o
+def compact_frame(df, precision='float32'):
+  return pd.DataFrame({c: df[c].values.astype(get_storage_dtype(df[c].values, precision, c in CALENDAR_COLUMNS)) for c in df.columns},
+                      index=df.index)
+
+
+
+
+##################################################################
+#### Binary synthetic data (see SYNTHETIC_DATA_MAGIC for format)
+##################################################################
+
+### provenance of synthetic data (dict saved in binary header): generator (e.g. script name) & its settings, plus date & versions
+def get_synthetic_data_provenance(generator, **settings):
+  provenance = {'generator': generator, 'created': datetime.now().isoformat(timespec='seconds'),
+                'python': sys.version.split()[0], 'numpy': np.__version__, 'pandas': pd.__version__}
+  provenance.update(settings)
+  return provenance
+
+
+
+### create binary synthetic data file with num_rows rows of columns (names, with numpy dtypes, default float64) & provenance
+###   (dict, see get_synthetic_data_provenance). Returns dict of writable memmaps for columns, to be filled by caller.
+def create_synthetic_data_binary(filename, columns, num_rows, dtypes=None, provenance=None):
+  if dtypes is None:
+    dtypes = [np.float64] * len(columns)
+  dtypes = [np.dtype(d) for d in dtypes]
+  provenance_bytes = json.dumps({} if provenance is None else provenance, default=str).encode()
+  provenance_offset = 8 * SYNTHETIC_DATA_HEADER_SIZE + (SYNTHETIC_DATA_NAME_SIZE + 16) * len(columns)
+  data_offset = int(np.ceil((provenance_offset + len(provenance_bytes)) / SYNTHETIC_DATA_ALIGNMENT)) * SYNTHETIC_DATA_ALIGNMENT
+  offsets = []
+  end = data_offset
+  for d in dtypes:
+    end = int(np.ceil(end / d.itemsize)) * d.itemsize
+    offsets.append(end)
+    end += num_rows * d.itemsize
+
+  header = np.array([SYNTHETIC_DATA_MAGIC, SYNTHETIC_DATA_VERSION, data_offset, num_rows, len(columns), provenance_offset,
+                     len(provenance_bytes), 0], dtype='<i8').tobytes()
+  for name, d, offset in zip(columns, dtypes, offsets):
+    if len(name.encode()) >= SYNTHETIC_DATA_NAME_SIZE:
+      raise ValueError('Column name too long for synthetic data file: ' + name)
+    header += name.encode().ljust(SYNTHETIC_DATA_NAME_SIZE, b'\0') + d.str.encode().ljust(8, b'\0') + \
+              np.array([offset], dtype='<i8').tobytes()
+  with open(filename, 'wb') as f:
+    f.write(header + provenance_bytes)
+    f.truncate(max(end, data_offset))
+  return {name: np.memmap(filename, dtype=d, mode='r+', offset=offset, shape=(num_rows,))
+          for name, d, offset in zip(columns, dtypes, offsets)}
+
+
+
+### save synthetic data (dataframe, e.g. as written to synthetic_data.txt) as binary file, with provenance, at storage precision
+###   (see get_storage_dtype; float32 halves the file, and readers convert values back to float64 for computation)
+def save_synthetic_data_binary(filename, synthetic_data, provenance=None, precision='float64'):
+  dtypes = [get_storage_dtype(synthetic_data[c].values, precision, c in CALENDAR_COLUMNS) for c in synthetic_data.columns]
+  columns = create_synthetic_data_binary(filename, list(synthetic_data.columns), synthetic_data.shape[0], dtypes, provenance)
+  for name, x in columns.items():
+    x[:] = synthetic_data[name].values
+    x.flush()
+
+
+
+### header of binary synthetic data file: dict with num_rows, columns (names), dtypes, offsets & provenance (dict)
+def read_synthetic_data_header(filename):
+  with open(filename, 'rb') as f:
+    fields = np.frombuffer(f.read(8 * SYNTHETIC_DATA_HEADER_SIZE), dtype='<i8')
+    if (fields.size < SYNTHETIC_DATA_HEADER_SIZE) or (fields[0] != SYNTHETIC_DATA_MAGIC) or (fields[1] != SYNTHETIC_DATA_VERSION):
+      raise ValueError('Not a synthetic data file (or unsupported version): ' + filename)
+    num_rows, num_columns, provenance_offset, provenance_size = [int(x) for x in fields[3:7]]
+    columns, dtypes, offsets = [], [], []
+    for i in range(num_columns):
+      descriptor = f.read(SYNTHETIC_DATA_NAME_SIZE + 16)
+      columns.append(descriptor[:SYNTHETIC_DATA_NAME_SIZE].rstrip(b'\0').decode())
+      dtypes.append(np.dtype(descriptor[SYNTHETIC_DATA_NAME_SIZE:(SYNTHETIC_DATA_NAME_SIZE + 8)].rstrip(b'\0').decode()))
+      offsets.append(int(np.frombuffer(descriptor[-8:], dtype='<i8')[0]))
+    f.seek(provenance_offset)
+    provenance = json.loads(f.read(provenance_size).decode()) if provenance_size > 0 else {}
+  return {'num_rows': num_rows, 'columns': columns, 'dtypes': dtypes, 'offsets': offsets, 'provenance': provenance}
+
+
+
+### read-only memmaps of columns of binary synthetic data file (dict of column name -> array), and header
+def open_synthetic_data_binary(filename):
+  header = read_synthetic_data_header(filename)
+  columns = {name: np.memmap(filename, dtype=d, mode='r', offset=offset, shape=(header['num_rows'],))
+             for name, d, offset in zip(header['columns'], header['dtypes'], header['offsets'])}
+  return columns, header
+
+
+
+### (num_rows, len(columns)) read-only array of columns from binary synthetic data file. Zero-copy memmap (shared by all
+###   processes reading the file, and in stored dtype, e.g. float32) if columns are stored one after another with the same
+###   dtype, else copied into memory.
+def get_synthetic_data_array(filename, columns=SYNTHETIC_DATA_COLUMNS):
+  header = read_synthetic_data_header(filename)
+  index = [header['columns'].index(c) for c in columns]
+  d, nbytes = header['dtypes'][index[0]], header['num_rows'] * header['dtypes'][index[0]].itemsize
+  if all((header['dtypes'][i] == d) and (header['offsets'][i] == header['offsets'][index[0]] + k * nbytes) for k, i in enumerate(index)):
+    return np.memmap(filename, dtype=d, mode='r', offset=header['offsets'][index[0]], shape=(header['num_rows'], len(columns)),
+                     order='F')
+  data = open_synthetic_data_binary(filename)[0]
+  return np.column_stack([data[c] for c in columns])
+
+
+
+### file name of antithetic twin of synthetic data file (ANTITHETIC_SUFFIX before extension)
+def get_antithetic_filename(filename):
+  base, extension = os.path.splitext(filename)
+  return base + ANTITHETIC_SUFFIX + extension
+
+
+
+### True if dir_generated_inputs has synthetic_data.bin at least as new as synthetic_data.txt (or txt missing), so it's read instead
+###   (name gives other synthetic data files, e.g. synthetic_data_antithetic)
+def use_synthetic_data_binary(dir_generated_inputs, name=SYNTHETIC_DATA_NAME):
+  binary_file, text_file = dir_generated_inputs + name + '.bin', dir_generated_inputs + name + '.txt'
+  return os.path.exists(binary_file) and ((not os.path.exists(text_file)) or (os.path.getmtime(binary_file) >= os.path.getmtime(text_file)))
+
+
+
+### synthetic data (dataframe with revenue, payoutCfd & power, as float64) from dir_generated_inputs: synthetic_data.bin if
+###   current (see use_synthetic_data_binary), else synthetic_data.txt (or other synthetic data file name)
+def read_synthetic_data(dir_generated_inputs, name=SYNTHETIC_DATA_NAME):
+  if use_synthetic_data_binary(dir_generated_inputs, name):
+    data = open_synthetic_data_binary(dir_generated_inputs + name + '.bin')[0]
+    return pd.DataFrame({column: np.array(x, dtype=float) for column, x in data.items()})
+  return pd.read_csv(dir_generated_inputs + name + '.txt', delimiter=' ')
+
+
+
+### write binary synthetic data file as text (synthetic_data.txt format)
+def export_synthetic_data_text(binary_file, text_file):
+  data = open_synthetic_data_binary(binary_file)[0]
+  pd.DataFrame({name: np.array(x, dtype=float) for name, x in data.items()}).to_csv(text_file, sep=' ', index=False)
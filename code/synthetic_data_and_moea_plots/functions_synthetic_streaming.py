@@ -0,0 +1,281 @@
+##############################################################################################################
+### functions_synthetic_streaming.py - streaming generation of the moea inputs (synthetic_data.txt: revenue, cfd payout, power
+###     price index) in chunks of years, so memory is bounded by the chunk size rather than the number of years. Uses the same
+###     models as functions_synthetic_data & functions_revenues_contracts (swe, gen, power price, revenue), fitted once. Random
+###     states and the AR(1,3) & SARMA filter states are carried across chunks, so the monthly series don't depend on chunk size.
+###     Quantities that make_synthetic_data_plots.py fits to the whole sample (swe index weights, cfd strike/cap/premiums, power
+###     price index weights & regression) are calibrated once on the first calibration years of the stream, then applied to
+###     every chunk. Parallel mode (root_seed given): each chunk gets its own random streams spawned from root_seed & chunk number
+###     (numpy SeedSequence), warms up its AR/SARMA states with a burn in, and is generated on a pool of processes. Output then
+###     depends on root_seed & chunk size, but not on the number of processes. With sampling 'qmc', swe copula draws & gen/power
+###     price innovations in each chunk come from scrambled Sobol point sets (see functions_synthetic_data.sample_qmc_normal), so
+###     output also depends on chunk size in sequential mode. An antithetic twin of a record (same random states & calibration,
+###     with every copula draw & innovation mirrored) can be written alongside it, for antithetic estimates of the objectives.
+##############################################################################################################
+import multiprocessing
+import numpy as np
+import pandas as pd
+import statsmodels.formula.api as sm
+
+### Project functions ###
+import functions_synthetic_data
+import functions_revenues_contracts
+import functions_model_cache
+import functions_stochastic_inputs
+
+
+##################################################################
+#### Constants
+##################################################################
+STREAM_CHUNK_YEARS = 100000         # years generated per chunk
+STREAM_CALIBRATION_YEARS = 100000   # years used to calibrate swe index, cfd & power price index
+STREAM_SEEDS = {'swe': 1, 'gen': 2, 'power': 3}   # same seeds as synthetic_swe, synthetic_generation & synthetic_power
+POWER_BURN_YEARS = 3                # years of SARMA burn in after last historical year, as synthetic_power
+CHUNK_BURN_YEARS = 10               # years of AR(1,3) & SARMA burn in for each chunk in parallel mode
+CFD_PARAMS = {'lambdaRisk': 0.25, 'strikeQuantile': 0.5, 'capQuantile': 0.95}   # as make_synthetic_data_plots.py
+
+
+
+
+##################################################################
+#### Streams of monthly synthetic data
+##################################################################
+
+### fitted swe, gen, power price & revenue models from historical data, through model cache as the in-memory functions
+def fit_synthetic_models(swe, gen, power, hp_GWh, hp_dolPerKwh):
+  return {'swe': functions_model_cache.cached_fit('swe', functions_synthetic_data.fit_swe_model, swe),
+          'gen': functions_model_cache.cached_fit('gen', functions_synthetic_data.fit_generation_model, gen),
+          'power': functions_model_cache.cached_fit('power', functions_synthetic_data.fit_power_model, power),
+          'revenue': functions_model_cache.cached_fit('revenue', functions_revenues_contracts.fit_revenue_model, gen, hp_GWh,
+                                                      hp_dolPerKwh)}
+
+
+
+### random states for sequential stream: numpy RandomState for each stage, seeded as the in-memory functions
+def get_random_states(seeds=STREAM_SEEDS):
+  return {stage: np.random.RandomState(seeds[stage]) for stage in ['swe', 'gen', 'power']}
+
+
+
+### random states for chunk in parallel mode: numpy Generator for each stage, from streams spawned from root_seed for chunk
+###   (independent of the number of chunks or processes)
+def get_chunk_random_states(root_seed, chunk):
+  stages = ['swe', 'gen', 'power']
+  seeds = np.random.SeedSequence(root_seed, spawn_key=(chunk,)).spawn(len(stages))
+  return {stage: np.random.default_rng(seed) for stage, seed in zip(stages, seeds)}
+
+
+
+### new stream (dict of random states, filter states, last year's monthly power price & next water year), after burn in. Gen
+###   starts from 3 random deseasonalized residuals and gen_burn_months of burn in (including those 3), and power price from last
+###   historical year and power_burn_months of burn in. Defaults are as the in-memory functions: swe & power price streams give
+###   the same values as synthetic_swe & synthetic_power with the same seeds, and gen draws its 3 starting values before (rather
+###   than after) the residuals, so it is statistically but not numerically the same as synthetic_generation. Keeps monthly power
+###   price of last burn in year, for power price index of first year. sampling ('mc' or 'qmc') is used for chunks (burn in is
+###   always pseudo-random). If antithetic, all draws (burn in & chunks) are mirrored, giving the antithetic twin of the stream
+###   with the same random states.
+def start_synthetic_stream(models, random_states, gen_burn_months=12, power_burn_months=POWER_BURN_YEARS * 12, wyr=0,
+                           sampling='mc', antithetic=False):
+  genModel, powModel = models['gen'], models['power']
+  stream = {'wyr': wyr, 'powPriceLast': None, 'sampling': sampling, 'antithetic': antithetic}
+  for stage in ['swe', 'gen', 'power']:
+    stream[stage + 'Random'] = random_states[stage]
+  residSDeInit = functions_synthetic_data.sample_innovations(genModel['AR_mean'], genModel['AR_std'], 3, stream['genRandom'],
+                                                             antithetic=antithetic)
+  residSDeAR = functions_synthetic_data.sample_innovations(genModel['AR_mean'], genModel['AR_std'], gen_burn_months,
+                                                           stream['genRandom'], antithetic=antithetic)
+  stream['genState'] = functions_synthetic_data.filter_generation_residuals(
+    genModel, residSDeAR[3:], functions_synthetic_data.get_generation_filter_state(genModel, residSDeInit))[1]
+  resid = functions_synthetic_data.sample_innovations(0, powModel['logDeERRSTD'], power_burn_months, stream['powerRandom'],
+                                                      antithetic=antithetic)
+  logDe, stream['powerState'] = functions_synthetic_data.filter_power_residuals(powModel, resid, powModel['logDeState'])
+  if power_burn_months >= 12:
+    stream['powPriceLast'] = functions_synthetic_data.get_power_frame(powModel, [wyr - 1], logDe[-12:]).powPrice.values
+  return stream
+
+
+
+### new stream for chunk in parallel mode (see get_chunk_random_states), after burn_years of burn in, starting at water year wyr
+def start_chunk_stream(models, root_seed, chunk, wyr=0, burn_years=CHUNK_BURN_YEARS, sampling='mc', antithetic=False):
+  return start_synthetic_stream(models, get_chunk_random_states(root_seed, chunk), 12 * burn_years, 12 * burn_years, wyr, sampling,
+                                antithetic)
+
+
+
+### next nYears of stream: swe (annual), gen, power price & revenue (monthly), as sweSynth, genSynth, powSynth & revSim from
+###   the in-memory functions, and monthly power price of year before (None if unknown). Updates stream in place.
+def get_synthetic_chunk(models, stream, nYears):
+  genModel, powModel, revModel = models['gen'], models['power'], models['revenue']
+  powPriceLast = stream['powPriceLast']
+  wyr = np.arange(stream['wyr'], stream['wyr'] + nYears)
+  sweSynth = functions_synthetic_data.sample_swe(models['swe'], nYears, stream['sweRandom'], stream['sampling'], stream['antithetic'])
+
+  residSDeAR = functions_synthetic_data.sample_innovations(genModel['AR_mean'], genModel['AR_std'], 12 * nYears, stream['genRandom'],
+                                                          stream['sampling'], stream['antithetic'])
+  residSDe, stream['genState'] = functions_synthetic_data.filter_generation_residuals(genModel, residSDeAR, stream['genState'])
+  genSynth = functions_synthetic_data.get_generation_frame(genModel, wyr, sweSynth.danFeb.values, sweSynth.danApr.values, residSDe)
+
+  resid = functions_synthetic_data.sample_innovations(0, powModel['logDeERRSTD'], 12 * nYears, stream['powerRandom'],
+                                                      stream['sampling'], stream['antithetic'])
+  logDe, stream['powerState'] = functions_synthetic_data.filter_power_residuals(powModel, resid, stream['powerState'])
+  powSynth = functions_synthetic_data.get_power_frame(powModel, wyr, logDe)
+
+  revSim = functions_revenues_contracts.revenue_model_milDollars(genSynth.gen, powSynth.powPrice / 1000, revModel['dem_M_GWh'],
+                                                                 revModel['mtidFrac'], revModel['rate_DolPerkWh_M'],
+                                                                 revModel['rate_DolPerkWh_mtid'])
+  stream['wyr'] += nYears
+  stream['powPriceLast'] = powSynth.powPrice.values[-12:]
+  return sweSynth, genSynth, powSynth, revSim, powPriceLast
+
+
+
+### generator of (sweSynth, genSynth, powSynth, revSim, powPriceLast) chunks of up to chunkYears years, nYears in total. Sequential
+###   stream with seeds if root_seed is None, else each chunk from its own stream (parallel mode, same chunks as workers).
+def generate_synthetic_chunks(models, nYears, chunkYears=STREAM_CHUNK_YEARS, seeds=STREAM_SEEDS, root_seed=None, sampling='mc',
+                              antithetic=False):
+  if root_seed is None:
+    stream = start_synthetic_stream(models, get_random_states(seeds), sampling=sampling, antithetic=antithetic)
+  for chunk, start in enumerate(range(0, nYears, chunkYears)):
+    if root_seed is not None:
+      stream = start_chunk_stream(models, root_seed, chunk, start, sampling=sampling, antithetic=antithetic)
+    yield get_synthetic_chunk(models, stream, min(chunkYears, nYears - start))
+
+
+
+
+##################################################################
+#### Calibration & annual moea inputs
+##################################################################
+
+### calibration of swe index, cfd & power price index (dict), as in make_synthetic_data_plots.py & power_price_index, from first
+###   calibrationYears of stream (sequential with seeds, or parallel mode chunks if root_seed given)
+def calibrate_synthetic_index(models, calibrationYears=STREAM_CALIBRATION_YEARS, chunkYears=STREAM_CHUNK_YEARS,
+                              seeds=STREAM_SEEDS, root_seed=None, sampling='mc'):
+  chunks = [(sweSynth, genSynth.gen.values.reshape(-1, 12), powSynth.powPrice.values.reshape(-1, 12),
+             revSim.values.reshape(-1, 12).sum(axis=1))
+            for sweSynth, genSynth, powSynth, revSim, powPriceLast in
+            generate_synthetic_chunks(models, calibrationYears, chunkYears, seeds, root_seed, sampling)]
+  sweSynth = pd.concat([c[0] for c in chunks]).reset_index(drop=True)
+  genSynth, powPrice, revSimWyr = [np.concatenate([c[i] for c in chunks]) for i in range(1, 4)]
+
+  ## regression for swe index
+  lmRevSWE = sm.ols(formula='rev ~ sweFeb + sweApr', data=pd.DataFrame(
+    {'rev': revSimWyr, 'sweFeb': sweSynth.danFeb.values, 'sweApr': sweSynth.danApr.values}))
+  lmRevSWE = lmRevSWE.fit()
+  sweWtParams = [lmRevSWE.params[1]/(lmRevSWE.params[1]+lmRevSWE.params[2]), lmRevSWE.params[2]/(lmRevSWE.params[1]+lmRevSWE.params[2])]
+  sweWtSynth = (sweWtParams[0] * sweSynth.danFeb + sweWtParams[1] * sweSynth.danApr)
+
+  ## cfd: put with risk loading plus short call capped at capQuantile, both struck at strikeQuantile
+  strike = sweWtSynth.quantile(CFD_PARAMS['strikeQuantile'])
+  cap = sweWtSynth.quantile(CFD_PARAMS['capQuantile'])
+  premPut = functions_revenues_contracts.wang(pd.DataFrame({'asset': sweWtSynth, 'prob': 1 / calibrationYears}), contractType='put',
+                                              lam=CFD_PARAMS['lambdaRisk'], k=strike, premOnly=True)
+  premShortCall = functions_revenues_contracts.wang(pd.DataFrame({'asset': sweWtSynth, 'prob': 1 / calibrationYears}),
+                                                    contractType='shortcall', lam=0, k=strike, cap=cap, premOnly=True)
+
+  ## power price index: gen-weighted annual power price, predicted from last year's & last Sept's price
+  genExcessAvg = np.mean(genSynth - models['revenue']['dem_M_GWh'], axis=0)
+  genWeights = genExcessAvg / genExcessAvg.sum()
+  pwyr = np.sum(powPrice * genWeights, axis=1)
+  psep = powPrice[:, 11]
+  lmPswp = sm.ols(formula='ln_pwyr0 ~ ln_pwyr1 + ln_psep1',
+                  data=pd.DataFrame({'ln_pwyr0': np.log(pwyr[1:]), 'ln_pwyr1': np.log(pwyr[:-1]), 'ln_psep1': np.log(psep[:-1])}))
+  lmPswp = lmPswp.fit()
+
+  return {'sweWtParams': sweWtParams, 'strike': strike, 'cap': cap, 'premPut': premPut, 'premShortCall': premShortCall,
+          'genWeights': genWeights, 'lmPswpParams': lmPswp.params.values, 'lmPswpResidVar': np.var(lmPswp.resid)}
+
+
+
+### annual moea inputs (dataframe with revenue, payoutCfd & power, as synthetic_data.txt) for chunk of stream, given calibration.
+###   powPriceLast is monthly power price of year before chunk (None gives NaN power price index in first year).
+def get_synthetic_data_chunk(calibration, sweSynth, powSynth, revSim, powPriceLast=None):
+  sweWt = calibration['sweWtParams'][0] * sweSynth.danFeb.values + calibration['sweWtParams'][1] * sweSynth.danApr.values
+  k, cap = calibration['strike'], calibration['cap']
+  payoutCfd = (np.maximum(k - sweWt, 0) - calibration['premPut']) + \
+              (np.maximum(-np.maximum(sweWt - k, 0), -(cap - k)) - calibration['premShortCall'])
+
+  powPrice = powSynth.powPrice.values.reshape(-1, 12)
+  if powPriceLast is None:
+    powPrice = np.concatenate([np.full((1, 12), np.nan), powPrice])
+  else:
+    powPrice = np.concatenate([np.reshape(powPriceLast, (1, 12)), powPrice])
+  pwyr = np.sum(powPrice * calibration['genWeights'], axis=1)
+  psep = powPrice[:, 11]
+  params = calibration['lmPswpParams']
+  powerIndex = (pwyr[:-1] ** params[1]) * (psep[:-1] ** params[2]) * np.exp(params[0]) * np.exp(calibration['lmPswpResidVar'] / 2)
+
+  return pd.DataFrame({'revenue': revSim.values.reshape(-1, 12).sum(axis=1), 'payoutCfd': payoutCfd, 'power': powerIndex})
+
+
+
+### annual moea inputs for chunk in parallel mode (chunk number chunk, nYears from water year start), from its own stream
+def get_parallel_synthetic_data_chunk(models, calibration, root_seed, chunk, start, nYears, sampling='mc', antithetic=False):
+  stream = start_chunk_stream(models, root_seed, chunk, start, sampling=sampling, antithetic=antithetic)
+  sweSynth, genSynth, powSynth, revSim, powPriceLast = get_synthetic_chunk(models, stream, nYears)
+  return get_synthetic_data_chunk(calibration, sweSynth, powSynth, revSim, powPriceLast)
+
+
+
+### generator of annual moea inputs (dataframes, as get_synthetic_data_chunk) for nYears, chunkYears at a time, given calibration.
+###   If root_seed is None, chunks come in turn from one sequential stream with seeds, and the first year is dropped (same format
+###   as save_synthetic_data_moea, whose first year has no power price index). Else chunks are generated in parallel mode on a pool
+###   of nprocs processes (default one per core), a few chunks per process at a time, and yielded in order. If antithetic, chunks
+###   are the antithetic twins of those generated without (same seeds & calibration, mirrored draws).
+def generate_synthetic_data_chunks(models, calibration, nYears, chunkYears=STREAM_CHUNK_YEARS, seeds=STREAM_SEEDS, root_seed=None,
+                                   nprocs=None, sampling='mc', antithetic=False):
+  if root_seed is None:
+    chunks = generate_synthetic_chunks(models, nYears, chunkYears, seeds, sampling=sampling, antithetic=antithetic)
+    for chunk, (sweSynth, genSynth, powSynth, revSim, powPriceLast) in enumerate(chunks):
+      synthetic_data = get_synthetic_data_chunk(calibration, sweSynth, powSynth, revSim, powPriceLast)
+      yield synthetic_data.iloc[1:, :] if chunk == 0 else synthetic_data
+  else:
+    if nprocs is None:
+      nprocs = multiprocessing.cpu_count()
+    tasks = [(models, calibration, root_seed, chunk, start, min(chunkYears, nYears - start), sampling, antithetic)
+             for chunk, start in enumerate(range(0, nYears, chunkYears))]
+    with multiprocessing.Pool(nprocs) as pool:
+      for wave in range(0, len(tasks), 4 * nprocs):
+        for synthetic_data in pool.starmap(get_parallel_synthetic_data_chunk, tasks[wave:(wave + 4 * nprocs)]):
+          yield synthetic_data
+
+
+
+### write chunks (annual moea inputs, as generate_synthetic_data_chunks) with num_rows rows in total to synthetic_file: binary
+###   (see functions_stochastic_inputs, with provenance, values stored at precision) if synthetic_file ends with .bin, else text
+def write_synthetic_data_chunks(synthetic_file, chunks, num_rows, provenance=None, precision='float64'):
+  if synthetic_file.endswith('.bin'):
+    columns = functions_stochastic_inputs.create_synthetic_data_binary(
+      synthetic_file, functions_stochastic_inputs.SYNTHETIC_DATA_COLUMNS, num_rows,
+      [functions_stochastic_inputs.STORAGE_PRECISIONS[precision]] * len(functions_stochastic_inputs.SYNTHETIC_DATA_COLUMNS), provenance)
+    row = 0
+    for synthetic_data in chunks:
+      for name, x in columns.items():
+        x[row:(row + synthetic_data.shape[0])] = synthetic_data[name].values
+      row += synthetic_data.shape[0]
+    for x in columns.values():
+      x.flush()
+  else:
+    with open(synthetic_file, 'w') as f:
+      for chunk, synthetic_data in enumerate(chunks):
+        synthetic_data.to_csv(f, sep=' ', index=False, header=(chunk == 0))
+
+
+
+### stream nYears of moea inputs to synthetic_file, chunkYears at a time, after calibrating on first calibrationYears (chunks as
+###   generate_synthetic_data_chunks). Written as binary (see functions_stochastic_inputs, with settings & calibration as
+###   provenance, values stored at precision) if synthetic_file ends with .bin, else as text. sampling ('mc' or 'qmc') is used
+###   for calibration & all chunks. If antithetic, its antithetic twin (same calibration) is also streamed to the file named by
+###   functions_stochastic_inputs.get_antithetic_filename. Returns calibration.
+def stream_synthetic_data(models, synthetic_file, nYears, chunkYears=STREAM_CHUNK_YEARS, calibrationYears=STREAM_CALIBRATION_YEARS,
+                          seeds=STREAM_SEEDS, root_seed=None, nprocs=None, precision='float64', sampling='mc', antithetic=False):
+  calibration = calibrate_synthetic_index(models, min(calibrationYears, nYears), chunkYears, seeds, root_seed, sampling)
+  for twin in ([False, True] if antithetic else [False]):
+    provenance = functions_stochastic_inputs.get_synthetic_data_provenance(
+      'make_synthetic_data_streaming.py', n_years=nYears, chunk_years=chunkYears, calibration_years=min(calibrationYears, nYears),
+      seeds=seeds, root_seed=root_seed, sampling=sampling, antithetic=twin,
+      calibration={k: np.asarray(v).tolist() for k, v in calibration.items()})
+    chunks = generate_synthetic_data_chunks(models, calibration, nYears, chunkYears, seeds, root_seed, nprocs, sampling, twin)
+    write_synthetic_data_chunks(functions_stochastic_inputs.get_antithetic_filename(synthetic_file) if twin else synthetic_file,
+                                chunks, nYears - (root_seed is None), provenance, precision)
+  return calibration
@@ -9,6 +9,7 @@ from datetime import datetime
 ### Project functions ###
 import functions_moea_output_plots
 import functions_entropic_SA
+import functions_stochastic_inputs
 
 startTime = datetime.now()
 
@@ -36,7 +37,7 @@ fig_format = 'jpg'
 dps = functions_moea_output_plots.get_set(dir_data + 'optimization_output/4obj_2rbf_moreSeeds/DPS_4obj_2rbf_moreSeeds_borg_retest.resultfile', 4, 1, sort=False)[0]
 
 ### stochastic data
-samp = pd.read_csv(dir_data + 'generated_inputs/synthetic_data.txt', delimiter=' ')
+samp = functions_stochastic_inputs.read_synthetic_data(dir_data + 'generated_inputs/')
 
 ### data from entropic SA (after running calculate_entropic_SA.py & consolidate_SA_output.py)
 mi = pd.read_csv(dir_data + 'policy_simulation/4obj/mi_combined.csv', index_col=0).sort_index()
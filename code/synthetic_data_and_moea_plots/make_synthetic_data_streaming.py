@@ -0,0 +1,49 @@
+######################################################################
+### make_synthetic_data_streaming.py - generate moea inputs (synthetic_data.txt format: revenue, cfd payout, power price index)
+###     for any number of years with bounded memory, chunk_years at a time, calibrating the swe index, cfd & power price index on
+###     the first calibration_years (see functions_synthetic_streaming.py). If root_seed is given, chunks are generated in
+###     parallel on nprocs processes (default one per core), each from its own seed stream, so output depends on root_seed &
+###     chunk_years but not nprocs. If synthetic_file ends with .bin, it is written in the binary format read by main.cpp &
+###     functions_policy_evaluation (see functions_stochastic_inputs.py), with values stored at precision (float64 or float32),
+###     else as text. root_seed None gives the sequential stream. sampling is mc (pseudo-random, default) or qmc (scrambled Sobol
+###     copula draws & innovations). If antithetic is 1, the antithetic twin of the record (same seeds & calibration, mirrored
+###     draws) is also written, to synthetic_file with _antithetic before its extension (e.g. synthetic_data_antithetic.bin), for
+###     the antithetic estimator (ESTIMATOR_ANTITHETIC in main.cpp, retest_policies.py).
+### usage: python make_synthetic_data_streaming.py n_years synthetic_file [chunk_years] [calibration_years] [root_seed] [nprocs] [precision] [sampling] [antithetic]
+######################################################################
+import sys
+from datetime import datetime
+
+### Project functions ###
+import functions_clean_data
+import functions_synthetic_streaming
+
+startTime = datetime.now()
+
+dir_downloaded_inputs = './../../data/downloaded_inputs/'
+
+n_years = int(sys.argv[1])
+synthetic_file = sys.argv[2]
+chunk_years = int(sys.argv[3]) if len(sys.argv) > 3 else functions_synthetic_streaming.STREAM_CHUNK_YEARS
+calibration_years = int(sys.argv[4]) if len(sys.argv) > 4 else functions_synthetic_streaming.STREAM_CALIBRATION_YEARS
+root_seed = int(sys.argv[5]) if (len(sys.argv) > 5) and (sys.argv[5] != 'None') else None
+nprocs = int(sys.argv[6]) if len(sys.argv) > 6 else None
+precision = sys.argv[7] if len(sys.argv) > 7 else 'float64'
+sampling = sys.argv[8] if len(sys.argv) > 8 else 'mc'
+antithetic = (int(sys.argv[9]) == 1) if len(sys.argv) > 9 else False
+
+### Get and clean data
+swe = functions_clean_data.get_clean_swe(dir_downloaded_inputs)
+gen = functions_clean_data.get_historical_generation(dir_downloaded_inputs, swe).reset_index()
+power = functions_clean_data.get_historical_power(dir_downloaded_inputs)
+hp_GWh, hp_dolPerKwh, hp_dolM = functions_clean_data.get_historical_SFPUC_sales()
+
+### Fit models & stream synthetic data
+print('Fitting models..., ', datetime.now() - startTime)
+models = functions_synthetic_streaming.fit_synthetic_models(swe, gen, power, hp_GWh, hp_dolPerKwh)
+print('Streaming synthetic data..., ', datetime.now() - startTime)
+functions_synthetic_streaming.stream_synthetic_data(models, synthetic_file, n_years, chunk_years, calibration_years,
+                                                    root_seed=root_seed, nprocs=nprocs, precision=precision,
+                                                    sampling=sampling, antithetic=antithetic)
+
+print('Finished, output to ' + synthetic_file, datetime.now() - startTime)
@@ -0,0 +1,28 @@
+######################################################################
+### race_policies.py - screen policies in a borg .set file against a reference set with racing evaluation (samples in
+###     increasing batches, stopping early for policies dominated by the reference set with high confidence).
+### usage: python race_policies.py seed_sample LHC_set set_file race_file reference_file [dps_run_type] [num_objectives]
+######################################################################
+import sys
+from datetime import datetime
+
+### Project functions ###
+import functions_moea_output_plots
+import functions_policy_evaluation
+
+startTime = datetime.now()
+
+seed_sample = int(sys.argv[1])
+LHC_set = int(sys.argv[2])
+set_file = sys.argv[3]
+race_file = sys.argv[4]
+reference_file = sys.argv[5]
+dps_run_type = int(sys.argv[6]) if len(sys.argv) > 6 else functions_moea_output_plots.DPS_RUN_TYPE
+num_objectives = int(sys.argv[7]) if len(sys.argv) > 7 else functions_moea_output_plots.NUM_OBJECTIVES
+
+dvs, objs, constraints, samples_used, dominated = functions_policy_evaluation.race_set(set_file, race_file, reference_file, seed_sample,
+                                                                                      LHC_set, dps_run_type, num_objectives)
+
+print(str(dvs.shape[0]) + ' policies raced, ' + str(dominated.sum()) + ' dropped as dominated, ' +
+      str(round(samples_used.sum() / (dvs.shape[0] * functions_policy_evaluation.NUM_SAMPLES) * 100, 1)) + '% of samples used, output to ' +
+      race_file, datetime.now() - startTime)
@@ -0,0 +1,33 @@
+######################################################################
+### report_precision.py - error in objectives of policies in a borg .set file when synthetic stochastic inputs are stored
+###     at reduced precision (e.g. float32 synthetic_data.bin from convert_synthetic_data.py), compared to borg epsilons.
+### usage: python report_precision.py seed_sample LHC_set set_file report_file [precision] [dps_run_type] [num_objectives]
+######################################################################
+import sys
+import numpy as np
+from datetime import datetime
+
+### Project functions ###
+import functions_moea_output_plots
+import functions_policy_evaluation
+import functions_stochastic_inputs
+
+startTime = datetime.now()
+
+seed_sample = int(sys.argv[1])
+LHC_set = int(sys.argv[2])
+set_file = sys.argv[3]
+report_file = sys.argv[4]
+precision = sys.argv[5] if len(sys.argv) > 5 else 'float32'
+dps_run_type = int(sys.argv[6]) if len(sys.argv) > 6 else functions_moea_output_plots.DPS_RUN_TYPE
+num_objectives = int(sys.argv[7]) if len(sys.argv) > 7 else functions_moea_output_plots.NUM_OBJECTIVES
+
+dvs, report = functions_policy_evaluation.report_precision_set(set_file, report_file, seed_sample, LHC_set, precision,
+                                                               dps_run_type, num_objectives)
+
+print(report.to_string())
+num_bytes = functions_policy_evaluation.NUM_LINES_STOCHASTIC_INPUT * len(functions_stochastic_inputs.SYNTHETIC_DATA_COLUMNS)
+itemsize = np.dtype(functions_stochastic_inputs.STORAGE_PRECISIONS[precision]).itemsize
+print('stochastic inputs: ' + str(round(num_bytes * 8 / 2**20, 1)) + ' MB in float64, ' + str(round(num_bytes * itemsize / 2**20, 1)) +
+      ' MB in ' + precision)
+print(str(dvs.shape[0]) + ' policies evaluated, report output to ' + report_file, datetime.now() - startTime)
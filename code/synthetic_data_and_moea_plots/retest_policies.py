@@ -0,0 +1,31 @@
+######################################################################
+### retest_policies.py - re-evaluate policies in a borg .set file with python version of portfolioProblem, as main.cpp
+###     with BORG_RUN_TYPE 0, but without recompiling for each formulation. antithetic & control_variate (0/1) select the
+###     variance-reduced estimators (as ESTIMATOR_* in main.cpp; antithetic needs synthetic_data_antithetic from
+###     make_synthetic_data_streaming.py). Estimator variance of each objective is written to retest_file.variance.
+### usage: python retest_policies.py seed_sample LHC_set set_file retest_file [dps_run_type] [num_objectives] [nprocs] [antithetic] [control_variate]
+######################################################################
+import sys
+from datetime import datetime
+
+### Project functions ###
+import functions_moea_output_plots
+import functions_policy_evaluation
+
+startTime = datetime.now()
+
+seed_sample = int(sys.argv[1])
+LHC_set = int(sys.argv[2])
+set_file = sys.argv[3]
+retest_file = sys.argv[4]
+dps_run_type = int(sys.argv[5]) if len(sys.argv) > 5 else functions_moea_output_plots.DPS_RUN_TYPE
+num_objectives = int(sys.argv[6]) if len(sys.argv) > 6 else functions_moea_output_plots.NUM_OBJECTIVES
+nprocs = int(sys.argv[7]) if len(sys.argv) > 7 else None
+antithetic = (int(sys.argv[8]) == 1) if len(sys.argv) > 8 else False
+control_variate = (int(sys.argv[9]) == 1) if len(sys.argv) > 9 else False
+
+dvs, objs, constraints = functions_policy_evaluation.retest_set(set_file, retest_file, seed_sample, LHC_set, dps_run_type,
+                                                                num_objectives, nprocs, antithetic=antithetic,
+                                                                control_variate=control_variate)
+
+print(str(dvs.shape[0]) + ' policies retested, output to ' + retest_file, datetime.now() - startTime)
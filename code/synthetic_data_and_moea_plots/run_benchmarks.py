@@ -0,0 +1,39 @@
+######################################################################
+### run_benchmarks.py - time hot paths of synthetic data generation, policy simulation, entropic SA & output loading at a
+###     scaled-down preset (small, medium, large; see BENCHMARK_PRESETS in functions_benchmarks.py), writing json results.
+###     If baseline_file exists, time per sample is compared against it & the script exits with status 1 on any regression;
+###     if it doesn't exist, the results are stored there as the new baseline. tolerance is the fraction slower than baseline
+###     that counts as a regression (default BENCHMARK_REGRESSION_TOLERANCE; raise it on noisy shared machines).
+### usage: python run_benchmarks.py preset output_file [baseline_file] [tolerance]
+######################################################################
+import os
+import sys
+from datetime import datetime
+
+### Project functions ###
+import functions_benchmarks
+
+startTime = datetime.now()
+
+preset = sys.argv[1]
+output_file = sys.argv[2]
+baseline_file = sys.argv[3] if len(sys.argv) > 3 else None
+tolerance = float(sys.argv[4]) if len(sys.argv) > 4 else functions_benchmarks.BENCHMARK_REGRESSION_TOLERANCE
+
+results = functions_benchmarks.run_benchmarks(preset)
+functions_benchmarks.save_benchmarks(results, output_file)
+for name, entry in results['benchmarks'].items():
+  print('%-22s %10.4f s  %12.1f samples/s' % (name, entry['seconds'], entry['samples_per_second']))
+print('Benchmarks finished, output to ' + output_file, datetime.now() - startTime)
+
+if baseline_file is not None:
+  if os.path.exists(baseline_file):
+    comparison = functions_benchmarks.compare_benchmarks(results, functions_benchmarks.read_benchmarks(baseline_file), tolerance)
+    print(comparison.to_string(index=False))
+    if comparison.regression.any():
+      print('Regressions (> ' + str(int(tolerance * 100)) + '% slower than ' +
+            baseline_file + '): ' + ', '.join(comparison.benchmark.loc[comparison.regression]))
+      sys.exit(1)
+  else:
+    functions_benchmarks.save_benchmarks(results, baseline_file)
+    print('No baseline found, results stored as baseline ' + baseline_file)
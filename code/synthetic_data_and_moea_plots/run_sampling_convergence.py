@@ -0,0 +1,59 @@
+######################################################################
+### run_sampling_convergence.py - convergence study of objective estimates for policies in a borg .set file, with mc &
+###     qmc (scrambled Sobol) synthetic records of increasing length, against the error of today's estimate (NUM_SAMPLES
+###     windows of a 1M year mc record). See functions_sampling_convergence.py. Writes output_prefix_objectives.csv (estimates for
+###     every replicate), output_prefix_error.csv (error by record length) & output_prefix_equivalent.csv (record length each
+###     sampling needs for the baseline error).
+### usage: python run_sampling_convergence.py set_file output_prefix [LHC_set] [replicates] [max_years] [dps_run_type] [num_objectives]
+######################################################################
+import sys
+from datetime import datetime
+
+### Project functions ###
+import functions_clean_data
+import functions_moea_output_plots
+import functions_policy_evaluation
+import functions_sampling_convergence
+import functions_synthetic_streaming
+
+startTime = datetime.now()
+
+dir_downloaded_inputs = './../../data/downloaded_inputs/'
+dir_generated_inputs = './../../data/generated_inputs/'
+
+set_file = sys.argv[1]
+output_prefix = sys.argv[2]
+LHC_set = int(sys.argv[3]) if len(sys.argv) > 3 else functions_policy_evaluation.NUM_PARAM_SAMPLES - 1
+replicates = int(sys.argv[4]) if len(sys.argv) > 4 else functions_sampling_convergence.CONVERGENCE_REPLICATES
+max_years = int(sys.argv[5]) if len(sys.argv) > 5 else max(functions_sampling_convergence.CONVERGENCE_YEARS)
+dps_run_type = int(sys.argv[6]) if len(sys.argv) > 6 else functions_moea_output_plots.DPS_RUN_TYPE
+num_objectives = int(sys.argv[7]) if len(sys.argv) > 7 else functions_moea_output_plots.NUM_OBJECTIVES
+
+### Get and clean data, fit models & calibrate (once, with mc stream, so only record sampling differs between runs)
+swe = functions_clean_data.get_clean_swe(dir_downloaded_inputs)
+gen = functions_clean_data.get_historical_generation(dir_downloaded_inputs, swe).reset_index()
+power = functions_clean_data.get_historical_power(dir_downloaded_inputs)
+hp_GWh, hp_dolPerKwh, hp_dolM = functions_clean_data.get_historical_SFPUC_sales()
+print('Fitting models & calibrating..., ', datetime.now() - startTime)
+models = functions_synthetic_streaming.fit_synthetic_models(swe, gen, power, hp_GWh, hp_dolPerKwh)
+calibration = functions_synthetic_streaming.calibrate_synthetic_index(models)
+
+### Objective estimates for replicate records
+num_dv = functions_moea_output_plots.NUM_DV if dps_run_type > 0 else 2
+dvs = functions_policy_evaluation.get_set_dvs(set_file, num_dv)
+params = functions_policy_evaluation.get_financial_params(functions_policy_evaluation.get_param_samples(dir_generated_inputs), LHC_set)
+years = [y for y in functions_sampling_convergence.CONVERGENCE_YEARS if y <= max_years]
+print('Estimating objectives..., ', datetime.now() - startTime)
+results = functions_sampling_convergence.run_sampling_convergence(models, calibration, dvs, params, years, replicates,
+                                                                  dps_run_type=dps_run_type, num_objectives=num_objectives)
+results.to_csv(output_prefix + '_objectives.csv', index=False)
+
+### Error & equivalent record lengths
+error = functions_sampling_convergence.get_convergence_error(results)
+error.to_csv(output_prefix + '_error.csv')
+equivalent = functions_sampling_convergence.get_equivalent_years(error, functions_sampling_convergence.get_convergence_rates(error))
+equivalent.to_csv(output_prefix + '_equivalent.csv')
+print(error.to_string())
+print(equivalent.to_string())
+
+print('Finished, output to ' + output_prefix + '_*.csv', datetime.now() - startTime)